@@ -0,0 +1,192 @@
+"""
+Single entry point of the project scripts.
+
+    python auto_digger.py <command> [arguments of the command]
+
+Each command runs the `__main__` block of its script, with the arguments that
+follow the command name. Only the standard library is imported here, so the
+cost of a command is the imports of its own script. Scripts of the
+`tracks_similarity` and `tracks_match` folders run with their folder on the
+path, as they import their siblings by name.
+
+`python auto_digger.py startup` measures how long `<command> --help` takes for
+each command, lists the slowest imports of each one, and exits with status 1
+when a command is over the startup budget.
+"""
+
+import os
+import re
+import runpy
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# command: (script relative to the repository root, description)
+COMMANDS = {
+    "features": ("track_feature_extraction.py", "extract the features of an audio file"),
+    "build-dataset": ("build_dataset.py", "build the features CSV of a folder of tracks"),
+    "similar": ("most_similar.py", "find the closest tracks by features"),
+    "explore": ("explore_features.py", "plot the features dataset"),
+    "cache": ("feature_cache.py", "inspect the feature cache"),
+    "discogs": ("parse_discogs_data.py", "explore and extract a Discogs dump"),
+    "release-store": ("release_store.py", "load a Discogs dump into SQLite"),
+    "select": ("select_candidates.py", "select download candidates from the release store"),
+    "download": ("track_download/dl_all_tracks.py", "download the tracks of a queue"),
+    "ingest": ("ingest.py", "download and extract features in one pipeline"),
+    "serve": ("similarity_server.py", "serve similarity queries with warm data"),
+    "query": ("similarity_client.py", "query a running similarity service"),
+    "tags": ("tracks_similarity/tag_index.py", "index the class comment tags of tracks"),
+    "triplets": ("tracks_similarity/triplet_dataset.py", "generate triplets from tags"),
+    "training-data": ("tracks_similarity/generate_training_data.py", "write siamese training data"),
+    "siamese": ("tracks_similarity/similarity.py", "siamese model similarity"),
+    "benchmark": ("benchmarks/suite.py", "benchmark the hot paths on synthetic data"),
+    "fast-report": ("benchmarks/segment_sampling.py", "compare fast features to full-track ones"),
+    "label": ("tracks_match/dataset_maker.py", "label pairs of tracks (Streamlit app)"),
+}
+
+# commands run by another program than python
+STREAMLIT_COMMANDS = {"label"}
+
+STARTUP_BUDGET = 1.0  # seconds of `<command> --help`
+
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run_command(command: str, argv: list[str]):
+    """
+    Runs the script of a command as `__main__` with the given arguments.
+    """
+    script = os.path.join(ROOT_DIR, COMMANDS[command][0])
+    folder = os.path.dirname(script)
+
+    if command in STREAMLIT_COMMANDS:
+        sys.exit(
+            subprocess.call([sys.executable, "-m", "streamlit", "run", script, "--", *argv])
+        )
+
+    for path in (ROOT_DIR, folder):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    sys.argv = [script, *argv]
+    runpy.run_path(script, run_name="__main__")
+
+
+def parse_import_times(stderr: str) -> list[tuple[str, float]]:
+    """
+    Cumulative import time of each top level import of a `python -X importtime` run.
+
+    Returns:
+        list[tuple[str, float]]: The module names and their import time in seconds, slowest first.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+
+        # nested imports are indented under the import that triggered them
+        if match and len(match.group(3)) == 1:
+            imports.append((match.group(4), int(match.group(2)) / 1e6))
+
+    return sorted(imports, key=lambda item: item[1], reverse=True)
+
+
+def measure_startup(command: str) -> dict:
+    """
+    Runs `<command> --help` in a fresh interpreter and measures its startup.
+
+    Returns:
+        dict: The wall time in seconds, the exit code and the slowest top level imports.
+    """
+    start_time = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.abspath(__file__), command, "--help"],
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "seconds": elapsed,
+        "returncode": out.returncode,
+        "imports": parse_import_times(out.stderr),
+    }
+
+
+def startup_report(commands: list[str], budget: float = STARTUP_BUDGET, top: int = 5) -> bool:
+    """
+    Prints the startup time and slowest imports of each command.
+
+    Returns:
+        bool: Whether every command starts within the budget.
+    """
+    within_budget = True
+
+    for command in commands:
+        result = measure_startup(command)
+        over = result["seconds"] > budget or result["returncode"] != 0
+        within_budget &= not over
+
+        status = "OVER BUDGET" if over else "ok"
+        if result["returncode"] != 0:
+            status = f"FAILED ({result['returncode']})"
+
+        print(f"{command:<16} {result['seconds']:6.2f}s  {status}")
+        for module, seconds in result["imports"][:top]:
+            print(f"    {seconds:6.3f}s  {module}")
+
+    return within_budget
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="auto_digger",
+        description="Find niche music using raw audio data.",
+        epilog="Run `auto_digger <command> --help` for the arguments of a command.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    for command, (_, description) in COMMANDS.items():
+        # the script of the command parses its own arguments
+        subparsers.add_parser(command, help=description, add_help=False)
+
+    startup_parser = subparsers.add_parser(
+        "startup", help="report the startup time and imports of each command"
+    )
+    startup_parser.add_argument(
+        "commands", nargs="*", help="Commands to measure, defaults to all python ones"
+    )
+    startup_parser.add_argument(
+        "--budget",
+        type=float,
+        default=STARTUP_BUDGET,
+        help="Maximum seconds of `<command> --help`",
+    )
+    startup_parser.add_argument(
+        "--top", type=int, default=5, help="Number of imports listed per command"
+    )
+
+    args, argv = parser.parse_known_args()
+
+    if args.command != "startup":
+        run_command(args.command, argv)
+        return
+
+    if argv:
+        parser.error(f"unrecognized arguments: {' '.join(argv)}")
+
+    commands = args.commands or [c for c in COMMANDS if c not in STREAMLIT_COMMANDS]
+    unknown = set(commands) - set(COMMANDS)
+    if unknown:
+        parser.error(f"unknown commands: {', '.join(sorted(unknown))}")
+
+    if not startup_report(commands, budget=args.budget, top=args.top):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmark of `build_feature_vector` against the original per-feature extraction.
+
+The original implementation recomputed an STFT or mel spectrogram for every
+spectral feature. It is kept here as a reference to measure the per-track speedup
+and to check that both paths agree.
+
+Usage: python -m benchmarks.feature_extraction <tracks_folder> [--limit N]
+"""
+
+import os
+import time
+
+import numpy as np
+import librosa
+
+from track_feature_extraction import SAMPLE_RATE, describe, features_from_signal
+
+
+def reference_features_from_signal(x: np.ndarray, sr: int) -> dict:
+    """
+    Builds a feature vector the way `build_feature_vector` originally did.
+
+    Args:
+        x (np.ndarray): The audio signal.
+        sr (int): The sample rate of the audio signal.
+
+    Returns:
+        dict: A dictionary containing the features of the audio signal.
+    """
+    out_vector: dict[str, float] = dict()
+
+    out_vector["tempo"] = librosa.feature.tempo(y=x, sr=sr)[0]
+    out_vector["rmse"] = np.sqrt(np.mean(x**2))
+    out_vector |= describe(np.fft.fftfreq(x.size), key_prefix="freqs_")
+    out_vector |= describe(
+        librosa.feature.zero_crossing_rate(x)[0], key_prefix="zero_crossing_rate_"
+    )
+    out_vector |= describe(
+        librosa.feature.spectral_centroid(y=x, sr=sr)[0],
+        key_prefix="spectral_centroids_",
+    )
+    out_vector |= describe(
+        librosa.feature.spectral_bandwidth(y=x, sr=sr)[0],
+        key_prefix="spectral_bandwidth_",
+    )
+    out_vector |= describe(
+        librosa.feature.spectral_contrast(y=x, sr=sr)[0],
+        key_prefix="spectral_contrast_",
+    )
+    out_vector |= describe(
+        librosa.feature.spectral_rolloff(y=x, sr=sr)[0],
+        key_prefix="spectral_rolloff_",
+    )
+    out_vector |= describe(
+        librosa.feature.spectral_flatness(y=x)[0], key_prefix="spectral_flatness_"
+    )
+    out_vector |= describe(librosa.feature.mfcc(y=x, sr=sr), key_prefix="mfcc_")
+
+    return out_vector
+
+
+def max_relative_difference(reference: dict, candidate: dict) -> float:
+    """
+    Returns the largest relative difference between two feature vectors.
+
+    Args:
+        reference (dict): The reference feature vector.
+        candidate (dict): The feature vector to compare, with the same keys.
+
+    Returns:
+        float: The largest `|reference - candidate| / max(|reference|, 1e-12)`.
+    """
+    if list(reference.keys()) != list(candidate.keys()):
+        raise ValueError("Feature vectors do not have the same keys")
+
+    a = np.fromiter(reference.values(), dtype=float)
+    b = np.fromiter(candidate.values(), dtype=float)
+
+    return float(np.max(np.abs(a - b) / np.maximum(np.abs(a), 1e-12)))
+
+
+def benchmark_track(audio_path: str) -> dict:
+    """
+    Times both extraction paths on one track, sharing the decoding step.
+
+    Args:
+        audio_path (str): The path to the audio file.
+
+    Returns:
+        dict: The duration of the track, the time of each path and the speedup.
+    """
+    x, sr = librosa.load(audio_path, sr=SAMPLE_RATE)
+
+    start_time = time.perf_counter()
+    reference = reference_features_from_signal(x, sr)
+    reference_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    shared = features_from_signal(x, sr)
+    shared_time = time.perf_counter() - start_time
+
+    return {
+        "audio": audio_path,
+        "duration": x.size / sr,
+        "reference_time": reference_time,
+        "shared_time": shared_time,
+        "speedup": reference_time / shared_time,
+        "max_relative_difference": max_relative_difference(reference, shared),
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compare the shared-STFT extraction to the original one."
+    )
+    parser.add_argument("tracks_folder", help="Path to a folder of audio tracks")
+    parser.add_argument(
+        "--limit", type=int, default=10, help="Number of tracks to benchmark"
+    )
+    args = parser.parse_args()
+
+    tracks = sorted(os.listdir(args.tracks_folder))[: args.limit]
+
+    results = []
+    for file_name in tracks:
+        result = benchmark_track(os.path.join(args.tracks_folder, file_name))
+        results.append(result)
+        print(
+            f"{file_name}: {result['duration']:.0f}s of audio, "
+            f"reference={result['reference_time']:.2f}s "
+            f"shared={result['shared_time']:.2f}s "
+            f"speedup=x{result['speedup']:.2f} "
+            f"max_rel_diff={result['max_relative_difference']:.2e}"
+        )
+
+    if results:
+        total_reference = sum(r["reference_time"] for r in results)
+        total_shared = sum(r["shared_time"] for r in results)
+        print(
+            f"total: reference={total_reference:.2f}s shared={total_shared:.2f}s "
+            f"speedup=x{total_reference / total_shared:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
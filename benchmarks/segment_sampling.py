@@ -0,0 +1,278 @@
+"""
+Accuracy report of the segment-sampled fast extraction mode against full tracks.
+
+For every setting of sample rate and segment length, the feature vectors of a
+library are built in fast mode and compared to the full-track vectors:
+
+- speed: extraction time of both modes on the first `--timing-tracks` tracks, uncached
+- features: median relative error of each feature, and its median absolute error in
+  standard deviations of the library, which is the scale `most_similar` compares on
+- rankings, over the `--k` closest tracks of each track by its full vector:
+    - `query_recall`: found by querying the full-track index with the fast vector,
+      as when screening a new candidate against the library
+    - `self_top1`: how often the fast vector finds its own track first in that index
+    - `index_recall`: found by querying an index built on fast vectors with the fast
+      vector, as when the whole library is screened in fast mode
+
+Vectors go through the feature cache, so running the report again with other
+settings only extracts what is missing.
+
+Usage: python -m benchmarks.segment_sampling <tracks_folder> [--sr 22050 11025] [--segment-seconds 10 20]
+"""
+
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from build_dataset import build_class_vector
+from feature_cache import cached_feature_vector
+from most_similar import FeatureIndex
+from track_feature_extraction import SegmentSampling, build_feature_vector, sample_rate_argument
+
+
+def features_dataframe(tracks: list[str], vectors: list[dict]) -> pd.DataFrame:
+    """
+    Lays feature vectors out like the dataset of build_dataset.py, for `FeatureIndex`.
+    """
+    return pd.DataFrame(
+        [
+            {"audio": file_name} | build_class_vector(file_name) | vector
+            for file_name, vector in zip(tracks, vectors)
+        ]
+    )
+
+
+def extraction_time(audio_paths: list[str], sampling: SegmentSampling = None) -> float:
+    """
+    Times the uncached extraction of some tracks.
+
+    Returns:
+        float: The mean number of seconds per track.
+    """
+    start_time = time.perf_counter()
+    for audio_path in audio_paths:
+        build_feature_vector(audio_path, sampling=sampling)
+
+    return (time.perf_counter() - start_time) / max(len(audio_paths), 1)
+
+
+def feature_errors(full: pd.DataFrame, fast: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compares the features of both modes, track by track.
+
+    Args:
+        full (pd.DataFrame): The full-track feature vectors, one row per track.
+        fast (pd.DataFrame): The fast-mode feature vectors of the same tracks.
+
+    Returns:
+        pd.DataFrame: The median `relative` error and the median error in library
+        standard deviations (`std_error`) of each feature, worst first.
+    """
+    difference = (fast - full).abs()
+    relative = difference / full.abs().clip(lower=1e-12)
+    std_error = difference / full.std(ddof=0).replace(0, np.nan)
+
+    errors = pd.DataFrame({"relative": relative.median(), "std_error": std_error.median()})
+
+    return errors.sort_values("std_error", ascending=False)
+
+
+def neighbours(index: FeatureIndex, vectors: np.ndarray, k: int) -> list[list[int]]:
+    """
+    Finds the `k` closest indexed rows of each vector, leaving out the row of the vector itself.
+    """
+    _, indices = index.query(vectors, k=k + 1)
+
+    return [[j for j in row if j != i][:k] for i, row in enumerate(indices)]
+
+
+def ranking_agreement(full_df: pd.DataFrame, fast_df: pd.DataFrame, k: int) -> dict:
+    """
+    Compares the `most_similar` rankings of the fast vectors to the full-track ones.
+
+    Args:
+        full_df (pd.DataFrame): The full-track dataset.
+        fast_df (pd.DataFrame): The fast-mode dataset, with the same rows.
+        k (int): The number of neighbours compared per track.
+
+    Returns:
+        dict: The mean `query_recall`, `self_top1` and `index_recall`.
+    """
+    full_index = FeatureIndex.build(full_df)
+    fast_index = FeatureIndex.build(fast_df)
+
+    full_vectors = full_df.iloc[:, 12:].values.astype(float)
+    fast_vectors = fast_df.iloc[:, 12:].values.astype(float)
+
+    reference = neighbours(full_index, full_vectors, k)
+    queried = neighbours(full_index, fast_vectors, k)
+    screened = neighbours(fast_index, fast_vectors, k)
+
+    _, closest = full_index.query(fast_vectors, k=1)
+
+    def recall(found: list[list[int]]) -> float:
+        return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(reference, found)]))
+
+    return {
+        "query_recall": recall(queried),
+        "self_top1": float(np.mean(closest[:, 0] == np.arange(len(full_df)))),
+        "index_recall": recall(screened),
+    }
+
+
+def report(
+    tracks_folder: str,
+    settings: list[SegmentSampling],
+    limit: int = None,
+    k: int = 5,
+    timing_tracks: int = 5,
+    verbose=False,
+) -> dict:
+    """
+    Measures the speed and accuracy of each fast extraction setting on a library.
+
+    Args:
+        tracks_folder (str): The folder of audio tracks.
+        settings (list[SegmentSampling]): The fast extraction settings to compare.
+        limit (int, optional): The number of tracks used. Defaults to every track.
+        k (int): The number of neighbours compared per track. Default is 5.
+        timing_tracks (int): The number of tracks extraction is timed on. Default is 5.
+        verbose (bool, optional): Whether to print progress messages. Defaults to False.
+
+    Returns:
+        dict: The `full` extraction time and a result per setting.
+    """
+    tracks = sorted(os.listdir(tracks_folder))[:limit]
+    audio_paths = [os.path.join(tracks_folder, file_name) for file_name in tracks]
+
+    if len(tracks) < 2:
+        raise ValueError("The report needs at least two tracks")
+    k = min(k, len(tracks) - 1)
+
+    if verbose:
+        print(f"Full-track features of {len(tracks)} tracks...")
+    full_df = features_dataframe(tracks, [cached_feature_vector(path) for path in audio_paths])
+    full_time = extraction_time(audio_paths[:timing_tracks])
+
+    results = []
+    for sampling in settings:
+        if verbose:
+            print(f"Fast features ({sampling.key()})...")
+
+        fast_df = features_dataframe(
+            tracks, [cached_feature_vector(path, sampling=sampling) for path in audio_paths]
+        )
+        fast_time = extraction_time(audio_paths[:timing_tracks], sampling)
+
+        errors = feature_errors(
+            full_df.iloc[:, 12:].astype(float), fast_df.iloc[:, 12:].astype(float)
+        )
+
+        results.append(
+            {
+                "sr": sampling.sr,
+                "positions": list(sampling.positions),
+                "segment_seconds": sampling.seconds,
+                "seconds_per_track": fast_time,
+                "speedup": full_time / fast_time,
+                "median_relative_error": float(errors["relative"].median()),
+                "median_std_error": float(errors["std_error"].median()),
+                "worst_features": errors.head(5).to_dict(orient="index"),
+                **ranking_agreement(full_df, fast_df, k),
+            }
+        )
+
+    return {
+        "tracks": len(tracks),
+        "k": k,
+        "full_seconds_per_track": full_time,
+        "settings": results,
+    }
+
+
+def main():
+    import argparse
+
+    defaults = SegmentSampling()
+
+    parser = argparse.ArgumentParser(
+        description="Compare fast segment-sampled features to full-track features."
+    )
+    parser.add_argument("tracks_folder", help="Path to a folder of audio tracks")
+    parser.add_argument(
+        "--limit", type=int, default=None, help="Number of tracks used, defaults to all"
+    )
+    parser.add_argument(
+        "--sr", type=sample_rate_argument, nargs="+", default=[defaults.sr], help="Sample rates to compare"
+    )
+    parser.add_argument(
+        "--segments",
+        type=float,
+        nargs="+",
+        default=defaults.positions,
+        help="Centre of each segment, as a fraction of the track duration",
+    )
+    parser.add_argument(
+        "--segment-seconds",
+        type=float,
+        nargs="+",
+        default=[defaults.seconds],
+        help="Segment lengths to compare",
+    )
+    parser.add_argument(
+        "--k", type=int, default=5, help="Number of neighbours compared per track"
+    )
+    parser.add_argument(
+        "--timing-tracks",
+        type=int,
+        default=5,
+        help="Number of tracks extraction is timed on",
+    )
+    parser.add_argument(
+        "--output", default="segment_sampling.json", help="JSON file of the report"
+    )
+    args = parser.parse_args()
+
+    settings = [
+        SegmentSampling(sr, tuple(args.segments), seconds)
+        for sr, seconds in itertools.product(args.sr, args.segment_seconds)
+    ]
+
+    results = report(
+        args.tracks_folder,
+        settings,
+        limit=args.limit,
+        k=args.k,
+        timing_tracks=args.timing_tracks,
+        verbose=True,
+    )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(
+        f"{results['tracks']} tracks, full extraction "
+        f"{results['full_seconds_per_track']:.2f}s per track, k={results['k']}"
+    )
+    for result in results["settings"]:
+        print(
+            f"sr={result['sr']} segments={len(result['positions'])}x{result['segment_seconds']:g}s: "
+            f"{result['seconds_per_track']:.2f}s per track (x{result['speedup']:.1f}) "
+            f"rel_err={result['median_relative_error']:.3f} "
+            f"std_err={result['median_std_error']:.3f} "
+            f"query_recall={result['query_recall']:.2f} "
+            f"self_top1={result['self_top1']:.2f} "
+            f"index_recall={result['index_recall']:.2f}"
+        )
+        for feature, errors in result["worst_features"].items():
+            print(f"    {feature}: std_err={errors['std_error']:.3f} rel_err={errors['relative']:.3f}")
+
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Benchmark suite of the hot paths, on deterministic synthetic data.
+
+Each case generates its inputs with `benchmarks.synthetic` in a temporary
+folder, then times its hot path a few times and keeps the best run. Peak
+Python memory is measured in a separate run under tracemalloc, so tracing does
+not slow the timed runs. Results are written to a JSON file:
+
+    {"meta": {...}, "results": {"<case>": {"seconds": ..., "throughput": ..., ...}}}
+
+With `--baseline`, the results are compared to a previous results file and the
+suite exits with status 1 when the throughput of a case drops, or its peak
+memory grows, by more than `--threshold`. Everything runs offline on the CPU.
+
+Usage: python -m benchmarks.suite [--scale 1.0] [--output results.json] [--baseline baseline.json]
+"""
+
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks import synthetic
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _add_script_folder(folder: str):
+    """
+    Makes the modules of a script folder importable, as they import their siblings by name.
+    """
+    path = os.path.join(ROOT_DIR, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def _scaled(size: int, scale: float) -> int:
+    return max(1, round(size * scale))
+
+
+def _tempo_error(detected: float, expected: float) -> float:
+    """
+    Relative error of a detected tempo, ignoring octave errors (half or double tempo).
+    """
+    return min(abs(detected * factor - expected) / expected for factor in (0.5, 1, 2))
+
+
+def case_feature_extraction(workdir: str, scale: float) -> dict:
+    from track_feature_extraction import build_feature_vector
+
+    tracks = synthetic.write_audio_library(
+        os.path.join(workdir, "audio"), _scaled(4, scale), duration=30.0
+    )
+    paths = [os.path.join(workdir, "audio", file_name) for file_name, _ in tracks]
+    tempo_errors = []
+
+    def run():
+        tempo_errors.clear()
+        for path, (_, bpm) in zip(paths, tracks):
+            tempo_errors.append(_tempo_error(build_feature_vector(path)["tempo"], bpm))
+
+    return {
+        "run": run,
+        "items": 30.0 * len(paths),
+        "unit": "audio_seconds",
+        "repeats": 1,
+        "extra": lambda: {"max_tempo_error": max(tempo_errors)},
+    }
+
+
+def case_most_similar_index(workdir: str, scale: float) -> dict:
+    from most_similar import FeatureIndex
+
+    df = synthetic.synthetic_features(_scaled(20_000, scale))
+
+    return {"run": lambda: FeatureIndex.build(df), "items": len(df), "unit": "tracks"}
+
+
+def case_most_similar_query(workdir: str, scale: float) -> dict:
+    from most_similar import FeatureIndex, most_similar
+
+    df = synthetic.synthetic_features(_scaled(20_000, scale))
+    index = FeatureIndex.build(df)
+    queries = range(0, len(df), max(1, len(df) // 500))
+
+    def run():
+        for df_index in queries:
+            most_similar(df, df_index=df_index, index=index)
+
+    return {"run": run, "items": len(queries), "unit": "queries"}
+
+
+def case_tag_scan(workdir: str, scale: float) -> dict:
+    _add_script_folder("tracks_similarity")
+    from tag_index import TagIndex
+
+    folder = os.path.join(workdir, "tagged")
+    paths = synthetic.write_tagged_library(folder, _scaled(500, scale))
+    runs = iter(range(1_000_000))
+
+    def run():
+        # a new index file every run, so every tag is read
+        TagIndex(os.path.join(workdir, f"tags_{next(runs)}.json")).scan_folder(folder)
+
+    return {"run": run, "items": len(paths), "unit": "files"}
+
+
+def case_triplet_dataset(workdir: str, scale: float) -> dict:
+    _add_script_folder("tracks_similarity")
+    from tag_index import TagIndex
+    from triplet_dataset import TripletDataset
+
+    folder = os.path.join(workdir, "tagged")
+    paths = synthetic.write_tagged_library(folder, _scaled(5000, scale))
+
+    tag_index = TagIndex(os.path.join(workdir, "tags.json"))
+    tag_index.scan_folder(folder)
+
+    return {
+        "run": lambda: TripletDataset(folder, tag_index=tag_index),
+        "items": len(paths),
+        "unit": "anchors",
+    }
+
+
+def case_audio_matrix(workdir: str, scale: float) -> dict:
+    _add_script_folder("tracks_match")
+    from audio_matrix import AudioMatrix
+
+    rng = np.random.default_rng(0)
+    n_labels = _scaled(20_000, scale)
+    names = [f"track_{i:05d}.mp3" for i in range(_scaled(2000, scale))]
+    lefts = rng.choice(names, n_labels)
+    rights = rng.choice(names, n_labels)
+    matches = rng.random(n_labels) < 0.5
+
+    def run():
+        audio_matrix = AudioMatrix()
+        for left, right, match in zip(lefts, rights, matches):
+            audio_matrix.set_match(left, right, match)
+
+        audio_matrix.pairs_exist(rights, lefts)
+        AudioMatrix().from_dataframe(audio_matrix.to_dataframe())
+
+    return {"run": run, "items": n_labels, "unit": "labels"}
+
+
+def case_discogs_parse(workdir: str, scale: float) -> dict:
+    from parse_discogs_data import iter_release_batches
+
+    xml_path = os.path.join(workdir, "releases.xml")
+    n_releases = _scaled(20_000, scale)
+    size = synthetic.write_discogs_xml(xml_path, n_releases)
+
+    def run():
+        for _ in iter_release_batches(xml_path, batch_size=1000):
+            pass
+
+    return {
+        "run": run,
+        "items": n_releases,
+        "unit": "releases",
+        "extra": lambda: {"megabytes": size / 1e6},
+    }
+
+
+CASES = {
+    "feature_extraction": case_feature_extraction,
+    "most_similar_index": case_most_similar_index,
+    "most_similar_query": case_most_similar_query,
+    "tag_scan": case_tag_scan,
+    "triplet_dataset": case_triplet_dataset,
+    "audio_matrix": case_audio_matrix,
+    "discogs_parse": case_discogs_parse,
+}
+
+
+def run_case(name: str, scale: float = 1.0, repeats: int = 3, memory=True) -> dict:
+    """
+    Generates the inputs of a case and measures its hot path.
+
+    Args:
+        name (str): The name of the case, a key of `CASES`.
+        scale (float): The multiplier of the default input sizes.
+        repeats (int): The number of timed runs, the best one is kept. Slow cases run once.
+        memory (bool, optional): Whether to measure the peak memory in an extra run. Defaults to True.
+
+    Returns:
+        dict: The best and median time, the throughput, the peak memory and the case extras.
+    """
+    with tempfile.TemporaryDirectory(prefix=f"auto_digger_{name}_") as workdir:
+        case = CASES[name](workdir, scale)
+
+        times = []
+        for _ in range(min(repeats, case.get("repeats", repeats))):
+            start_time = time.perf_counter()
+            case["run"]()
+            times.append(time.perf_counter() - start_time)
+
+        result = {
+            "items": case["items"],
+            "unit": case["unit"],
+            "seconds": min(times),
+            "median_seconds": statistics.median(times),
+            "throughput": case["items"] / min(times),
+        }
+
+        if memory:
+            tracemalloc.start()
+            case["run"]()
+            result["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+
+        if "extra" in case:
+            result |= case["extra"]()
+
+    return result
+
+
+def run_suite(names: list[str], scale: float = 1.0, repeats: int = 3, memory=True, verbose=False) -> dict:
+    """
+    Runs benchmark cases.
+
+    Args:
+        names (list[str]): The names of the cases to run.
+        scale (float): The multiplier of the default input sizes.
+        repeats (int): The number of timed runs per case.
+        memory (bool, optional): Whether to measure the peak memory. Defaults to True.
+        verbose (bool, optional): Whether to print each result. Defaults to False.
+
+    Returns:
+        dict: The run metadata and the result of each case.
+    """
+    import librosa
+    import pandas as pd
+
+    results = {}
+    for name in names:
+        results[name] = run_case(name, scale=scale, repeats=repeats, memory=memory)
+
+        if verbose:
+            result = results[name]
+            memory_str = f" peak={result['peak_memory_mb']:.1f}MB" if memory else ""
+            print(
+                f"{name}: {result['seconds']:.3f}s "
+                f"{result['throughput']:.1f} {result['unit']}/s{memory_str}"
+            )
+
+    return {
+        "meta": {
+            "scale": scale,
+            "repeats": repeats,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "librosa": librosa.__version__,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.25) -> list[str]:
+    """
+    Lists the regressions of a suite run against a baseline run.
+
+    Args:
+        results (dict): The output of `run_suite`.
+        baseline (dict): A previous output of `run_suite`, at the same scale.
+        threshold (float): The tolerated relative drop of throughput or growth of peak memory.
+
+    Returns:
+        list[str]: A description of each regression, empty when there is none.
+    """
+    if results["meta"]["scale"] != baseline["meta"]["scale"]:
+        raise ValueError(
+            f"Cannot compare scale {results['meta']['scale']} to baseline scale {baseline['meta']['scale']}"
+        )
+
+    regressions = []
+    for name, result in results["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+
+        if result["throughput"] < reference["throughput"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {result['throughput']:.1f} {result['unit']}/s "
+                f"< baseline {reference['throughput']:.1f}"
+            )
+
+        if "peak_memory_mb" in result and "peak_memory_mb" in reference:
+            if result["peak_memory_mb"] > reference["peak_memory_mb"] * (1 + threshold):
+                regressions.append(
+                    f"{name}: peak memory {result['peak_memory_mb']:.1f}MB "
+                    f"> baseline {reference['peak_memory_mb']:.1f}MB"
+                )
+
+    return regressions
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths on synthetic data.")
+    parser.add_argument(
+        "cases", nargs="*", help=f"Cases to run among {', '.join(CASES)}, defaults to all"
+    )
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier of the input sizes")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per case")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the peak memory runs")
+    parser.add_argument(
+        "--output", default="benchmark_results.json", help="Results JSON file"
+    )
+    parser.add_argument("--baseline", help="Results JSON file to compare to")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Tolerated relative regression before failing",
+    )
+    args = parser.parse_args()
+
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    results = run_suite(
+        args.cases or list(CASES),
+        scale=args.scale,
+        repeats=args.repeats,
+        memory=not args.no_memory,
+        verbose=True,
+    )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to '{args.output}'")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), threshold=args.threshold)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+        if regressions:
+            sys.exit(1)
+
+        print(f"no regression beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Deterministic synthetic data for the benchmarks.
+
+Every generator takes a seed and writes the same bytes for the same arguments,
+so benchmark runs on different machines or commits process identical inputs
+without any download:
+
+- audio tracks mixing a tone, noise and clicks at a known tempo
+- libraries of tiny AIFF files with class comment ID3 tags like '2,e;d'
+- feature CSVs with the columns written by `build_dataset.py`
+- Discogs release XML dumps
+"""
+
+import os
+import random
+
+import numpy as np
+import pandas as pd
+import soundfile as sf
+
+GENRES = "aetdfghiobr"
+CLASSES = ["h", "o", "d", "a", "t", "g", "e", "b", "f", "i", "r"]
+
+
+def tone(frequency: float, duration: float, sr: int, amplitude: float = 0.3) -> np.ndarray:
+    """
+    Generates a sine tone.
+
+    Args:
+        frequency (float): The frequency of the tone in Hz.
+        duration (float): The duration in seconds.
+        sr (int): The sample rate.
+        amplitude (float): The peak amplitude.
+
+    Returns:
+        np.ndarray: The float32 signal.
+    """
+    t = np.arange(int(duration * sr)) / sr
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def noise(duration: float, sr: int, amplitude: float = 0.05, seed: int = 0) -> np.ndarray:
+    """
+    Generates white noise.
+
+    Args:
+        duration (float): The duration in seconds.
+        sr (int): The sample rate.
+        amplitude (float): The standard deviation of the noise.
+        seed (int): The seed of the noise.
+
+    Returns:
+        np.ndarray: The float32 signal.
+    """
+    rng = np.random.default_rng(seed)
+    return (amplitude * rng.standard_normal(int(duration * sr))).astype(np.float32)
+
+
+def clicks(bpm: float, duration: float, sr: int, amplitude: float = 0.8) -> np.ndarray:
+    """
+    Generates short decaying clicks on every beat of a tempo.
+
+    Args:
+        bpm (float): The tempo in beats per minute.
+        duration (float): The duration in seconds.
+        sr (int): The sample rate.
+        amplitude (float): The peak amplitude of a click.
+
+    Returns:
+        np.ndarray: The float32 signal.
+    """
+    y = np.zeros(int(duration * sr), dtype=np.float32)
+
+    click_length = int(0.02 * sr)
+    click = amplitude * np.exp(-np.arange(click_length) / (0.003 * sr))
+    click *= np.sign(np.sin(2 * np.pi * 1000 * np.arange(click_length) / sr))
+
+    for start in (np.arange(0, duration, 60 / bpm) * sr).astype(int):
+        end = min(start + click_length, y.size)
+        y[start:end] += click[: end - start]
+
+    return y
+
+
+def synthetic_track(bpm: float, duration: float, sr: int, seed: int = 0) -> np.ndarray:
+    """
+    Mixes a tone, noise and clicks at a known tempo.
+
+    Args:
+        bpm (float): The tempo of the clicks.
+        duration (float): The duration in seconds.
+        sr (int): The sample rate.
+        seed (int): The seed of the tone frequency and the noise.
+
+    Returns:
+        np.ndarray: The float32 signal, in [-1, 1].
+    """
+    frequency = random.Random(seed).uniform(110, 880)
+
+    y = tone(frequency, duration, sr) + noise(duration, sr, seed=seed) + clicks(bpm, duration, sr)
+    return np.clip(y, -1, 1)
+
+
+def write_audio_library(
+    folder: str, n_tracks: int, duration: float = 30.0, sr: int = 22050, seed: int = 0
+) -> list[tuple[str, float]]:
+    """
+    Writes WAV tracks at random known tempos.
+
+    Args:
+        folder (str): The output folder, created if missing.
+        n_tracks (int): The number of tracks.
+        duration (float): The duration of each track in seconds.
+        sr (int): The sample rate.
+        seed (int): The seed of the library.
+
+    Returns:
+        list[tuple[str, float]]: The file name and tempo of each track.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+
+    tracks = []
+    for i in range(n_tracks):
+        bpm = rng.choice([90, 100, 110, 120, 128, 135, 140])
+        file_name = f"[{rng.choice(CLASSES)}] Synthetic - Track {i:05d}.wav"
+
+        y = synthetic_track(bpm, duration, sr, seed=seed * 100_003 + i)
+        sf.write(os.path.join(folder, file_name), y, sr, subtype="PCM_16")
+        tracks.append((file_name, float(bpm)))
+
+    return tracks
+
+
+def class_comment(rng: random.Random) -> str:
+    """
+    Draws a random class comment like '2,e;d'.
+    """
+    genres = rng.sample(GENRES, rng.randint(1, 3))
+    return f"{rng.randint(0, 5)},{';'.join(genres)}"
+
+
+def write_tagged_library(
+    folder: str, n_tracks: int, untagged_ratio: float = 0.1, seed: int = 0
+) -> list[str]:
+    """
+    Writes tiny AIFF files with a class comment ID3 tag.
+
+    Args:
+        folder (str): The output folder, created if missing.
+        n_tracks (int): The number of files.
+        untagged_ratio (float): The ratio of files without a class comment.
+        seed (int): The seed of the comments.
+
+    Returns:
+        list[str]: The paths of the files.
+    """
+    from mutagen.aiff import AIFF
+    from mutagen.id3 import COMM
+
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    silence = np.zeros(441, dtype=np.int16)
+
+    paths = []
+    for i in range(n_tracks):
+        path = os.path.join(folder, f"track_{i:05d}.aiff")
+        sf.write(path, silence, 44100, format="AIFF", subtype="PCM_16")
+
+        audio = AIFF(path)
+        audio.add_tags()
+        comment = "not a class comment" if rng.random() < untagged_ratio else class_comment(rng)
+        audio.tags.add(COMM(encoding=3, lang="eng", desc="", text=[comment]))
+        audio.save()
+
+        paths.append(path)
+
+    return paths
+
+
+def feature_columns() -> list[str]:
+    """
+    Gets the names of the feature columns of `build_dataset.py`.
+
+    Returns:
+        list[str]: The keys of a feature vector, in order.
+    """
+    from track_feature_extraction import features_from_signal
+
+    return list(features_from_signal(noise(2.0, 22050), 22050).keys())
+
+
+def synthetic_features(n_tracks: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Builds a features dataframe with the columns of `build_dataset.py` and random values.
+
+    Args:
+        n_tracks (int): The number of rows.
+        seed (int): The seed of the values.
+
+    Returns:
+        pd.DataFrame: The audio name, class and feature columns.
+    """
+    rng = np.random.default_rng(seed)
+    columns = feature_columns()
+
+    df = pd.DataFrame({"audio": [f"track_{i:06d}.mp3" for i in range(n_tracks)]})
+    for c in CLASSES:
+        df[c] = rng.random(n_tracks) < 0.2
+
+    # features on very different scales, like the real ones
+    scales = 10.0 ** rng.uniform(-3, 4, size=len(columns))
+    values = rng.standard_normal((n_tracks, len(columns))) * scales
+
+    return pd.concat([df, pd.DataFrame(values, columns=columns)], axis=1)
+
+
+def write_discogs_xml(xml_path: str, n_releases: int, seed: int = 0) -> int:
+    """
+    Writes a Discogs release dump with the structure of the monthly dumps.
+
+    Args:
+        xml_path (str): The output XML file.
+        n_releases (int): The number of releases.
+        seed (int): The seed of the styles and countries.
+
+    Returns:
+        int: The size of the file in bytes.
+    """
+    rng = random.Random(seed)
+
+    with open(xml_path, "w", encoding="utf-8") as f:
+        f.write("<releases>\n")
+
+        for i in range(1, n_releases + 1):
+            videos = (
+                f'<videos><video src="https://www.youtube.com/watch?v=v{i}" duration="290" embed="true">'
+                f"<title>V{i}</title><description/></video></videos>"
+                if i % 3
+                else ""
+            )
+            f.write(
+                f'<release id="{i}" status="Accepted">'
+                f'<images><image height="600" type="primary" uri="" uri150="" width="600"/></images>'
+                f"<artists><artist><id>{i * 7}</id><name>Artist {i}</name><anv/><join/><role/><tracks/></artist></artists>"
+                f"<title>Title &amp; {i}</title>"
+                f'<labels><label name="Label {i % 50}" catno="CAT{i}" id="{i % 50}"/></labels>'
+                f"<extraartists><artist><id>999</id><name>Extra</name></artist></extraartists>"
+                f'<formats><format name="Vinyl" qty="{1 + i % 2}" text=""><descriptions><description>12"</description></descriptions></format></formats>'
+                f"<genres><genre>Electronic</genre></genres>"
+                f"<styles><style>{rng.choice(['House', 'Techno', 'Ambient'])}</style><style>Deep House</style></styles>"
+                f"<country>{rng.choice(['UK', 'US', 'France'])}</country>"
+                f"<released>{1980 + i % 40}-03-00</released><notes>n</notes><data_quality>Correct</data_quality>"
+                f'<master_id is_main_release="true">{i}</master_id>'
+                f"<tracklist><track><position>A</position><title>T{i}a</title><duration>4:45</duration></track>"
+                f"<track><position>B</position><title>T{i}b</title><duration></duration></track></tracklist>"
+                f"{videos}<companies/></release>\n"
+            )
+
+        f.write("</releases>\n")
+
+    return os.path.getsize(xml_path)
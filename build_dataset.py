@@ -1,6 +1,9 @@
 import os
 import random
-from track_feature_extraction import build_feature_vector
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from feature_cache import cached_feature_vector
+from profiling import add_profile_argument, profile_session
+from track_feature_extraction import SegmentSampling, add_sampling_arguments, sampling_from_args
 import pandas as pd
 
 
@@ -26,26 +29,50 @@ def build_class_vector(file_name: str) -> dict[str, bool]:
     return out_vector
 
 
-def build_dataset(tracks: list[str], verbose=False) -> pd.DataFrame:
+def build_row(
+    directory_path: str, file_path: str, sampling: SegmentSampling = None
+) -> dict:
+    """
+    Builds the dataset row of a single audio track.
+
+    Args:
+        directory_path (str): The folder containing the audio track.
+        file_path (str): The file name of the audio track, relative to `directory_path`.
+        sampling (SegmentSampling, optional): The fast extraction mode. Defaults to the whole track.
+
+    Returns:
+        dict: The file name, the class vector and the features vector of the track.
+    """
+    out_vector = {"audio": file_path}
+    out_vector |= build_class_vector(file_path)
+    out_vector |= cached_feature_vector(
+        os.path.join(directory_path, file_path), sampling=sampling
+    )
+
+    return out_vector
+
+
+def build_dataset(tracks: list[str], directory_path: str, verbose=False) -> pd.DataFrame:
     """
     Builds a dataset from a list of audio tracks.
 
     Args:
-        tracks (list[str]): A list of file paths to audio tracks.
+        tracks (list[str]): A list of file names of audio tracks.
+        directory_path (str): The folder containing the audio tracks.
         verbose (bool, optional): Whether to print progress messages. Defaults to False.
 
     Returns:
         pd.DataFrame: A pandas DataFrame containing the features vectors of the audio tracks.
 
     Example:
-        >>> tracks = ['/path/to/track1.wav', '/path/to/track2.wav']
-        >>> dataset = build_dataset(tracks, verbose=True)
-        Building features vector of '/path/to/track1.wav'...
-        Building features vector of '/path/to/track2.wav'...
+        >>> tracks = ['track1.wav', 'track2.wav']
+        >>> dataset = build_dataset(tracks, '/path/to', verbose=True)
+        Building features vector of 'track1.wav'...
+        Building features vector of 'track2.wav'...
         >>> print(dataset)
                                         audio  class  feature1  feature2  ...
-        0                        /path/to/track1.wav      1      0.23      0.45  ...
-        1                        /path/to/track2.wav      2      0.12      0.67  ...
+        0                        track1.wav      1      0.23      0.45  ...
+        1                        track2.wav      2      0.12      0.67  ...
         ...
     """
     dataset = []
@@ -54,22 +81,218 @@ def build_dataset(tracks: list[str], verbose=False) -> pd.DataFrame:
         if verbose:
             print(f"Building features vector of '{file_path}'...")
 
-        out_vector = {"audio": file_path}
-        out_vector |= build_class_vector(file_path)
-        out_vector |= build_feature_vector(os.path.join(directory_path, file_path))
-
-        dataset.append(out_vector)
+        dataset.append(build_row(directory_path, file_path))
 
     return pd.DataFrame(dataset)
 
 
+def append_rows(rows: list[dict], output_path: str):
+    """
+    Appends rows to a CSV file, writing the header if the file is new.
+
+    The chunk is written with a single write and flushed to disk, so an
+    interrupted run leaves every previous chunk intact.
+
+    Args:
+        rows (list[dict]): The rows to append.
+        output_path (str): The path to the CSV file.
+    """
+    if not rows:
+        return
+
+    write_header = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+    chunk = pd.DataFrame(rows).to_csv(index=False, header=write_header)
+
+    with open(output_path, "a") as f:
+        f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def completed_tracks(output_path: str) -> set[str]:
+    """
+    Lists the tracks already written to a partial dataset.
+
+    Args:
+        output_path (str): The path to the CSV file written by `build_dataset_to_csv`.
+
+    Returns:
+        set[str]: The file names found in the `audio` column, empty if there is no file yet.
+    """
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return set()
+
+    return set(pd.read_csv(output_path, usecols=["audio"])["audio"])
+
+
+def check_extraction_mode(output_path: str, sampling: SegmentSampling = None):
+    """
+    Records the extraction mode of a dataset next to it, so rows of another mode are never appended.
+
+    The mode is written to `output_path` with an `.extraction` suffix. A dataset
+    written before modes were recorded was built from whole tracks.
+
+    Args:
+        output_path (str): The path to the CSV file of the dataset.
+        sampling (SegmentSampling, optional): The fast extraction mode of the new rows. Defaults to the whole track.
+
+    Raises:
+        ValueError: If the dataset was built with another extraction mode.
+    """
+    mode = sampling.key() if sampling is not None else "full"
+    mode_path = os.path.splitext(output_path)[0] + ".extraction"
+
+    if os.path.exists(mode_path):
+        with open(mode_path) as f:
+            recorded = f.read().strip()
+    elif completed_tracks(output_path):
+        recorded = "full"
+    else:
+        recorded = None
+
+    if recorded is not None and recorded != mode:
+        raise ValueError(
+            f"'{output_path}' was built with the '{recorded}' extraction mode, "
+            f"not '{mode}': use another output file"
+        )
+
+    if not os.path.exists(mode_path):
+        with open(mode_path, "w") as f:
+            f.write(mode + "\n")
+
+
+def build_dataset_to_csv(
+    tracks: list[str],
+    directory_path: str,
+    output_path: str,
+    failures_path: str = None,
+    workers: int = None,
+    chunk_size: int = 10,
+    verbose=False,
+    sampling: SegmentSampling = None,
+) -> pd.DataFrame:
+    """
+    Builds a dataset in parallel, appending finished rows to a CSV file.
+
+    Tracks already present in `output_path` are skipped, so an interrupted run
+    resumes where it stopped. A dataset is only resumed with the extraction mode
+    it was started with. A track that cannot be processed is recorded in
+    `failures_path` with its error and does not abort the run; it is retried on
+    the next run.
+
+    Args:
+        tracks (list[str]): A list of file names of audio tracks.
+        directory_path (str): The folder containing the audio tracks.
+        output_path (str): The CSV file the rows are appended to.
+        failures_path (str, optional): The CSV file failures are appended to. Defaults to `output_path` with a `.failures.csv` suffix.
+        workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+        chunk_size (int, optional): The number of finished rows buffered before each write. Defaults to 10.
+        verbose (bool, optional): Whether to print progress messages. Defaults to False.
+        sampling (SegmentSampling, optional): The fast extraction mode, for screening
+            candidates. Defaults to the whole track.
+
+    Returns:
+        pd.DataFrame: The full dataset read back from `output_path`, without rows if none was built.
+
+    Raises:
+        ValueError: If `output_path` was built with another extraction mode.
+    """
+    if failures_path is None:
+        failures_path = os.path.splitext(output_path)[0] + ".failures.csv"
+
+    check_extraction_mode(output_path, sampling)
+
+    done = completed_tracks(output_path)
+    pending = [file_path for file_path in tracks if file_path not in done]
+
+    if verbose:
+        print(f"{len(done)} tracks already built, {len(pending)} remaining")
+
+    rows = []
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(build_row, directory_path, file_path, sampling): file_path
+            for file_path in pending
+        }
+
+        for count, future in enumerate(as_completed(futures), start=1):
+            file_path = futures[future]
+
+            try:
+                rows.append(future.result())
+                if verbose:
+                    print(f"[{count}/{len(pending)}] Built features vector of '{file_path}'")
+            except Exception as e:
+                failures.append({"audio": file_path, "error": repr(e)})
+                if verbose:
+                    print(f"[{count}/{len(pending)}] Failed on '{file_path}': {e!r}")
+
+            if len(rows) >= chunk_size:
+                append_rows(rows, output_path)
+                rows = []
+
+            if len(failures) >= chunk_size:
+                append_rows(failures, failures_path)
+                failures = []
+
+    append_rows(rows, output_path)
+    append_rows(failures, failures_path)
+
+    # no row was ever written when every track failed
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return pd.DataFrame(columns=["audio", *build_class_vector("")])
+
+    return pd.read_csv(output_path)
+
+
 if __name__ == "__main__":
-    directory_path = "/Users/leopnt/Downloads/music_lib/h"
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Build the features dataset of a folder of tracks."
+    )
+    parser.add_argument("directory_path", help="Path to the folder of tracks")
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Output CSV file, defaults to track_features.csv or track_features_fast.csv with --fast",
+    )
+    parser.add_argument(
+        "--sample", type=int, default=200, help="Number of tracks to sample"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10,
+        help="Number of rows written to the output at once",
+    )
+    add_sampling_arguments(parser)
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    if args.output is None:
+        args.output = "track_features_fast.csv" if args.fast else "track_features.csv"
 
-    tracks = os.listdir(directory_path)
+    tracks = sorted(os.listdir(args.directory_path))
 
     random.seed(42)
-    tracks = random.sample(tracks, 200)
+    tracks = random.sample(tracks, min(args.sample, len(tracks)))
 
-    df = build_dataset(tracks, verbose=True)
-    df.to_csv("track_features.csv", index=False)
+    with profile_session(args.profile):
+        build_dataset_to_csv(
+            tracks,
+            args.directory_path,
+            args.output,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            verbose=True,
+            sampling=sampling_from_args(args),
+        )
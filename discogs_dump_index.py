@@ -0,0 +1,384 @@
+"""
+Byte-offset index of the releases of a Discogs release dump.
+
+A single pass records the byte offset of every `<release` start tag along with
+its `release_id`. The index gives random access to one release without
+re-scanning the dump, and splits the dump into byte-range shards parsed
+independently by a process pool.
+
+`.xml.gz` dumps are read through `indexed_gzip` when it is installed. It keeps
+a checkpoint of the decompressor state every few megabytes, saved next to the
+dump, so seeking to an uncompressed offset only decompresses from the closest
+checkpoint. Without it, `gzip` is used and every seek decompresses from the
+start of the file, so a `.gz` dump is then extracted as a single shard.
+"""
+
+import csv
+import gzip
+import importlib.util
+import io
+import os
+import re
+import shutil
+import warnings
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+import numpy as np
+
+from parse_discogs_data import RELEASE_TABLES, iter_release_batches, parse_release
+
+# Start tags of releases and end tags, `</releases>` is not matched
+RELEASE_TAG_PATTERN = re.compile(rb'<release\b[^>]*?\bid="(\d+)"|</release>')
+SCAN_BLOCK_SIZE = 16 * 1024 * 1024
+SCAN_OVERLAP = 4096
+GZIP_CHECKPOINT_SPACING = 4 * 1024 * 1024
+
+
+def offset_index_path(xml_file: str) -> str:
+    return xml_file + ".offsets.npz"
+
+
+def gzip_index_path(xml_file: str) -> str:
+    return xml_file + ".gzidx"
+
+
+def seekable_dump(xml_file: str) -> bool:
+    """
+    Whether seeking in a dump is cheap: it is not compressed, or `indexed_gzip` is installed.
+    """
+    return not xml_file.endswith(".gz") or importlib.util.find_spec("indexed_gzip") is not None
+
+
+def open_dump(xml_file: str) -> io.BufferedIOBase:
+    """
+    Opens a Discogs dump for binary reading, decompressing `.gz` files.
+
+    Args:
+        xml_file (str): The path to the `.xml` or `.xml.gz` dump.
+
+    Returns:
+        io.BufferedIOBase: A seekable file object over the uncompressed XML.
+    """
+    if not xml_file.endswith(".gz"):
+        return open(xml_file, "rb")
+
+    try:
+        import indexed_gzip
+    except ImportError:
+        warnings.warn(
+            "indexed_gzip is not installed, seeking in the .gz dump decompresses it from the start"
+        )
+        return gzip.open(xml_file, "rb")
+
+    f = indexed_gzip.IndexedGzipFile(xml_file, spacing=GZIP_CHECKPOINT_SPACING)
+    if os.path.exists(gzip_index_path(xml_file)):
+        f.import_index(gzip_index_path(xml_file))
+
+    return f
+
+
+class OffsetIndex:
+    def __init__(self, offsets: np.ndarray, release_ids: np.ndarray, end_offset: int) -> None:
+        """
+        Params
+        ======
+        `offsets`: uncompressed byte offset of each `<release` start tag, in file order
+        `release_ids`: `release_id` of each release
+        `end_offset`: uncompressed byte offset right after the last `</release>`
+        """
+        self.offsets = offsets
+        self.release_ids = release_ids
+        self.end_offset = end_offset
+
+        self._id_order = np.argsort(release_ids, kind="stable")
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    @staticmethod
+    def build(xml_file: str, verbose=False) -> "OffsetIndex":
+        """
+        Scans a dump once and records the offset of each release.
+
+        For `.gz` dumps read through indexed_gzip, the checkpoints created by the
+        scan are exported next to the dump too.
+
+        Args:
+            xml_file (str): The path to the `.xml` or `.xml.gz` dump.
+            verbose (bool, optional): Whether to print progress messages. Defaults to False.
+
+        Returns:
+            OffsetIndex: The index of the dump.
+        """
+        offsets = []
+        release_ids = []
+        end_offset = 0
+
+        with open_dump(xml_file) as f:
+            buffer = b""
+            buffer_offset = 0
+            eof = False
+
+            while not eof:
+                block = f.read(SCAN_BLOCK_SIZE)
+                eof = not block
+                buffer += block
+
+                # matches starting in the overlap are scanned again with the next block
+                limit = len(buffer) if eof else len(buffer) - SCAN_OVERLAP
+                for match in RELEASE_TAG_PATTERN.finditer(buffer):
+                    if match.start() >= limit:
+                        break
+
+                    if match.group(1) is None:
+                        end_offset = buffer_offset + match.end()
+                    else:
+                        offsets.append(buffer_offset + match.start())
+                        release_ids.append(int(match.group(1)))
+
+                if not eof and limit > 0:
+                    buffer_offset += limit
+                    buffer = buffer[limit:]
+
+                if verbose:
+                    print(f"indexed {len(offsets)} releases", end="\r")
+
+            if xml_file.endswith(".gz") and hasattr(f, "export_index"):
+                f.export_index(gzip_index_path(xml_file))
+
+        if verbose:
+            print()
+
+        return OffsetIndex(
+            np.array(offsets, dtype=np.int64),
+            np.array(release_ids, dtype=np.int64),
+            end_offset,
+        )
+
+    def save(self, index_file: str):
+        np.savez(
+            index_file,
+            offsets=self.offsets,
+            release_ids=self.release_ids,
+            end_offset=np.int64(self.end_offset),
+        )
+
+    @staticmethod
+    def load(index_file: str) -> "OffsetIndex":
+        data = np.load(index_file)
+        return OffsetIndex(data["offsets"], data["release_ids"], int(data["end_offset"]))
+
+    def release_range(self, position: int) -> tuple[int, int]:
+        """
+        Byte range of the release at `position` in file order.
+        """
+        start = int(self.offsets[position])
+        end = int(self.offsets[position + 1]) if position + 1 < len(self) else self.end_offset
+
+        return start, end
+
+    def find(self, release_id: int) -> int:
+        """
+        Position in file order of a release, or -1 if it is not in the dump.
+        """
+        i = np.searchsorted(self.release_ids, release_id, sorter=self._id_order)
+        if i < len(self) and self.release_ids[self._id_order[i]] == release_id:
+            return int(self._id_order[i])
+
+        return -1
+
+    def shards(self, num_shards: int) -> list[tuple[int, int]]:
+        """
+        Splits the releases into byte ranges of about the same size.
+
+        Every range starts on a `<release` start tag and ends right before the
+        next shard, or after the last `</release>` for the last shard.
+        """
+        if len(self) == 0:
+            return []
+
+        start_offset = int(self.offsets[0])
+        targets = start_offset + np.arange(1, num_shards) * (self.end_offset - start_offset) / num_shards
+        boundaries = np.unique(np.searchsorted(self.offsets, targets))
+        boundaries = boundaries[(boundaries > 0) & (boundaries < len(self))]
+
+        starts = [start_offset] + [int(self.offsets[b]) for b in boundaries]
+        ends = starts[1:] + [self.end_offset]
+
+        return list(zip(starts, ends))
+
+
+def load_or_build_index(xml_file: str, verbose=False) -> OffsetIndex:
+    """
+    Loads the offset index saved next to a dump, building and saving it on first use.
+    """
+    index_file = offset_index_path(xml_file)
+
+    if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(xml_file):
+        return OffsetIndex.load(index_file)
+
+    index = OffsetIndex.build(xml_file, verbose=verbose)
+    index.save(index_file)
+
+    return index
+
+
+def read_release(xml_file: str, release_id: int, index: OffsetIndex = None) -> dict[str, list[tuple]]:
+    """
+    Reads a single release by `release_id` without scanning the dump.
+
+    Args:
+        xml_file (str): The path to the `.xml` or `.xml.gz` dump.
+        release_id (int): The id of the release.
+        index (OffsetIndex, optional): The offset index of the dump. Defaults to the saved one.
+
+    Returns:
+        dict[str, list[tuple]]: The rows of the release, as returned by `parse_release`.
+    """
+    if index is None:
+        index = load_or_build_index(xml_file)
+
+    position = index.find(release_id)
+    if position < 0:
+        raise KeyError(f"release_id={release_id} is not in '{xml_file}'")
+
+    start, end = index.release_range(position)
+    with open_dump(xml_file) as f:
+        f.seek(start)
+        content = f.read(end - start)
+
+    # the range may run up to the next start tag, keep the release element only
+    content = content[: content.rindex(b"</release>") + len(b"</release>")]
+
+    return parse_release(ET.fromstring(content))
+
+
+class ByteRangeReader(io.RawIOBase):
+    """
+    Reads `start` to `end` of a dump, wrapped in a `<releases>` root element.
+    """
+
+    def __init__(self, xml_file: str, start: int, end: int) -> None:
+        self.f = open_dump(xml_file)
+        self.f.seek(start)
+        self.remaining = end - start
+        self.prefix = b"<releases>"
+        self.suffix = b"</releases>"
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.prefix:
+            data, self.prefix = self.prefix, b""
+        elif self.remaining > 0:
+            data = self.f.read(min(len(buffer), self.remaining))
+            self.remaining -= len(data)
+            if not data:
+                self.remaining = 0
+        else:
+            data, self.suffix = self.suffix, b""
+
+        data = data[: len(buffer)]
+        buffer[: len(data)] = data
+
+        return len(data)
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+def iter_shard_batches(xml_file: str, start: int, end: int, batch_size: int = 1000) -> Iterator[dict[str, dict[str, list]]]:
+    """
+    Same as `iter_release_batches`, restricted to one byte-range shard.
+    """
+    with io.BufferedReader(ByteRangeReader(xml_file, start, end)) as f:
+        yield from iter_release_batches(f, batch_size=batch_size)
+
+
+def extract_shard_to_csv(xml_file: str, start: int, end: int, output_folder: str, batch_size: int = 1000) -> int:
+    """
+    Extracts one byte-range shard to one CSV file per table, without headers.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    files = {
+        table: open(os.path.join(output_folder, f"{table}.csv"), "w", newline="")
+        for table in RELEASE_TABLES
+    }
+    writers = {table: csv.writer(f) for table, f in files.items()}
+
+    count = 0
+    try:
+        for batch in iter_shard_batches(xml_file, start, end, batch_size=batch_size):
+            for table, columns in batch.items():
+                writers[table].writerows(zip(*columns.values()))
+
+            count += len(batch["MusicRelease"]["release_id"])
+    finally:
+        for f in files.values():
+            f.close()
+
+    return count
+
+
+def parallel_extract_to_csv(xml_file: str, output_folder: str, workers: int = None, batch_size: int = 1000, verbose=False) -> int:
+    """
+    Extracts a dump to one CSV file per table, parsing byte-range shards in a process pool.
+
+    Each worker writes its own shard folder. Shards are then concatenated in
+    file order, so the output is the same as `parse_discogs_data.extract_to_csv`.
+
+    Args:
+        xml_file (str): The path to the `.xml` or `.xml.gz` dump.
+        output_folder (str): The folder of the CSV files, created if missing.
+        workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+        batch_size (int): The number of releases per batch.
+        verbose (bool, optional): Whether to print progress messages. Defaults to False.
+
+    Returns:
+        int: The number of extracted releases.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    index = load_or_build_index(xml_file, verbose=verbose)
+    workers = workers or os.cpu_count()
+
+    if seekable_dump(xml_file):
+        # more shards than workers balances uneven release sizes
+        shards = index.shards(workers * 4)
+    else:
+        # every shard would decompress the dump from its start
+        warnings.warn(
+            "indexed_gzip is not installed, the .gz dump is extracted as a single shard"
+        )
+        shards = index.shards(1)
+    shard_folders = [
+        os.path.join(output_folder, f"shard_{i:04d}") for i in range(len(shards))
+    ]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(extract_shard_to_csv, xml_file, start, end, folder, batch_size)
+            for (start, end), folder in zip(shards, shard_folders)
+        ]
+        count = 0
+        for i, future in enumerate(futures):
+            count += future.result()
+            if verbose:
+                print(f"shard {i + 1}/{len(shards)} done, {count} releases")
+
+    for table, columns in RELEASE_TABLES.items():
+        with open(os.path.join(output_folder, f"{table}.csv"), "w", newline="") as out:
+            csv.writer(out).writerow(columns)
+            for folder in shard_folders:
+                with open(os.path.join(folder, f"{table}.csv"), newline="") as shard:
+                    shutil.copyfileobj(shard, out)
+
+    for folder in shard_folders:
+        shutil.rmtree(folder)
+
+    return count
@@ -1,12 +1,11 @@
+from typing import TYPE_CHECKING
+
 import pandas as pd
-import seaborn as sns
-import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.decomposition import PCA
 
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score
+if TYPE_CHECKING:
+    from sklearn.ensemble import RandomForestClassifier
+
+# plotting and scikit-learn imports take seconds, they are done by the functions using them
 
 
 def plot_correlation_matrix(df):
@@ -19,6 +18,9 @@ def plot_correlation_matrix(df):
     Returns:
     None
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     # Compute the correlation matrix
     correlation_matrix = df.iloc[:, 1:].corr()
 
@@ -56,6 +58,9 @@ def plot_pca(df):
     Returns:
     None
     """
+    import matplotlib.pyplot as plt
+    from sklearn.decomposition import PCA
+
     class_labels = df.iloc[:, 1:12]
     names = df.iloc[:, 0]
     features = df.iloc[:, 12:]
@@ -101,7 +106,7 @@ def plot_pca(df):
     plt.show()
 
 
-def train(df) -> RandomForestClassifier:
+def train(df) -> "RandomForestClassifier":
     """
     Trains a random forest classifier on the given dataframe and returns the trained model.
 
@@ -111,6 +116,10 @@ def train(df) -> RandomForestClassifier:
     Returns:
     RandomForestClassifier: The trained random forest classifier model.
     """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import accuracy_score
+    from sklearn.model_selection import train_test_split
+
     X = df.iloc[:, 12:]
     y = df.iloc[:, 1:12]
     y = y.replace({True: 1, False: 0})
@@ -130,8 +139,31 @@ def train(df) -> RandomForestClassifier:
     return model
 
 
-# csv built with build_dataset.py
-df = pd.read_csv("track_features.csv")
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Plot the features dataset.")
+    parser.add_argument(
+        "features",
+        nargs="?",
+        default="track_features.csv",
+        help="CSV built with build_dataset.py",
+    )
+    parser.add_argument(
+        "--train",
+        action="store_true",
+        help="Also train a random forest on the classes and print its accuracy",
+    )
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.features)
+
+    plot_correlation_matrix(df)
+    plot_pca(df)
+
+    if args.train:
+        train(df)
+
 
-plot_correlation_matrix(df)
-plot_pca(df)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Persistent on-disk cache of track feature vectors.
+
+Entries are keyed by the SHA-256 of the audio file content, the extraction sample
+rate or segment sampling and the extraction code version, so renamed or moved files
+still hit the cache and any change to `track_feature_extraction.py` invalidates it.
+The cache is a SQLite file bounded in number of entries with least recently used
+eviction. Entries of other extraction versions are kept, so checkouts sharing the
+cache do not delete each other's entries, until `--prune` removes them.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import librosa
+
+import track_feature_extraction
+from profiling import profiler
+from track_feature_extraction import SAMPLE_RATE, SegmentSampling, build_feature_vector
+
+DEFAULT_CACHE_PATH = os.path.expanduser("~/.cache/auto_digger/features.sqlite")
+DEFAULT_MAX_ENTRIES = 100_000
+
+
+def extraction_version() -> str:
+    """
+    Gets the version of the feature extraction code.
+
+    Returns:
+        str: A digest of the `track_feature_extraction` source and the librosa version.
+    """
+    with open(track_feature_extraction.__file__, "rb") as f:
+        source_digest = hashlib.sha256(f.read()).hexdigest()[:16]
+
+    return f"{source_digest}-librosa{librosa.__version__}"
+
+
+def file_digest(file_path: str) -> str:
+    """
+    Computes the SHA-256 of a file content.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        version: str = None,
+        check_same_thread: bool = True,
+    ) -> None:
+        """
+        Params
+        ======
+        `path`: SQLite file of the cache, created if missing
+        `max_entries`: number of feature vectors kept before evicting the least recently used
+        `version`: extraction code version, defaults to `extraction_version()`
+        `check_same_thread`: False to share the cache between threads, which must then serialize its calls
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.version = version or extraction_version()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=check_same_thread)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS features (
+                key TEXT PRIMARY KEY,
+                version TEXT,
+                features TEXT,
+                last_access REAL
+            );
+            CREATE INDEX IF NOT EXISTS features_last_access ON features (last_access);
+            CREATE TABLE IF NOT EXISTS digests (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER,
+                size INTEGER,
+                digest TEXT
+            );
+            """
+        )
+
+    def close(self):
+        self.conn.close()
+
+    def prune(self) -> int:
+        """
+        Removes the entries computed by other versions of the extraction code.
+
+        They are never read, as the version is part of the key, and are otherwise
+        only removed by eviction. Other checkouts sharing the cache lose their entries.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM features WHERE version != ?", (self.version,)
+            )
+
+        return cursor.rowcount
+
+    def digest(self, audio_path: str) -> str:
+        """
+        Gets the content digest of a file, rehashing it only if its size or mtime changed.
+        """
+        path = os.path.abspath(audio_path)
+        stat = os.stat(path)
+
+        row = self.conn.execute(
+            "SELECT digest FROM digests WHERE path = ? AND mtime_ns = ? AND size = ?",
+            (path, stat.st_mtime_ns, stat.st_size),
+        ).fetchone()
+        if row is not None:
+            return row[0]
+
+        digest = file_digest(path)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?)",
+                (path, stat.st_mtime_ns, stat.st_size, digest),
+            )
+
+        return digest
+
+    def key(self, audio_path: str, sr: int = SAMPLE_RATE, sampling: SegmentSampling = None) -> str:
+        mode = sampling.key() if sampling is not None else sr
+        return f"{self.digest(audio_path)}:{mode}:{self.version}"
+
+    def get(self, audio_path: str, sr: int = SAMPLE_RATE, sampling: SegmentSampling = None):
+        """
+        Gets the cached feature vector of an audio file, or None on a cache miss.
+        """
+        key = self.key(audio_path, sr, sampling)
+
+        row = self.conn.execute(
+            "SELECT features FROM features WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        with self.conn:
+            self.conn.execute(
+                "UPDATE features SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+
+        return json.loads(row[0])
+
+    def put(
+        self,
+        audio_path: str,
+        features: dict,
+        sr: int = SAMPLE_RATE,
+        sampling: SegmentSampling = None,
+    ):
+        """
+        Stores the feature vector of an audio file and evicts the least recently used entries.
+        """
+        key = self.key(audio_path, sr, sampling)
+        serialized = json.dumps({k: float(v) for k, v in features.items()})
+
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?)",
+                (key, self.version, serialized, time.time()),
+            )
+            self.conn.execute(
+                """
+                DELETE FROM features WHERE key IN (
+                    SELECT key FROM features ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def build_feature_vector(
+        self, audio_path: str, verbose=False, sampling: SegmentSampling = None
+    ) -> dict:
+        """
+        Same as `track_feature_extraction.build_feature_vector`, going through the cache.
+        """
+        with profiler.stage("feature_cache_get"):
+            features = self.get(audio_path, sampling=sampling)
+
+        if features is None:
+            profiler.count("feature_cache_misses")
+            features = build_feature_vector(audio_path, verbose=verbose, sampling=sampling)
+            self.put(audio_path, features, sampling=sampling)
+        else:
+            profiler.count("feature_cache_hits")
+            if verbose:
+                print(f"Loaded cached features of '{audio_path}'")
+
+        return features
+
+
+_default_cache = None
+
+
+def cached_feature_vector(
+    audio_path: str, verbose=False, sampling: SegmentSampling = None
+) -> dict:
+    """
+    Builds a feature vector through the default on-disk cache.
+
+    The cache is opened once per process at `AUTO_DIGGER_FEATURE_CACHE`, or
+    `DEFAULT_CACHE_PATH` if the environment variable is not set.
+
+    Args:
+        audio_path (str): The path to the audio file.
+        verbose (bool, optional): Whether to print progress messages. Defaults to False.
+        sampling (SegmentSampling, optional): The fast extraction mode. Defaults to the whole track.
+
+    Returns:
+        dict: A dictionary containing the features of the audio file.
+    """
+    global _default_cache
+
+    if _default_cache is None:
+        _default_cache = FeatureCache(
+            os.environ.get("AUTO_DIGGER_FEATURE_CACHE", DEFAULT_CACHE_PATH)
+        )
+
+    return _default_cache.build_feature_vector(audio_path, verbose=verbose, sampling=sampling)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect the feature cache.")
+    parser.add_argument(
+        "--path", default=DEFAULT_CACHE_PATH, help="Path to the cache file"
+    )
+    parser.add_argument(
+        "--clear", action="store_true", help="Remove every cached feature vector"
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Remove the feature vectors of other versions of the extraction code",
+    )
+    args = parser.parse_args()
+
+    cache = FeatureCache(args.path)
+    if args.prune:
+        print(f"Removed {cache.prune()} feature vectors of other versions")
+    if args.clear:
+        with cache.conn:
+            cache.conn.execute("DELETE FROM features")
+            cache.conn.execute("DELETE FROM digests")
+
+    (count,) = cache.conn.execute("SELECT COUNT(*) FROM features").fetchone()
+    print(f"{count} cached feature vectors (version {cache.version})")
@@ -0,0 +1,215 @@
+"""
+Pipelined ingest of download candidates into the feature store.
+
+Downloads (fetch and transcode, with `track_download/dl_audio.sh`) run in a
+thread pool and push finished files onto a bounded queue. Worker processes run
+`build_feature_vector` on them as they arrive, and each row is appended to the
+features CSV as soon as it is built. When the queue is full, downloads wait
+for the feature workers, so at most `queue_size` files wait for extraction.
+Extracted files stay on disk unless `delete_audio` is set, which is what
+bounds the disk use of a long run.
+
+`most_similar` rebuilds its index whenever the features CSV changes, so an
+ingested track can be queried as soon as its row is written.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from build_dataset import append_rows, build_row, check_extraction_mode, completed_tracks
+from profiling import add_profile_argument, profile_session
+from track_download.dl_all_tracks import DownloadManager, read_jobs
+from track_feature_extraction import SegmentSampling, add_sampling_arguments, sampling_from_args
+
+_DONE = None
+
+
+def ingest(
+    jobs: list[tuple[str, str]],
+    manager: DownloadManager,
+    features_path: str,
+    failures_path: str = None,
+    workers: int = None,
+    queue_size: int = 8,
+    delete_audio=False,
+    verbose=False,
+    sampling: SegmentSampling = None,
+) -> dict[str, int]:
+    """
+    Downloads and extracts the features of every job, overlapping network and CPU work.
+
+    Args:
+        jobs (list[tuple[str, str]]): The (url, audio_name) jobs, as read by `read_jobs`.
+        manager (DownloadManager): The download manager running the fetch command.
+        features_path (str): The features CSV the rows are appended to.
+        failures_path (str, optional): The CSV file failures are appended to. Defaults to `features_path` with a `.failures.csv` suffix.
+        workers (int, optional): The number of feature extraction processes. Defaults to the number of CPUs.
+        queue_size (int): The number of downloaded files waiting for extraction before downloads pause.
+        delete_audio (bool, optional): Whether to delete each audio file once its features are stored, which bounds the disk use to the queued and in-flight files. Defaults to False.
+        verbose (bool, optional): Whether to print progress messages. Defaults to False.
+        sampling (SegmentSampling, optional): The fast extraction mode, for screening
+            candidates. Defaults to the whole track.
+
+    Returns:
+        dict[str, int]: The number of ingested tracks, download failures and extraction failures.
+
+    Raises:
+        ValueError: If `features_path` was built with another extraction mode.
+    """
+    if failures_path is None:
+        failures_path = os.path.splitext(features_path)[0] + ".failures.csv"
+
+    workers = workers or os.cpu_count()
+
+    check_extraction_mode(features_path, sampling)
+
+    done = completed_tracks(features_path)
+    pending = [(url, name) for url, name in jobs if f"{name}.mp3" not in done]
+    counts = {"ingested": 0, "download_failed": 0, "extraction_failed": 0}
+
+    if verbose:
+        print(f"{len(jobs) - len(pending)} tracks already ingested, {len(pending)} remaining")
+
+    downloaded: queue.Queue = queue.Queue(maxsize=queue_size)
+    counts_lock = threading.Lock()
+
+    def download(url: str, name: str):
+        try:
+            status = manager.download(url, name)
+        except Exception as e:
+            status = "failed"
+            if verbose:
+                print(f"Error while downloading '{name}': {e!r}")
+
+        if status == "failed":
+            with counts_lock:
+                counts["download_failed"] += 1
+            if verbose:
+                print(f"Failed to download '{name}'")
+            return
+
+        # blocks while the feature workers are behind
+        downloaded.put(f"{name}.mp3")
+
+    def produce():
+        try:
+            with ThreadPoolExecutor(max_workers=manager.concurrency) as executor:
+                futures = [executor.submit(download, url, name) for url, name in pending]
+
+            # surfaces errors of `download` itself, its download failures are already counted
+            for future in futures:
+                future.result()
+        finally:
+            downloaded.put(_DONE)
+
+    os.makedirs(manager.output_dir, exist_ok=True)
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    def store(future, file_name: str):
+        try:
+            append_rows([future.result()], features_path)
+            counts["ingested"] += 1
+            if verbose:
+                print(f"Ingested '{file_name}'")
+        except Exception as e:
+            append_rows([{"audio": file_name, "error": repr(e)}], failures_path)
+            counts["extraction_failed"] += 1
+            if verbose:
+                print(f"Failed on '{file_name}': {e!r}")
+
+        if delete_audio:
+            os.remove(os.path.join(manager.output_dir, file_name))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+
+        while (file_name := downloaded.get()) is not _DONE:
+            future = executor.submit(build_row, manager.output_dir, file_name, sampling)
+            in_flight[future] = file_name
+
+            # at most one extraction per worker, the rest waits in the bounded queue
+            while len(in_flight) >= workers:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    store(future, in_flight.pop(future))
+
+        for future in wait(in_flight).done:
+            store(future, in_flight.pop(future))
+
+    producer.join()
+
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Download a queue of candidates and extract their features as they arrive."
+    )
+    parser.add_argument(
+        "queue",
+        nargs="?",
+        default="track_download/tracks_sample.csv",
+        help="Download queue CSV file",
+    )
+    parser.add_argument(
+        "--features",
+        default=None,
+        help="Features CSV to append to, defaults to track_features.csv or track_features_fast.csv with --fast",
+    )
+    parser.add_argument(
+        "--state",
+        default="track_download/youtube_downloaded/download_state.json",
+        help="Download job state file, used to resume",
+    )
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel downloads")
+    parser.add_argument("--workers", type=int, default=None, help="Feature processes")
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=8,
+        help="Downloaded files waiting for extraction before downloads pause",
+    )
+    parser.add_argument(
+        "--delete-audio",
+        action="store_true",
+        help="Delete each audio file once its features are stored, "
+        "without it every downloaded file stays on disk",
+    )
+    parser.add_argument(
+        "--command",
+        nargs="+",
+        default=None,
+        help="Fetch command, called with <url> <audio_name> <work_dir> appended, "
+        "that leaves the track in <work_dir>/out.mp3",
+    )
+    add_sampling_arguments(parser)
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    if args.features is None:
+        args.features = "track_features_fast.csv" if args.fast else "track_features.csv"
+
+    manager = DownloadManager(
+        args.state, command=args.command, concurrency=args.concurrency
+    )
+
+    with profile_session(args.profile):
+        counts = ingest(
+            read_jobs(args.queue),
+            manager,
+            args.features,
+            workers=args.workers,
+            queue_size=args.queue_size,
+            delete_audio=args.delete_audio,
+            verbose=True,
+            sampling=sampling_from_args(args),
+        )
+    print(
+        f"ingested={counts['ingested']} download_failed={counts['download_failed']} "
+        f"extraction_failed={counts['extraction_failed']}"
+    )
@@ -1,46 +1,178 @@
+import os
+from typing import TYPE_CHECKING
+
 import numpy as np
 import pandas as pd
-from sklearn.preprocessing import StandardScaler
 
-from track_feature_extraction import build_feature_vector
+from profiling import add_profile_argument, profile_session, profiler
+
+if TYPE_CHECKING:
+    from sklearn.neighbors import BallTree
+    from sklearn.preprocessing import StandardScaler
+
+FEATURES_CSV_PATH = "track_features.csv"
+INDEX_PATH = "track_features.index.joblib"
+
+
+class FeatureIndex:
+    def __init__(self, names: np.ndarray, scaler: "StandardScaler", tree: "BallTree") -> None:
+        """
+        Params
+        ======
+        `names`: name of the track of each indexed row
+        `scaler`: scaler fitted on the features of the indexed tracks
+        `tree`: nearest neighbour index over the scaled features
+        """
+        self.names = names
+        self.scaler = scaler
+        self.tree = tree
+
+    @staticmethod
+    def build(df: pd.DataFrame) -> "FeatureIndex":
+        """
+        Fits the scaler and the nearest neighbour index on a features dataframe.
+
+        Args:
+            df (pandas.DataFrame): The dataframe built with build_dataset.py.
+
+        Returns:
+            FeatureIndex: The index over every row of `df`.
+        """
+        # scikit-learn takes seconds to import, only building an index needs it
+        from sklearn.neighbors import BallTree
+        from sklearn.preprocessing import StandardScaler
+
+        X = df.iloc[:, 12:].values.astype(float)
+
+        scaler = StandardScaler()
+        tree = BallTree(scaler.fit_transform(X))
+
+        return FeatureIndex(df.iloc[:, 0].values, scaler, tree)
+
+    def save(self, index_path: str, source_path: str = None):
+        """
+        Saves the index, stamped with the size and mtime of the CSV it was built from.
+
+        Only its components are pickled, so the file does not depend on the module
+        `FeatureIndex` was imported from, `__main__` when the script runs.
+        """
+        import joblib
+
+        joblib.dump(
+            {
+                "stamp": file_stamp(source_path) if source_path else None,
+                "names": self.names,
+                "scaler": self.scaler,
+                "tree": self.tree,
+            },
+            index_path,
+        )
+
+    @staticmethod
+    def load(index_path: str, source_path: str = None):
+        """
+        Loads a saved index, or returns None if it is missing, unreadable or `source_path` changed since.
+        """
+        import joblib
+
+        if not os.path.exists(index_path):
+            return None
+
+        try:
+            saved = joblib.load(index_path)
+            index = FeatureIndex(saved["names"], saved["scaler"], saved["tree"])
+        except Exception:
+            # an index of an older format or a corrupt file is rebuilt
+            return None
+
+        if source_path and saved["stamp"] != file_stamp(source_path):
+            return None
+
+        return index
+
+    def query(self, vectors: np.ndarray, k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the nearest indexed tracks of a batch of feature vectors.
+
+        Args:
+            vectors (np.ndarray): Unscaled feature vectors, of shape (n_features,) or (n_queries, n_features).
+            k (int): The number of neighbours per query. Default is 5.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The distances and the row indices of the
+            neighbours, both of shape (n_queries, k) and sorted by distance.
+        """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=float))
+        k = min(k, len(self.names))
+
+        return self.tree.query(self.scaler.transform(vectors), k=k)
+
+
+def file_stamp(file_path: str) -> tuple[int, int]:
+    stat = os.stat(file_path)
+    return (stat.st_size, stat.st_mtime_ns)
 
 
-def most_similar(df, df_index=0, audio_path: str = "", verbose=False) -> list[str]:
+def load_or_build_index(
+    csv_path: str = FEATURES_CSV_PATH, index_path: str = INDEX_PATH
+) -> FeatureIndex:
+    """
+    Loads the saved index of a features CSV, rebuilding and saving it if the CSV changed.
+
+    Args:
+        csv_path (str): The CSV built with build_dataset.py.
+        index_path (str): The path of the saved index.
+
+    Returns:
+        FeatureIndex: The index over the rows of `csv_path`.
+    """
+    with profiler.stage("load_index"):
+        index = FeatureIndex.load(index_path, source_path=csv_path)
+
+    if index is None:
+        with profiler.stage("build_index"):
+            index = FeatureIndex.build(pd.read_csv(csv_path))
+            index.save(index_path, source_path=csv_path)
+
+    return index
+
+
+def most_similar(
+    df, df_index=0, audio_path: str = "", verbose=False, index: FeatureIndex = None
+) -> list[str]:
     """
     Calculates the most similar individuals to the given individual using the Euclidean distance between their feature vectors.
 
     Parameters:
-    df (pandas.DataFrame): The dataframe containing the individuals.
+    df (pandas.DataFrame): The dataframe containing the individuals. Only needed to build
+    the index or to read the row `df_index`, None otherwise.
     df_index (int): The index of the individual to compare to. Default is 0.
     audio_path (str): The path to an audio file to compare to. Default is an empty string.
     verbose (bool): Whether to print the closest candidates. Default is False.
+    index (FeatureIndex): A prebuilt index over `df`. Default is to build one from `df`.
 
     Returns:
     list[str]: A list of the names of the most similar individuals.
     """
-    X = df.iloc[:, 12:].values
+    if index is None:
+        index = FeatureIndex.build(df)
 
     if audio_path:
-        name = audio_path
+        from feature_cache import cached_feature_vector
+
         given_individual = np.fromiter(
-            build_feature_vector(audio_path, verbose=verbose).values(), dtype=float
+            cached_feature_vector(audio_path, verbose=verbose).values(), dtype=float
         )
 
     else:
-        name = df.iloc[df_index, 0]
         given_individual = np.array(df.iloc[df_index, 12:], dtype=float)
 
-    scaler = StandardScaler()
-    scaled_data = scaler.fit_transform(X)
-
-    scaled_given_individual = scaler.transform(given_individual.reshape(1, -1))
-
-    distances = np.linalg.norm(scaled_data - scaled_given_individual, axis=1)
-
     top_n = 5  # Number of most similar individuals to select
-    most_similar_indices = np.argsort(distances)[: (top_n + 1)][1:]
+    with profiler.stage("query_index"):
+        _, indices = index.query(given_individual, k=top_n + 1)
+    most_similar_indices = indices[0][1:]
 
-    most_similar_individuals = df.iloc[most_similar_indices, 0]
+    most_similar_individuals = index.names[most_similar_indices]
 
     if verbose:
         print("Closest candidates:")
@@ -55,9 +187,17 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Features exploration.")
     parser.add_argument("audio_file", help="Path to the audio file")
+    parser.add_argument(
+        "--features", default=FEATURES_CSV_PATH, help="CSV built with build_dataset.py"
+    )
+    parser.add_argument(
+        "--index", default=INDEX_PATH, help="Path of the saved nearest neighbour index"
+    )
+    add_profile_argument(parser)
     args = parser.parse_args()
 
-    # csv built with build_dataset.py
-    df = pd.read_csv("track_features.csv")
+    with profile_session(args.profile):
+        # the saved index holds the track names, the CSV is only read to rebuild it
+        index = load_or_build_index(args.features, args.index)
 
-    most_similar(df, audio_path=args.audio_file, verbose=True)
+        most_similar(None, audio_path=args.audio_file, verbose=True, index=index)
@@ -1,5 +1,7 @@
 import xml.etree.ElementTree as ET
+from typing import Iterator
 import argparse
+import csv
 import os
 import time
 
@@ -38,13 +40,13 @@ def explore_large_xml(xml_file: str, level: int):
             print(tab * num_tabulation + f"</{element.tag}>")
             num_tabulation -= 1
 
+            element.clear()  # clear memory, once the element is fully parsed
+
         if count > level:
             return
 
         count += 1
 
-        element.clear()  # clear memory
-
 
 def count_releases(xml_file: str) -> int:
     """
@@ -62,47 +64,333 @@ def count_releases(xml_file: str) -> int:
 
     start_time = time.time()
 
-    with open(xml_file, "r") as f:
-        for event, element in ET.iterparse(f, events=("start", "end")):
+    with open(xml_file, "rb") as f:
+        for _ in iter_releases(f):
+            count += 1
+
             if count % 1000 == 0:
                 end_time = time.time()
                 elapsed_time = end_time - start_time
                 progression = f.tell() / total_size
-                remaining_time = elapsed_time / progression
+                remaining_time = elapsed_time / progression - elapsed_time
 
                 print(
                     f"count={count} progression={(progression * 100):.2f}% elapsed={int(elapsed_time)}s remaining=~{int(remaining_time / 60.0)}m    ",
                     end="\r",
                 )
 
-            if event == "start":
-                if element.tag == "release":
-                    count += 1
+    return count
+
+
+# Columns of each table of create_release_db.sql, without the auto increment ids
+RELEASE_TABLES = {
+    "MusicRelease": ["release_id", "title", "status", "data_quality", "year", "country"],
+    "Artist": ["artist_id", "release_id", "name"],
+    "MusicLabel": ["label_id", "release_id", "catno", "name"],
+    "MusicGenre": ["release_id", "name"],
+    "MusicStyle": ["release_id", "name"],
+    "MusicFormat": ["release_id", "name", "qty"],
+    "Tracklist": ["title", "release_id"],
+    "Video": ["release_id", "title", "duration", "url"],
+}
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_release(release: ET.Element) -> dict[str, list[tuple]]:
+    """
+    Extracts the rows of every table of create_release_db.sql from a <release> element.
+
+    Args:
+        release (ET.Element): A fully parsed <release> element.
+
+    Returns:
+        dict[str, list[tuple]]: The rows of each table of `RELEASE_TABLES`, in its column order.
+    """
+    release_id = _to_int(release.get("id"))
+    released = release.findtext("released")
+
+    rows = {table: [] for table in RELEASE_TABLES}
+
+    rows["MusicRelease"].append(
+        (
+            release_id,
+            release.findtext("title"),
+            release.get("status"),
+            release.findtext("data_quality"),
+            _to_int(released[:4]) if released else None,
+            release.findtext("country"),
+        )
+    )
+
+    for artist in release.iterfind("artists/artist"):
+        rows["Artist"].append(
+            (_to_int(artist.findtext("id")), release_id, artist.findtext("name"))
+        )
+
+    for label in release.iterfind("labels/label"):
+        rows["MusicLabel"].append(
+            (_to_int(label.get("id")), release_id, label.get("catno"), label.get("name"))
+        )
+
+    for genre in release.iterfind("genres/genre"):
+        rows["MusicGenre"].append((release_id, genre.text))
+
+    for style in release.iterfind("styles/style"):
+        rows["MusicStyle"].append((release_id, style.text))
+
+    for release_format in release.iterfind("formats/format"):
+        rows["MusicFormat"].append(
+            (release_id, release_format.get("name"), _to_int(release_format.get("qty")))
+        )
+
+    for track in release.iterfind("tracklist/track"):
+        rows["Tracklist"].append((track.findtext("title"), release_id))
+
+    for video in release.iterfind("videos/video"):
+        rows["Video"].append(
+            (
+                release_id,
+                video.findtext("title"),
+                _to_int(video.get("duration")),
+                video.get("src"),
+            )
+        )
 
-            if event == "end":
-                pass
+    return rows
 
-            element.clear()  # clear memory
+
+def iter_releases(xml_file) -> Iterator[ET.Element]:
+    """
+    Streams the <release> elements of a Discogs release dump one at a time.
+
+    Each element is cleared as soon as the consumer moves to the next one, and
+    cleared elements are detached from the root, so memory does not grow with
+    the size of the dump.
+
+    Args:
+        xml_file: The path to the Discogs XML file, or a binary file object.
+
+    Yields:
+        ET.Element: Each fully parsed <release> element.
+    """
+    depth = 0
+    root = None
+
+    for event, element in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth += 1
+            continue
+
+        depth -= 1
+
+        if depth == 1 and element.tag == "release":
+            yield element
+
+            element.clear()
+            root.clear()  # drop the reference kept by the root to the cleared release
+
+
+def new_batch() -> dict[str, dict[str, list]]:
+    return {
+        table: {column: [] for column in columns}
+        for table, columns in RELEASE_TABLES.items()
+    }
+
+
+def iter_release_batches(xml_file, batch_size: int = 1000) -> Iterator[dict[str, dict[str, list]]]:
+    """
+    Streams a Discogs release dump as columnar batches of the create_release_db.sql tables.
+
+    Args:
+        xml_file: The path to the Discogs XML file, or a binary file object.
+        batch_size (int): The number of releases per batch.
+
+    Yields:
+        dict[str, dict[str, list]]: For each table of `RELEASE_TABLES`, a list of values per column.
+    """
+    batch = new_batch()
+    count = 0
+
+    for release in iter_releases(xml_file):
+        for table, rows in parse_release(release).items():
+            columns = batch[table]
+            for column, values in zip(RELEASE_TABLES[table], zip(*rows)):
+                columns[column].extend(values)
+
+        count += 1
+
+        if count == batch_size:
+            yield batch
+            batch = new_batch()
+            count = 0
+
+    if count:
+        yield batch
+
+
+def extract_to_csv(xml_file: str, output_folder: str, batch_size: int = 1000) -> int:
+    """
+    Extracts a Discogs release dump to one CSV file per table, one batch at a time.
+
+    Args:
+        xml_file (str): The path to the Discogs XML file.
+        output_folder (str): The folder of the CSV files, created if missing.
+        batch_size (int): The number of releases per batch.
+
+    Returns:
+        int: The number of extracted releases.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    files = {
+        table: open(os.path.join(output_folder, f"{table}.csv"), "w", newline="")
+        for table in RELEASE_TABLES
+    }
+    writers = {table: csv.writer(f) for table, f in files.items()}
+
+    count = 0
+    try:
+        for table, columns in RELEASE_TABLES.items():
+            writers[table].writerow(columns)
+
+        for batch in iter_release_batches(xml_file, batch_size=batch_size):
+            for table, columns in batch.items():
+                writers[table].writerows(zip(*columns.values()))
+
+            count += len(batch["MusicRelease"]["release_id"])
+    finally:
+        for f in files.values():
+            f.close()
 
     return count
 
 
+def benchmark_extraction(xml_file: str, limit: int = None, batch_size: int = 1000) -> dict:
+    """
+    Measures the throughput of `iter_release_batches` in releases per second.
+
+    Args:
+        xml_file (str): The path to the Discogs XML file.
+        limit (int, optional): Stop after this number of releases. Defaults to the whole dump.
+        batch_size (int): The number of releases per batch.
+
+    Returns:
+        dict: The number of releases, the elapsed time and the releases per second.
+    """
+    count = 0
+    start_time = time.perf_counter()
+
+    for batch in iter_release_batches(xml_file, batch_size=batch_size):
+        count += len(batch["MusicRelease"]["release_id"])
+
+        if limit is not None and count >= limit:
+            break
+
+    elapsed_time = time.perf_counter() - start_time
+
+    return {
+        "releases": count,
+        "elapsed": elapsed_time,
+        "releases_per_second": count / elapsed_time if elapsed_time > 0 else float("inf"),
+    }
+
+
 def main():
-    parser = argparse.ArgumentParser(
-        description="Explore the structure of an XML file."
+    parser = argparse.ArgumentParser(description="Explore and extract a Discogs release dump.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    explore_parser = subparsers.add_parser(
+        "explore", help="Explore the structure of an XML file"
     )
-    parser.add_argument("xml_file", help="Path to the XML file")
-    parser.add_argument(
+    explore_parser.add_argument("xml_file", help="Path to the XML file")
+    explore_parser.add_argument(
         "num_elements",
         help="Number of XML elements processed before it stops iteration",
     )
+
+    count_parser = subparsers.add_parser("count", help="Count the releases")
+    count_parser.add_argument("xml_file", help="Path to the XML file")
+
+    extract_parser = subparsers.add_parser(
+        "extract", help="Extract the releases to one CSV file per table"
+    )
+    extract_parser.add_argument("xml_file", help="Path to the XML file")
+    extract_parser.add_argument("output_folder", help="Folder of the CSV files")
+    extract_parser.add_argument("--batch-size", type=int, default=1000)
+    extract_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Parse byte-range shards in this number of processes",
+    )
+
+    index_parser = subparsers.add_parser(
+        "index", help="Index the byte offset of every release"
+    )
+    index_parser.add_argument("xml_file", help="Path to the XML or XML.GZ file")
+
+    get_parser = subparsers.add_parser(
+        "get", help="Print a single release using the offset index"
+    )
+    get_parser.add_argument("xml_file", help="Path to the XML or XML.GZ file")
+    get_parser.add_argument("release_id", type=int)
+
+    benchmark_parser = subparsers.add_parser(
+        "benchmark", help="Measure the extraction throughput"
+    )
+    benchmark_parser.add_argument("xml_file", help="Path to the XML file")
+    benchmark_parser.add_argument(
+        "--limit", type=int, default=None, help="Number of releases to extract"
+    )
+    benchmark_parser.add_argument("--batch-size", type=int, default=1000)
+
     args = parser.parse_args()
 
-    # if args.level == 0:
-    #    print(f"found {count_releases(args.xml_file)} releases")
+    if args.command == "explore":
+        explore_large_xml(args.xml_file, int(args.num_elements))
+
+    elif args.command == "count":
+        print(f"found {count_releases(args.xml_file)} releases")
+
+    elif args.command == "extract":
+        if args.workers:
+            from discogs_dump_index import parallel_extract_to_csv
+
+            count = parallel_extract_to_csv(
+                args.xml_file, args.output_folder, args.workers, args.batch_size, verbose=True
+            )
+        else:
+            count = extract_to_csv(args.xml_file, args.output_folder, args.batch_size)
+        print(f"extracted {count} releases to '{args.output_folder}'")
+
+    elif args.command == "index":
+        from discogs_dump_index import OffsetIndex, offset_index_path
+
+        index = OffsetIndex.build(args.xml_file, verbose=True)
+        index.save(offset_index_path(args.xml_file))
+        print(f"indexed {len(index)} releases to '{offset_index_path(args.xml_file)}'")
+
+    elif args.command == "get":
+        import pprint
+
+        from discogs_dump_index import read_release
+
+        pprint.pprint(read_release(args.xml_file, args.release_id))
 
-    # else:
-    explore_large_xml(args.xml_file, int(args.num_elements))
+    elif args.command == "benchmark":
+        result = benchmark_extraction(args.xml_file, args.limit, args.batch_size)
+        print(
+            f"{result['releases']} releases in {result['elapsed']:.2f}s: "
+            f"{result['releases_per_second']:.0f} releases/s"
+        )
 
 
 if __name__ == "__main__":
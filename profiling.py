@@ -0,0 +1,254 @@
+"""
+Opt-in per-stage timers and counters for the feature and training data pipelines.
+
+Code is instrumented with `profiler.stage(name)` blocks and `profiler.count(name)`
+calls. While profiling is off, a stage returns a shared no-op context manager and
+a count returns at once, so the instrumentation costs one attribute check.
+
+Stages nest: a stage opened inside another one is recorded under the path
+`outer;inner`, which is also the stack format of flame graphs. Profiling is
+enabled with the `AUTO_DIGGER_PROFILE_DIR` environment variable, so worker
+processes started by a profiled process profile too. Each process writes its
+records to `<pid>.json` in that folder whenever its outermost stage ends, and
+the profiled process merges them when it exports.
+
+CLIs add a `--profile` option with `add_profile_argument` and wrap their work in
+`with profile_session(args.profile):`. The output format depends on the file
+extension: `.json` for the aggregated records, anything else for folded stacks
+(`stage;substage self_microseconds`) readable by flamegraph.pl or speedscope.
+"""
+
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+PROFILE_DIR_ENV = "AUTO_DIGGER_PROFILE_DIR"
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class Profiler:
+    def __init__(self, profile_dir: str = None) -> None:
+        """
+        Params
+        ======
+        `profile_dir`: folder where each process writes its records, profiling is off without it
+        """
+        self.profile_dir = profile_dir
+        self.enabled = profile_dir is not None
+
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.stages: dict[str, list] = {}
+        self.counters: dict[str, int] = {}
+
+    def _check_process(self):
+        # a forked worker starts with a copy of its parent's records
+        if self.pid != os.getpid():
+            self.reset()
+
+    def stage(self, name: str):
+        """
+        Context manager timing a stage, nested under the stages open in this thread.
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+
+        return self._timed_stage(name)
+
+    @contextlib.contextmanager
+    def _timed_stage(self, name: str):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+
+        stack.append(name)
+        path = ";".join(stack)
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            stack.pop()
+
+            with self.lock:
+                self._check_process()
+                record = self.stages.setdefault(path, [0, 0.0])
+                record[0] += 1
+                record[1] += elapsed
+
+            if not stack:
+                self.dump()
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self._check_process()
+            self.counters[name] = self.counters.get(name, 0) + int(value)
+
+        if not getattr(self.local, "stack", None):
+            self.dump()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            self._check_process()
+            return {
+                "stages": {
+                    path: {"calls": calls, "seconds": seconds}
+                    for path, (calls, seconds) in self.stages.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+    def dump(self):
+        """
+        Writes the records of this process to the profile folder.
+        """
+        if self.profile_dir is None:
+            return
+
+        path = os.path.join(self.profile_dir, f"{os.getpid()}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def enable(self, profile_dir: str):
+        self.profile_dir = profile_dir
+        self.enabled = True
+        os.environ[PROFILE_DIR_ENV] = profile_dir
+
+    def disable(self):
+        self.profile_dir = None
+        self.enabled = False
+        os.environ.pop(PROFILE_DIR_ENV, None)
+
+
+profiler = Profiler(os.environ.get(PROFILE_DIR_ENV))
+
+
+def merge(snapshots: list[dict]) -> dict:
+    """
+    Sums the records of several processes.
+
+    Args:
+        snapshots (list[dict]): The `Profiler.snapshot()` of each process.
+
+    Returns:
+        dict: The merged stages and counters, with the number of processes.
+    """
+    stages: dict[str, dict] = {}
+    counters: dict[str, int] = {}
+
+    for snapshot in snapshots:
+        for path, record in snapshot["stages"].items():
+            merged = stages.setdefault(path, {"calls": 0, "seconds": 0.0})
+            merged["calls"] += record["calls"]
+            merged["seconds"] += record["seconds"]
+
+        for name, value in snapshot["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+
+    return {"processes": len(snapshots), "stages": stages, "counters": counters}
+
+
+def collect(profile_dir: str) -> dict:
+    """
+    Merges the records written by every process to a profile folder.
+    """
+    snapshots = []
+    for file_name in sorted(os.listdir(profile_dir)):
+        if file_name.endswith(".json"):
+            with open(os.path.join(profile_dir, file_name)) as f:
+                snapshots.append(json.load(f))
+
+    return merge(snapshots)
+
+
+def self_times(stages: dict[str, dict]) -> dict[str, float]:
+    """
+    Time spent in each stage outside of its substages, in seconds.
+    """
+    times = {path: record["seconds"] for path, record in stages.items()}
+
+    for path, record in stages.items():
+        parent = path.rpartition(";")[0]
+        if parent in times:
+            times[parent] -= record["seconds"]
+
+    return {path: max(seconds, 0.0) for path, seconds in times.items()}
+
+
+def export(profile: dict, output_path: str):
+    """
+    Writes a merged profile as JSON, or as folded stacks unless the file ends with `.json`.
+    """
+    with open(output_path, "w") as f:
+        if output_path.endswith(".json"):
+            json.dump(profile, f, indent=2)
+            return
+
+        for path, seconds in sorted(self_times(profile["stages"]).items()):
+            f.write(f"{path} {round(seconds * 1e6)}\n")
+
+
+def summary(profile: dict) -> str:
+    lines = [f"{'stage':<48} {'calls':>8} {'total s':>10} {'self s':>10}"]
+    own = self_times(profile["stages"])
+
+    for path, record in sorted(profile["stages"].items()):
+        lines.append(
+            f"{path:<48} {record['calls']:>8} {record['seconds']:>10.3f} {own[path]:>10.3f}"
+        )
+    for name, value in sorted(profile["counters"].items()):
+        lines.append(f"{name:<48} {value:>8}")
+
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def profile_session(output_path: str = None):
+    """
+    Profiles the block and the worker processes it starts, then exports the merged profile.
+
+    Does nothing without `output_path`.
+    """
+    if output_path is None:
+        yield
+        return
+
+    profile_dir = tempfile.mkdtemp(prefix="auto_digger_profile_")
+    profiler.reset()
+    profiler.enable(profile_dir)
+
+    try:
+        yield
+    finally:
+        profiler.dump()
+        profile = collect(profile_dir)
+        profiler.disable()
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+        export(profile, output_path)
+        print(summary(profile))
+        print(f"profile written to '{output_path}'")
+
+
+def add_profile_argument(parser):
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="PATH",
+        help="Profile the stages and write them to PATH (.json, or folded stacks otherwise)",
+    )
@@ -0,0 +1,190 @@
+"""
+Local SQLite store of Discogs releases.
+
+Writes the schema of `discogs_release_xml_parser/create_release_db.sql` into a
+SQLite file, so a full dump can be loaded and queried without a database
+server. Rows are bulk inserted with `executemany` in large transactions and the
+secondary indexes are only created once the load is done. The database is in
+WAL mode, so it can be queried while it is being loaded.
+"""
+
+import os
+import re
+import sqlite3
+import time
+
+from parse_discogs_data import RELEASE_TABLES, iter_release_batches
+
+SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "discogs_release_xml_parser",
+    "create_release_db.sql",
+)
+
+# Covering indexes of the selection queries on style, genre, year, country and label
+INDEXES = {
+    "MusicStyle_name": "MusicStyle (name, release_id)",
+    "MusicGenre_name": "MusicGenre (name, release_id)",
+    "MusicRelease_year_country": "MusicRelease (year, country)",
+    "MusicRelease_country_year": "MusicRelease (country, year)",
+    "MusicLabel_name": "MusicLabel (name, release_id)",
+    "MusicStyle_release": "MusicStyle (release_id, name)",
+    "MusicGenre_release": "MusicGenre (release_id, name)",
+    "Artist_release": "Artist (release_id)",
+    "MusicLabel_release": "MusicLabel (release_id)",
+    "MusicFormat_release": "MusicFormat (release_id, name, qty)",
+    "Tracklist_release": "Tracklist (release_id)",
+    "Video_release": "Video (release_id, url)",
+}
+
+
+def sqlite_schema() -> str:
+    """
+    Translates the MariaDB schema of create_release_db.sql to SQLite.
+
+    Returns:
+        str: The CREATE TABLE statements.
+    """
+    with open(SCHEMA_PATH) as f:
+        schema = f.read()
+
+    # INTEGER PRIMARY KEY columns are aliases of the SQLite rowid
+    schema = schema.replace("INT PRIMARY KEY AUTO_INCREMENT", "INTEGER PRIMARY KEY")
+    schema = re.sub(r"\bINT PRIMARY KEY\b", "INTEGER PRIMARY KEY", schema)
+
+    return schema
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """
+    Opens a release store, creating its tables if needed.
+
+    Args:
+        db_path (str): The path to the SQLite file.
+
+    Returns:
+        sqlite3.Connection: A connection in WAL mode.
+    """
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(sqlite_schema())
+
+    return conn
+
+
+def create_indexes(conn: sqlite3.Connection):
+    for name, definition in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def drop_indexes(conn: sqlite3.Connection):
+    for name in INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+
+
+def insert_batch(conn: sqlite3.Connection, batch: dict[str, dict[str, list]]):
+    """
+    Inserts a columnar batch of `iter_release_batches` in the current transaction.
+    """
+    for table, columns in batch.items():
+        if not columns[RELEASE_TABLES[table][0]]:
+            continue
+
+        column_names = ", ".join(columns)
+        placeholders = ", ".join("?" * len(columns))
+        conn.executemany(
+            f"INSERT INTO {table} ({column_names}) VALUES ({placeholders})",
+            zip(*columns.values()),
+        )
+
+
+def load_dump(
+    xml_file: str,
+    db_path: str,
+    batch_size: int = 1000,
+    transaction_size: int = 100_000,
+    verbose=False,
+) -> int:
+    """
+    Loads a Discogs release dump into an empty release store.
+
+    Args:
+        xml_file (str): The path to the Discogs XML file.
+        db_path (str): The path to the SQLite file, created if missing.
+        batch_size (int): The number of releases per `executemany` batch.
+        transaction_size (int): The number of releases per committed transaction.
+        verbose (bool, optional): Whether to print progress messages. Defaults to False.
+
+    Returns:
+        int: The number of loaded releases.
+    """
+    conn = connect(db_path)
+
+    (existing,) = conn.execute("SELECT COUNT(*) FROM MusicRelease").fetchone()
+    if existing:
+        raise Exception(f"'{db_path}' already contains {existing} releases")
+
+    drop_indexes(conn)
+
+    # a crash during the load leaves an incomplete store to reload anyway
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA foreign_keys=OFF")
+
+    count = 0
+    uncommitted = 0
+    start_time = time.time()
+
+    try:
+        for batch in iter_release_batches(xml_file, batch_size=batch_size):
+            insert_batch(conn, batch)
+
+            batch_count = len(batch["MusicRelease"]["release_id"])
+            count += batch_count
+            uncommitted += batch_count
+
+            if uncommitted >= transaction_size:
+                conn.commit()
+                uncommitted = 0
+
+                if verbose:
+                    elapsed_time = time.time() - start_time
+                    print(
+                        f"loaded {count} releases, {count / elapsed_time:.0f} releases/s",
+                        end="\r",
+                    )
+
+        conn.commit()
+
+        if verbose:
+            print(f"\nloaded {count} releases, creating indexes...")
+
+        conn.execute("PRAGMA synchronous=NORMAL")
+        create_indexes(conn)
+    finally:
+        conn.close()
+
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Load a Discogs release dump into a local SQLite file."
+    )
+    parser.add_argument("xml_file", help="Path to the Discogs XML file")
+    parser.add_argument("db_path", help="Path to the SQLite file")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--transaction-size", type=int, default=100_000)
+    args = parser.parse_args()
+
+    load_dump(
+        args.xml_file,
+        args.db_path,
+        batch_size=args.batch_size,
+        transaction_size=args.transaction_size,
+        verbose=True,
+    )
@@ -0,0 +1,205 @@
+"""
+Selects niche download candidates from the SQLite release store.
+
+Releases are filtered through the indexes of `release_store` on style, genre,
+year, country and label, and capped on popularity by their number of videos.
+The output is a download queue for `track_download/dl_all_tracks.py` with one
+row per video and the list of styles of its releases.
+"""
+
+import csv
+import random
+import sqlite3
+
+QUEUE_COLUMNS = ["id", "release_id", "title", "url", "style"]
+STYLE_SEPARATOR = ";"
+
+
+def _in_clause(column: str, values: list) -> tuple[str, list]:
+    return f"{column} IN ({', '.join('?' * len(values))})", list(values)
+
+
+def select_releases_query(
+    styles: list[str] = None,
+    genres: list[str] = None,
+    countries: list[str] = None,
+    labels: list[str] = None,
+    year_from: int = None,
+    year_to: int = None,
+    max_videos: int = None,
+) -> tuple[str, list]:
+    """
+    Builds the query of the ids of the releases matching every given filter.
+
+    Args:
+        styles (list[str], optional): Keep releases with at least one of these styles.
+        genres (list[str], optional): Keep releases with at least one of these genres.
+        countries (list[str], optional): Keep releases from one of these countries.
+        labels (list[str], optional): Keep releases on one of these labels.
+        year_from (int, optional): Keep releases from this year on.
+        year_to (int, optional): Keep releases up to this year.
+        max_videos (int, optional): Popularity cap, keep releases with at most this number of videos.
+
+    Returns:
+        tuple[str, list]: The SQL query and its parameters.
+    """
+    conditions = []
+    params = []
+
+    for table, values in (
+        ("MusicStyle", styles),
+        ("MusicGenre", genres),
+        ("MusicLabel", labels),
+    ):
+        if values:
+            clause, clause_params = _in_clause("name", values)
+            conditions.append(
+                f"r.release_id IN (SELECT release_id FROM {table} WHERE {clause})"
+            )
+            params += clause_params
+
+    if countries:
+        clause, clause_params = _in_clause("r.country", countries)
+        conditions.append(clause)
+        params += clause_params
+
+    if year_from is not None:
+        conditions.append("r.year >= ?")
+        params.append(year_from)
+
+    if year_to is not None:
+        conditions.append("r.year <= ?")
+        params.append(year_to)
+
+    if max_videos is not None:
+        conditions.append(
+            "(SELECT COUNT(*) FROM Video v WHERE v.release_id = r.release_id) <= ?"
+        )
+        params.append(max_videos)
+
+    where = " AND ".join(conditions) if conditions else "1"
+
+    return f"SELECT r.release_id FROM MusicRelease r WHERE {where}", params
+
+
+def select_candidates(
+    conn: sqlite3.Connection, limit: int = None, seed: int = 42, **filters
+) -> list[dict]:
+    """
+    Selects the videos of the matching releases, one entry per video url.
+
+    Args:
+        conn (sqlite3.Connection): A connection to a release store.
+        limit (int, optional): Randomly sample this number of videos. Defaults to all of them.
+        seed (int): The seed of the sampling.
+        **filters: The filters of `select_releases_query`.
+
+    Returns:
+        list[dict]: The download queue rows, with the styles of all the releases of each video.
+    """
+    releases_query, params = select_releases_query(**filters)
+
+    rows = conn.execute(
+        f"""
+        WITH selected AS ({releases_query})
+        SELECT v.id, v.release_id, v.title, v.url, s.name
+        FROM Video v
+        JOIN selected USING (release_id)
+        LEFT JOIN MusicStyle s ON s.release_id = v.release_id
+        WHERE v.url IS NOT NULL
+        ORDER BY v.id, s.id
+        """,
+        params,
+    )
+
+    queue: dict[str, dict] = {}
+    for video_id, release_id, title, url, style in rows:
+        if url not in queue:
+            queue[url] = {
+                "id": video_id,
+                "release_id": release_id,
+                "title": title,
+                "url": url,
+                "style": [],
+            }
+
+        if style is not None and style not in queue[url]["style"]:
+            queue[url]["style"].append(style)
+
+    candidates = list(queue.values())
+
+    if limit is not None and limit < len(candidates):
+        candidates = random.Random(seed).sample(candidates, limit)
+
+    return candidates
+
+
+def write_queue(candidates: list[dict], output_path: str):
+    """
+    Writes a download queue in the CSV format of `track_download/tracks_sample.csv`,
+    where the text fields are quoted and the ids are not.
+    """
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+        writer.writerow(QUEUE_COLUMNS)
+
+        for candidate in candidates:
+            writer.writerow(
+                [
+                    candidate["id"],
+                    candidate["release_id"],
+                    candidate["title"],
+                    candidate["url"],
+                    STYLE_SEPARATOR.join(candidate["style"]),
+                ]
+            )
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description="Select niche candidates and write a deduplicated download queue."
+    )
+    parser.add_argument("db_path", help="Release store built with release_store.py")
+    parser.add_argument(
+        "--output",
+        default="track_download/tracks_sample.csv",
+        help="Download queue CSV file",
+    )
+    parser.add_argument("--style", action="append", help="Style, can be repeated")
+    parser.add_argument("--genre", action="append", help="Genre, can be repeated")
+    parser.add_argument("--country", action="append", help="Country, can be repeated")
+    parser.add_argument("--label", action="append", help="Label, can be repeated")
+    parser.add_argument("--year-from", type=int)
+    parser.add_argument("--year-to", type=int)
+    parser.add_argument(
+        "--max-videos",
+        type=int,
+        help="Popularity cap: maximum number of videos of a release",
+    )
+    parser.add_argument("--limit", type=int, help="Number of videos to sample")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    start_time = time.time()
+
+    conn = sqlite3.connect(args.db_path)
+    candidates = select_candidates(
+        conn,
+        limit=args.limit,
+        seed=args.seed,
+        styles=args.style,
+        genres=args.genre,
+        countries=args.country,
+        labels=args.label,
+        year_from=args.year_from,
+        year_to=args.year_to,
+        max_videos=args.max_videos,
+    )
+    write_queue(candidates, args.output)
+
+    print(
+        f"wrote {len(candidates)} videos to '{args.output}' in {time.time() - start_time:.2f}s"
+    )
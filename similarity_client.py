@@ -0,0 +1,103 @@
+"""
+Thin client of `similarity_server.py`.
+
+Only imports the standard library, so a query costs a process start and a
+localhost round trip.
+
+Usage:
+    python similarity_client.py features <audio_file>... [--k 5]
+    python similarity_client.py features --name <indexed track name>
+    python similarity_client.py siamese <audio_file>... [--k 10]
+    python similarity_client.py reload
+    python similarity_client.py health
+"""
+
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+DEFAULT_URL = "http://127.0.0.1:8765"
+
+
+def request(url: str, endpoint: str, body: dict = None, timeout: float = 600) -> dict:
+    """
+    Sends a request to the similarity service.
+
+    Args:
+        url (str): The base URL of the service.
+        endpoint (str): The endpoint, like `/features`.
+        body (dict, optional): The JSON body of a POST request. Defaults to a GET request.
+        timeout (float): The timeout in seconds.
+
+    Returns:
+        dict: The decoded JSON response.
+    """
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(
+        url + endpoint, data=data, headers={"Content-Type": "application/json"}
+    )
+
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise Exception(json.load(e).get("error", str(e))) from None
+
+
+def print_results(queries: list[str], results: list[list[dict]]):
+    for query, matches in zip(queries, results):
+        print(f"{query}:")
+        for match in matches:
+            print(f"  {match['distance']:.4f}  {match['audio']}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query a running similarity service.")
+    parser.add_argument("--url", default=DEFAULT_URL, help="Base URL of the service")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    features_parser = subparsers.add_parser("features", help="closest tracks by features")
+    features_parser.add_argument("audio_files", nargs="*", help="Audio files to analyse")
+    features_parser.add_argument(
+        "--name", action="append", default=[], help="Indexed track name, can be repeated"
+    )
+    features_parser.add_argument("--k", type=int, default=5)
+
+    siamese_parser = subparsers.add_parser("siamese", help="closest tracks by siamese model")
+    siamese_parser.add_argument("audio_files", nargs="+", help="Audio files to embed")
+    siamese_parser.add_argument("--k", type=int, default=10)
+
+    subparsers.add_parser("reload", help="reload the data of the service")
+    subparsers.add_parser("health", help="show what the service has loaded")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "features":
+            # the service may run in another working directory
+            audio_paths = [os.path.abspath(path) for path in args.audio_files]
+            queries = [{"audio_path": path} for path in audio_paths]
+            queries += [{"name": name} for name in args.name]
+
+            response = request(args.url, "/features", {"queries": queries, "k": args.k})
+            print_results(audio_paths + args.name, response["results"])
+
+        elif args.command == "siamese":
+            audio_paths = [os.path.abspath(path) for path in args.audio_files]
+
+            response = request(args.url, "/siamese", {"queries": audio_paths, "k": args.k})
+            print_results(audio_paths, response["results"])
+
+        elif args.command == "reload":
+            print(json.dumps(request(args.url, "/reload", {}), indent=2))
+
+        else:
+            print(json.dumps(request(args.url, "/health"), indent=2))
+
+    except (urllib.error.URLError, ConnectionError) as e:
+        sys.exit(f"Cannot reach the similarity service at {args.url}: {e}")
+    except Exception as e:
+        sys.exit(f"Query failed: {e}")
@@ -0,0 +1,308 @@
+"""
+Long-running similarity query service over localhost HTTP.
+
+The features CSV, its nearest neighbour index and the feature cache are loaded
+once, and so are the siamese model and its embedding store when they are given.
+Queries are then answered without paying the imports and loading of
+`most_similar.py` or `tracks_similarity/similarity.py` on every run.
+
+Endpoints, all with JSON bodies:
+
+- `GET /health`: what is loaded
+- `POST /features`: `{"queries": [{"audio_path": ...} or {"name": ...}], "k": 5}`
+- `POST /siamese`: `{"queries": ["<audio_path>", ...], "k": 10}`, needs `--model` and `--store`
+- `POST /reload`: reloads the features, the index, the store and a changed model
+
+Every query of a request is answered in one batch: one index query for the
+feature vectors, one encoder call for the siamese windows. `similarity_client.py`
+is a client without heavy imports.
+"""
+
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from feature_cache import DEFAULT_CACHE_PATH, FeatureCache
+from most_similar import FEATURES_CSV_PATH, INDEX_PATH, file_stamp, load_or_build_index
+from track_feature_extraction import build_feature_vector
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+SIMILARITY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tracks_similarity")
+
+
+class QueryError(Exception):
+    pass
+
+
+class SimilarityService:
+    def __init__(
+        self,
+        features_path: str = FEATURES_CSV_PATH,
+        index_path: str = INDEX_PATH,
+        cache_path: str = None,
+        model_path: str = None,
+        store_path: str = None,
+    ) -> None:
+        """
+        Params
+        ======
+        `features_path`: features CSV built with build_dataset.py
+        `index_path`: saved nearest neighbour index, rebuilt when the CSV changes
+        `cache_path`: feature cache of the queried audio files
+        `model_path`: siamese model, siamese queries are disabled without it
+        `store_path`: embedding store built with `similarity.py embed`
+        """
+        self.features_path = features_path
+        self.index_path = index_path
+        self.cache_path = cache_path or os.environ.get(
+            "AUTO_DIGGER_FEATURE_CACHE", DEFAULT_CACHE_PATH
+        )
+        self.model_path = model_path
+        self.store_path = store_path
+
+        # every request runs in a new thread, they share one connection to the cache
+        self.feature_cache = FeatureCache(self.cache_path, check_same_thread=False)
+        self.cache_lock = threading.Lock()
+        self.model_lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+
+        self.features = None
+        self.model = None
+        self.model_stamp = None
+        self.encoder = None
+        self.store = None
+
+        self.reload()
+
+    def _feature_vector(self, audio_path: str) -> dict:
+        # features are extracted outside of the lock, queries only wait for each other on the cache
+        with self.cache_lock:
+            features = self.feature_cache.get(audio_path)
+
+        if features is None:
+            features = build_feature_vector(audio_path)
+            with self.cache_lock:
+                self.feature_cache.put(audio_path, features)
+
+        return features
+
+    def _load_features(self) -> dict:
+        df = pd.read_csv(self.features_path)
+        names = df.iloc[:, 0].astype(str).values
+
+        return {
+            "df": df,
+            "index": load_or_build_index(self.features_path, self.index_path),
+            "rows": {name: row for row, name in enumerate(names)},
+            "stamp": file_stamp(self.features_path),
+        }
+
+    def _load_siamese(self):
+        if SIMILARITY_DIR not in sys.path:
+            sys.path.append(SIMILARITY_DIR)
+
+        from embedding_store import EmbeddingStore
+
+        self.store = EmbeddingStore(self.store_path)
+
+        stamp = file_stamp(self.model_path)
+        if stamp != self.model_stamp:
+            from similarity import extract_encoder, load_siamese_model
+
+            model = load_siamese_model(self.model_path)
+            with self.model_lock:
+                self.model = model
+                self.encoder = extract_encoder(model)
+                self.model_stamp = stamp
+
+    def reload(self) -> dict:
+        """
+        Loads the features, the index and the store again, and the model if its file changed.
+
+        Queries keep being answered with the previous data until the new data is loaded.
+        """
+        with self.reload_lock:
+            self.features = self._load_features()
+
+            if self.model_path and self.store_path:
+                self._load_siamese()
+
+        return self.health()
+
+    def health(self) -> dict:
+        return {
+            "features_path": self.features_path,
+            "tracks": len(self.features["rows"]),
+            "siamese": self.store is not None,
+            "store_tracks": len(self.store.paths) if self.store is not None else 0,
+        }
+
+    def query_features(self, queries: list[dict], k: int = 5) -> list[list[dict]]:
+        """
+        Finds the closest indexed tracks of a batch of queries, in one index query.
+
+        Args:
+            queries (list[dict]): Each with an `audio_path` to analyse, or the `name` of an indexed track.
+            k (int): The number of results per query.
+
+        Returns:
+            list[list[dict]]: The `audio` name and `distance` of the results of each query,
+            the queried track itself being left out.
+        """
+        features = self.features
+        df = features["df"]
+
+        vectors = []
+        exclude = []
+        for query in queries:
+            if "name" in query:
+                row = features["rows"].get(query["name"])
+                if row is None:
+                    raise QueryError(f"Unknown track '{query['name']}'")
+
+                vectors.append(np.asarray(df.iloc[row, 12:], dtype=float))
+                exclude.append(query["name"])
+
+            elif "audio_path" in query:
+                feature_vector = self._feature_vector(query["audio_path"])
+                vectors.append(np.fromiter(feature_vector.values(), dtype=float))
+                exclude.append(os.path.basename(query["audio_path"]))
+
+            else:
+                raise QueryError("A query needs a 'name' or an 'audio_path'")
+
+        distances, indices = features["index"].query(np.stack(vectors), k=k + 1)
+
+        results = []
+        for query_distances, query_indices, excluded in zip(distances, indices, exclude):
+            names = features["index"].names[query_indices]
+            matches = [
+                {"audio": str(name), "distance": float(distance)}
+                for name, distance in zip(names, query_distances)
+                if os.path.basename(str(name)) != excluded
+            ]
+            results.append(matches[:k])
+
+        return results
+
+    def query_siamese(self, audio_paths: list[str], k: int = 10) -> list[list[dict]]:
+        """
+        Ranks the embedding store against a batch of tracks, embedded in one encoder call.
+
+        Args:
+            audio_paths (list[str]): The paths of the query tracks.
+            k (int): The number of results per query.
+
+        Returns:
+            list[list[dict]]: The `audio` path and `distance` of the results of each query.
+        """
+        if self.store is None:
+            raise QueryError("The service was started without --model and --store")
+
+        from similarity import embed_tracks
+
+        store = self.store
+        with self.model_lock:
+            embeddings = embed_tracks(
+                audio_paths, self.encoder, store.offsets, store.window_length
+            )
+
+        return [
+            [
+                {"audio": path, "distance": distance}
+                for path, distance in store.rank(query_embeddings)[:k]
+            ]
+            for query_embeddings in embeddings
+        ]
+
+
+class SimilarityRequestHandler(BaseHTTPRequestHandler):
+    service: SimilarityService = None
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, self.service.health())
+        else:
+            self._send(404, {"error": f"Unknown endpoint '{self.path}'"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+
+            if self.path == "/features":
+                results = self.service.query_features(request["queries"], k=request.get("k", 5))
+                self._send(200, {"results": results})
+
+            elif self.path == "/siamese":
+                results = self.service.query_siamese(request["queries"], k=request.get("k", 10))
+                self._send(200, {"results": results})
+
+            elif self.path == "/reload":
+                self._send(200, self.service.reload())
+
+            else:
+                self._send(404, {"error": f"Unknown endpoint '{self.path}'"})
+
+        except (QueryError, KeyError, ValueError, FileNotFoundError) as e:
+            self._send(400, {"error": repr(e)})
+        except Exception as e:
+            self._send(500, {"error": repr(e)})
+
+
+def serve(service: SimilarityService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+    """
+    Answers queries until interrupted.
+    """
+    handler = type("Handler", (SimilarityRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+
+    print(f"Serving similarity queries on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.feature_cache.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve similarity queries with warm data.")
+    parser.add_argument(
+        "--features", default=FEATURES_CSV_PATH, help="CSV built with build_dataset.py"
+    )
+    parser.add_argument(
+        "--index", default=INDEX_PATH, help="Path of the saved nearest neighbour index"
+    )
+    parser.add_argument("--model", default=None, help="Trained siamese model")
+    parser.add_argument(
+        "--store", default=None, help="Embedding store built with similarity.py embed"
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    service = SimilarityService(
+        args.features, args.index, model_path=args.model, store_path=args.store
+    )
+    serve(service, args.host, args.port)
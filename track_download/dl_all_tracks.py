@@ -1,16 +1,233 @@
+"""
+Download every track of a download queue with bounded concurrency.
+
+Each job runs the fetch command (`dl_audio.sh` by default) in its own work
+folder, where the command leaves `out.mp3`. The file is then moved to the
+output folder in one atomic rename, so a partial download never looks
+complete. A job is retried with exponential backoff when it fails, unless the
+command cannot be started at all. The state of every job is saved to a JSON
+file after each attempt, and tracks whose output file already exists are
+skipped, so an interrupted run resumes where it stopped.
+"""
+
+import json
+import os
+import shutil
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pandas as pd
 
-df = pd.read_csv("tracks_sample.csv")
-df = df.drop_duplicates(subset=["id"])
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = os.path.join(SCRIPT_DIR, "youtube_downloaded")
+WORK_OUTPUT = "out.mp3"  # file the fetch command leaves in its work folder
+
+
+class DownloadManager:
+    def __init__(
+        self,
+        state_path: str,
+        command: list[str] = None,
+        output_dir: str = OUTPUT_DIR,
+        concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 5.0,
+        timeout: float = 30 * 60,
+    ) -> None:
+        """
+        Params
+        ======
+        `state_path`: JSON file of the state of every job, created if missing
+        `command`: fetch command, called with `<url> <audio_name> <work_dir>` appended,
+        that leaves the track in `<work_dir>/out.mp3`
+        `output_dir`: folder the tracks are moved to, as `<audio_name>.mp3`
+        `concurrency`: number of downloads running at once
+        `retries`: number of retries of a failed download
+        `backoff`: delay before the first retry in seconds, doubled on each retry
+        `timeout`: maximum duration of one attempt in seconds
+        """
+        self.state_path = state_path
+        self.command = command or [os.path.join(SCRIPT_DIR, "dl_audio.sh")]
+        self.output_dir = output_dir
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.lock = threading.Lock()
+        self.state: dict[str, dict] = {}
+
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def output_path(self, audio_name: str) -> str:
+        return os.path.join(self.output_dir, f"{audio_name}.mp3")
+
+    def work_dir(self, audio_name: str) -> str:
+        return os.path.join(self.output_dir, "work", audio_name)
+
+    def is_complete(self, audio_name: str) -> bool:
+        output_path = self.output_path(audio_name)
+        return os.path.exists(output_path) and os.path.getsize(output_path) > 0
+
+    def _update_state(self, audio_name: str, **fields):
+        with self.lock:
+            self.state.setdefault(audio_name, {}).update(fields)
+
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(tmp_path, self.state_path)
+
+    def download(self, url: str, audio_name: str) -> str:
+        """
+        Runs one job until it succeeds or runs out of retries.
+
+        Returns
+        =======
+        the final status of the job: "done", "skipped" or "failed"
+        """
+        if self.is_complete(audio_name):
+            self._update_state(audio_name, url=url, status="done")
+            return "skipped"
+
+        attempts = self.state.get(audio_name, {}).get("attempts", 0)
+
+        for retry in range(self.retries + 1):
+            if retry > 0:
+                time.sleep(self.backoff * 2 ** (retry - 1))
+
+            work_dir = self.work_dir(audio_name)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+            attempts += 1
+            self._update_state(audio_name, url=url, status="running", attempts=attempts)
+
+            try:
+                out = subprocess.run(
+                    [*self.command, url, audio_name, work_dir],
+                    capture_output=True,
+                    text=True,
+                    timeout=self.timeout,
+                )
+                error = out.stderr.strip()[-500:] if out.returncode != 0 else None
+            except subprocess.TimeoutExpired:
+                error = f"timeout after {self.timeout}s"
+            except (OSError, subprocess.SubprocessError) as e:
+                # the command cannot be run at all, retrying would not help
+                self._update_state(audio_name, status="failed", error=repr(e))
+                return "failed"
+
+            # the work folder is inside the output folder, the move is a rename
+            work_output = os.path.join(work_dir, WORK_OUTPUT)
+            if error is None and os.path.exists(work_output):
+                os.makedirs(self.output_dir, exist_ok=True)
+                os.replace(work_output, self.output_path(audio_name))
+
+            if error is None and self.is_complete(audio_name):
+                shutil.rmtree(work_dir, ignore_errors=True)
+                self._update_state(audio_name, status="done", error=None)
+                return "done"
+
+            self._update_state(
+                audio_name, status="failed", error=error or "no output file"
+            )
+
+        return "failed"
+
+    def run(self, jobs: list[tuple[str, str]], verbose=False) -> dict[str, int]:
+        """
+        Runs every (url, audio_name) job not already done.
+
+        Returns
+        =======
+        the number of jobs per final status
+        """
+        pending = [
+            (url, audio_name)
+            for url, audio_name in jobs
+            if self.state.get(audio_name, {}).get("status") != "done"
+            or not self.is_complete(audio_name)
+        ]
+        counts = {"done": len(jobs) - len(pending), "skipped": 0, "failed": 0}
+
+        if verbose:
+            print(f"{counts['done']} tracks already downloaded, {len(pending)} remaining")
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {
+                executor.submit(self.download, url, audio_name): audio_name
+                for url, audio_name in pending
+            }
+
+            for count, future in enumerate(as_completed(futures), start=1):
+                audio_name = futures[future]
+
+                try:
+                    status = future.result()
+                except Exception as e:
+                    status = "failed"
+                    self._update_state(audio_name, status="failed", error=repr(e))
+                counts[status] += 1
+
+                if verbose:
+                    print(f"[{count}/{len(pending)}] {audio_name}: {status}")
+
+        return counts
+
+
+def read_jobs(queue_path: str) -> list[tuple[str, str]]:
+    """
+    Reads the (url, audio_name) jobs of a download queue like tracks_sample.csv.
+    """
+    df = pd.read_csv(queue_path)
+    df = df.drop_duplicates(subset=["id"])
+
+    return [(str(row["url"]), str(row["id"])) for _, row in df.iterrows()]
+
+
+if __name__ == "__main__":
+    import argparse
 
-for id, row in df.iterrows():
-    url = "{}".format(row["url"])
-    id = row["id"]
+    parser = argparse.ArgumentParser(description="Download the tracks of a queue.")
+    parser.add_argument(
+        "queue", nargs="?", default="tracks_sample.csv", help="Download queue CSV file"
+    )
+    parser.add_argument(
+        "--state",
+        default=os.path.join(OUTPUT_DIR, "download_state.json"),
+        help="Job state file, used to resume",
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument(
+        "--backoff", type=float, default=5.0, help="Delay before the first retry"
+    )
+    parser.add_argument(
+        "--command",
+        nargs="+",
+        default=None,
+        help="Fetch command, called with <url> <audio_name> <work_dir> appended, "
+        "that leaves the track in <work_dir>/out.mp3",
+    )
+    args = parser.parse_args()
 
-    args = ["./dl_audio.sh", url, str(id)]
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    print(f'executing: {" ".join(args)}')
-    out = subprocess.run(args)
+    manager = DownloadManager(
+        args.state,
+        command=args.command,
+        concurrency=args.concurrency,
+        retries=args.retries,
+        backoff=args.backoff,
+    )
+    counts = manager.run(read_jobs(args.queue), verbose=True)
 
-    print("The exit code was: %d" % out.returncode)
+    print(
+        f"done={counts['done']} skipped={counts['skipped']} failed={counts['failed']}"
+    )
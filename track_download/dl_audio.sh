@@ -1,23 +1,24 @@
 #!/usr/bin/bash
 
-if [ -z "$1" ]
+if [ -z "$3" ]
   then
-    echo "Usage: $0 <url> <audio_name>"
+    echo "Usage: $0 <url> <audio_name> <work_dir>"
     echo '<url> should be surrounded by quotation marks: e.g "https://www.youtube.com/watch?v=9StMS1iXdho"'
-    exit
+    echo '<work_dir> is a folder used only by this download, created if missing'
+    echo 'the track is left in <work_dir>/out.mp3, dl_all_tracks.py moves it to its output folder'
+    exit 1
 fi
 
-SCRIPT_DIR=`dirname "$0"`
+set -e
+
+WORK_DIR="$3"
+mkdir -p "$WORK_DIR"
 
 yt-dlp "$1" --add-header User-Agent:"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.4 Safari/605.1.15" \
-    -o "$SCRIPT_DIR/youtube_downloaded/out.%(ext)s" \
+    -o "$WORK_DIR/out.%(ext)s" \
     -x --remux-video "webm>ogg/opus>ogg/m4a>ogg" \
     -f "bestaudio" \
-    --add-metadata
+    --add-metadata \
     --no-part
 
-ffmpeg -i "$SCRIPT_DIR/youtube_downloaded/out.ogg"  -ar 44100 -b:a 256k -map_metadata 0 -map_metadata 0:s:0 -id3v2_version 3 -vn "$SCRIPT_DIR/youtube_downloaded/out.mp3"
-
-mv "$SCRIPT_DIR/youtube_downloaded/out.mp3" "$SCRIPT_DIR/youtube_downloaded/$2.mp3"
-
-rm "$SCRIPT_DIR/youtube_downloaded/out.ogg"
+ffmpeg -y -i "$WORK_DIR/out.ogg"  -ar 44100 -b:a 256k -map_metadata 0 -map_metadata 0:s:0 -id3v2_version 3 -vn "$WORK_DIR/out.mp3"
@@ -1,6 +1,60 @@
+import os
+from typing import NamedTuple
+
 import numpy as np
 import librosa
 
+from profiling import add_profile_argument, profile_session, profiler
+
+SAMPLE_RATE = 44100
+N_FFT = 2048
+HOP_LENGTH = 512
+
+# the lowest spectral contrast band, above 200 Hz, must fit below the Nyquist frequency
+MIN_SAMPLE_RATE = 800
+
+
+class SegmentSampling(NamedTuple):
+    """
+    Fast extraction mode: only a few short segments of a track are decoded.
+
+    Fields:
+        sr (int): The sample rate the segments are resampled to.
+        positions (tuple[float, ...]): The centre of each segment, as a fraction of
+            the track duration, like intro, middle and drop.
+        seconds (float): The length of each segment in seconds.
+    """
+
+    sr: int = 22050
+    positions: tuple[float, ...] = (0.15, 0.5, 0.75)
+    seconds: float = 20.0
+
+    def offsets(self, duration: float) -> list[float]:
+        """
+        Gets the start of each segment in a track, segments being kept inside the track.
+
+        Returns:
+            list[float]: The offsets in seconds, or None when the segments would cover
+            the whole track anyway.
+
+        Example:
+            >>> SegmentSampling(positions=(0.5,), seconds=5.0).offsets(90.0)
+            [42.5]
+            >>> SegmentSampling(positions=(0.15, 0.5), seconds=5.0).offsets(8.0) is None
+            True
+        """
+        if duration <= len(self.positions) * self.seconds:
+            return None
+
+        return [
+            min(max(position * duration - self.seconds / 2, 0.0), duration - self.seconds)
+            for position in self.positions
+        ]
+
+    def key(self) -> str:
+        positions = ",".join(f"{position:g}" for position in self.positions)
+        return f"segments({positions})x{self.seconds:g}s@{self.sr}"
+
 
 def describe(freqs, key_prefix=None) -> dict[str, float]:
     """
@@ -13,13 +67,14 @@ def describe(freqs, key_prefix=None) -> dict[str, float]:
     Returns:
         dict[str, float]: A dictionary containing the statistics of the given frequencies.
     """
-    mean = np.mean(freqs)
-    std = np.std(freqs)
-    maxv = np.amax(freqs)
-    minv = np.amin(freqs)
-    median = np.median(freqs)
-    q1 = np.quantile(freqs, 0.25)
-    q3 = np.quantile(freqs, 0.75)
+    with profiler.stage("describe"):
+        mean = np.mean(freqs)
+        std = np.std(freqs)
+        maxv = np.amax(freqs)
+        minv = np.amin(freqs)
+        median = np.median(freqs)
+        q1 = np.quantile(freqs, 0.25)
+        q3 = np.quantile(freqs, 0.75)
 
     return {
         key_prefix + "mean": mean,
@@ -32,79 +87,288 @@ def describe(freqs, key_prefix=None) -> dict[str, float]:
     }
 
 
-def build_feature_vector(audio_path: str, verbose=False) -> dict:
+def describe_fftfreq(n: int, key_prefix=None) -> dict[str, float]:
     """
-    Builds a feature vector from the given audio file.
+    Get the statistics of `np.fft.fftfreq(n)` without materializing the array.
+
+    The FFT sample frequencies of a length `n` signal are an arithmetic progression
+    of step `1 / n`, so every statistic computed by `describe` has a closed form.
 
     Args:
-        audio_path (str): The path to the audio file.
-        verbose (bool, optional): Whether to print progress messages. Defaults to False.
+        n (int): The number of samples of the signal.
+        key_prefix (str, optional): The prefix to add to the keys of the returned dictionary. Defaults to None.
 
     Returns:
-        dict: A dictionary containing the features of the audio file.
+        dict[str, float]: The same dictionary as `describe(np.fft.fftfreq(n), key_prefix)`.
     """
-    if verbose:
-        print(f"Calculating features of '{audio_path}'...")
-    x, sr = librosa.load(audio_path, sr=44100)
+    lowest = -(n // 2)
+    highest = (n - 1) // 2
+
+    def quantile(q: float) -> np.float64:
+        # linear interpolation between sorted values is exact on a progression
+        return np.float64((lowest + q * (n - 1)) / n)
+
+    return {
+        key_prefix + "mean": np.float64((lowest + highest) / (2 * n)),
+        key_prefix + "std": np.float64(np.sqrt((n**2 - 1) / 12.0) / n),
+        key_prefix + "maxv": np.float64(highest / n),
+        key_prefix + "minv": np.float64(lowest / n),
+        key_prefix + "median": quantile(0.5),
+        key_prefix + "q1": quantile(0.25),
+        key_prefix + "q3": quantile(0.75),
+    }
+
+
+def frame_sizes(sr: int) -> tuple[int, int]:
+    """
+    Gets the FFT and hop lengths giving the frames of `SAMPLE_RATE` the same duration at `sr`.
+
+    Returns:
+        tuple[int, int]: `N_FFT` and `HOP_LENGTH` scaled by `sr / SAMPLE_RATE`.
+    """
+    return round(N_FFT * sr / SAMPLE_RATE), round(HOP_LENGTH * sr / SAMPLE_RATE)
+
+
+def spectral_intermediates(
+    x: np.ndarray, sr: int, n_fft: int = N_FFT, hop_length: int = HOP_LENGTH
+) -> dict[str, np.ndarray]:
+    """
+    Computes the spectral representations shared by every feature of `build_feature_vector`.
+
+    Args:
+        x (np.ndarray): The audio signal.
+        sr (int): The sample rate of the audio signal.
+        n_fft (int, optional): The FFT length. Defaults to `N_FFT`.
+        hop_length (int, optional): The hop length. Defaults to `HOP_LENGTH`.
+
+    Returns:
+        dict[str, np.ndarray]: The magnitude spectrogram (`S`), the log-power mel
+        spectrogram (`log_mel`) and the onset strength envelope (`onset_envelope`).
+    """
+    S = np.abs(librosa.stft(x, n_fft=n_fft, hop_length=hop_length))
+    mel = librosa.feature.melspectrogram(S=S**2, sr=sr)
+    log_mel = librosa.power_to_db(mel)
+    onset_envelope = librosa.onset.onset_strength(S=log_mel, sr=sr)
+
+    return {"S": S, "log_mel": log_mel, "onset_envelope": onset_envelope}
+
+
+def features_from_signal(
+    x: np.ndarray,
+    sr: int,
+    n_fft: int = N_FFT,
+    hop_length: int = HOP_LENGTH,
+    n_samples: int = None,
+) -> dict:
+    """
+    Builds a feature vector from an already decoded audio signal.
+
+    The STFT, mel spectrogram and onset envelope are computed once and every
+    spectral feature is derived from them.
+
+    Args:
+        x (np.ndarray): The audio signal.
+        sr (int): The sample rate of the audio signal.
+        n_fft (int, optional): The FFT length. Defaults to `N_FFT`.
+        hop_length (int, optional): The hop length. Defaults to `HOP_LENGTH`.
+        n_samples (int, optional): The number of samples the `freqs_` statistics
+            are computed for. Defaults to the length of `x`.
+
+    Returns:
+        dict: A dictionary containing the features of the audio signal.
+    """
+    with profiler.stage("features"):
+        return _features_from_signal(x, sr, n_fft, hop_length, n_samples)
+
+
+def _features_from_signal(
+    x: np.ndarray, sr: int, n_fft: int, hop_length: int, n_samples: int
+) -> dict:
+    with profiler.stage("stft"):
+        spectra = spectral_intermediates(x, sr, n_fft, hop_length)
+    S = spectra["S"]
 
     out_vector: dict[str, float] = dict()
 
-    tempo = librosa.feature.tempo(y=x, sr=sr)[0]
-    out_vector["tempo"] = tempo
+    with profiler.stage("tempo"):
+        out_vector["tempo"] = librosa.feature.tempo(
+            onset_envelope=spectra["onset_envelope"], sr=sr
+        )[0]
 
-    rmse = np.sqrt(np.mean(x**2))
-    out_vector["rmse"] = rmse
+    out_vector["rmse"] = np.sqrt(np.mean(x**2))
 
-    freqs = describe(np.fft.fftfreq(x.size), key_prefix="freqs_")
-    for key, stat in freqs.items():
-        out_vector[key] = stat
+    out_vector |= describe_fftfreq(n_samples or x.size, key_prefix="freqs_")
 
-    zero_crossing_rate = describe(
-        librosa.feature.zero_crossing_rate(x)[0], key_prefix="zero_crossing_rate_"
-    )
-    for key, stat in zero_crossing_rate.items():
-        out_vector[key] = stat
+    # crossings per sample of a lower sample rate signal are rescaled to `SAMPLE_RATE`
+    zero_crossing_rate = librosa.feature.zero_crossing_rate(
+        x, frame_length=n_fft, hop_length=hop_length
+    )[0]
+    if sr != SAMPLE_RATE:
+        zero_crossing_rate *= sr / SAMPLE_RATE
 
-    spectral_centroids = describe(
-        librosa.feature.spectral_centroid(y=x, sr=sr)[0],
+    out_vector |= describe(zero_crossing_rate, key_prefix="zero_crossing_rate_")
+
+    out_vector |= describe(
+        librosa.feature.spectral_centroid(S=S, sr=sr)[0],
         key_prefix="spectral_centroids_",
     )
-    for key, stat in spectral_centroids.items():
-        out_vector[key] = stat
 
-    spectral_bandwidth = describe(
-        librosa.feature.spectral_bandwidth(y=x, sr=sr)[0],
+    out_vector |= describe(
+        librosa.feature.spectral_bandwidth(S=S, sr=sr)[0],
         key_prefix="spectral_bandwidth_",
     )
-    for key, stat in spectral_bandwidth.items():
-        out_vector[key] = stat
 
-    spectral_contrast = describe(
-        librosa.feature.spectral_contrast(y=x, sr=sr)[0],
+    # only the lowest band is kept, fewer bands fit below the Nyquist of a low sample rate
+    if sr < MIN_SAMPLE_RATE:
+        raise ValueError(f"Sample rate {sr} Hz is below the minimum of {MIN_SAMPLE_RATE} Hz")
+    n_bands = min(6, int(np.log2(sr / 2 / 200)))
+    out_vector |= describe(
+        librosa.feature.spectral_contrast(S=S, sr=sr, n_bands=n_bands)[0],
         key_prefix="spectral_contrast_",
     )
-    for key, stat in spectral_contrast.items():
-        out_vector[key] = stat
 
-    spectral_rolloff = describe(
-        librosa.feature.spectral_rolloff(y=x, sr=sr)[0], key_prefix="spectral_rolloff_"
+    out_vector |= describe(
+        librosa.feature.spectral_rolloff(S=S, sr=sr)[0],
+        key_prefix="spectral_rolloff_",
     )
-    for key, stat in spectral_rolloff.items():
-        out_vector[key] = stat
 
-    spectral_flatness = describe(
-        librosa.feature.spectral_flatness(y=x)[0], key_prefix="spectral_flatness_"
+    out_vector |= describe(
+        librosa.feature.spectral_flatness(S=S)[0], key_prefix="spectral_flatness_"
     )
-    for key, stat in spectral_flatness.items():
-        out_vector[key] = stat
 
-    mfcc = describe(librosa.feature.mfcc(y=x, sr=sr), key_prefix="mfcc_")
-    for key, stat in mfcc.items():
-        out_vector[key] = stat
+    out_vector |= describe(
+        librosa.feature.mfcc(S=spectra["log_mel"], sr=sr), key_prefix="mfcc_"
+    )
 
     return out_vector
 
 
+def build_feature_vector(
+    audio_path: str, verbose=False, sampling: SegmentSampling = None
+) -> dict:
+    """
+    Builds a feature vector from the given audio file.
+
+    Args:
+        audio_path (str): The path to the audio file.
+        verbose (bool, optional): Whether to print progress messages. Defaults to False.
+        sampling (SegmentSampling, optional): Only decode the segments it describes,
+            for a faster approximation of the features. Defaults to the whole track.
+
+    Returns:
+        dict: A dictionary containing the features of the audio file.
+    """
+    if verbose:
+        print(f"Calculating features of '{audio_path}'...")
+
+    if sampling is not None:
+        with profiler.stage("build_sampled_feature_vector"):
+            return _build_sampled_feature_vector(audio_path, sampling)
+
+    with profiler.stage("build_feature_vector"):
+        # decoding then resampling is what librosa.load(sr=SAMPLE_RATE) does
+        with profiler.stage("decode"):
+            x, sr = librosa.load(audio_path, sr=None)
+        profiler.count("bytes_decoded", os.path.getsize(audio_path))
+        profiler.count("samples_decoded", x.size)
+
+        with profiler.stage("resample"):
+            x = librosa.resample(x, orig_sr=sr, target_sr=SAMPLE_RATE, res_type="soxr_hq")
+        sr = SAMPLE_RATE
+        profiler.count("samples_processed", x.size)
+
+        return features_from_signal(x, sr)
+
+
+def _build_sampled_feature_vector(audio_path: str, sampling: SegmentSampling) -> dict:
+    duration = librosa.get_duration(path=audio_path)
+    offsets = sampling.offsets(duration)
+
+    # a track shorter than the segments is decoded whole
+    segments_to_decode = [(0.0, None)] if offsets is None else [
+        (offset, sampling.seconds) for offset in offsets
+    ]
+
+    segments = []
+    for offset, segment_duration in segments_to_decode:
+        with profiler.stage("decode"):
+            x, sr = librosa.load(
+                audio_path, sr=None, offset=offset, duration=segment_duration
+            )
+        profiler.count("samples_decoded", x.size)
+
+        with profiler.stage("resample"):
+            segments.append(
+                librosa.resample(x, orig_sr=sr, target_sr=sampling.sr, res_type="soxr_hq")
+            )
+
+    # segments are analysed as one signal, like the whole track would be
+    x = np.concatenate(segments)
+    profiler.count("samples_processed", x.size)
+
+    n_fft, hop_length = frame_sizes(sampling.sr)
+
+    # the `freqs_` statistics only depend on the number of samples of the whole track
+    n_samples = int(np.ceil(duration * SAMPLE_RATE))
+
+    return features_from_signal(x, sampling.sr, n_fft, hop_length, n_samples)
+
+
+def sample_rate_argument(value: str) -> int:
+    """
+    Parses a sample rate option, rejecting rates the features cannot be computed at.
+    """
+    import argparse
+
+    sr = int(value)
+    if sr < MIN_SAMPLE_RATE:
+        raise argparse.ArgumentTypeError(f"must be at least {MIN_SAMPLE_RATE} Hz, got {sr}")
+
+    return sr
+
+
+def add_sampling_arguments(parser):
+    """
+    Adds the options of the fast extraction mode to an argparse parser.
+    """
+    defaults = SegmentSampling()
+
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Only decode a few segments of each track, see --segments",
+    )
+    parser.add_argument(
+        "--segments",
+        type=float,
+        nargs="+",
+        default=defaults.positions,
+        help="Centre of each segment of --fast, as a fraction of the track duration",
+    )
+    parser.add_argument(
+        "--segment-seconds",
+        type=float,
+        default=defaults.seconds,
+        help="Length of each segment of --fast in seconds",
+    )
+    parser.add_argument(
+        "--fast-sr",
+        type=sample_rate_argument,
+        default=defaults.sr,
+        help="Sample rate of the segments of --fast",
+    )
+
+
+def sampling_from_args(args) -> SegmentSampling:
+    """
+    Gets the sampling of the options added by `add_sampling_arguments`, None without `--fast`.
+    """
+    if not args.fast:
+        return None
+
+    return SegmentSampling(args.fast_sr, tuple(args.segments), args.segment_seconds)
+
+
 if __name__ == "__main__":
     import argparse
     import pprint
@@ -113,6 +377,13 @@ if __name__ == "__main__":
         description="Extract features of a raw audio file."
     )
     parser.add_argument("audio_file", help="Path to the audio file")
+    add_sampling_arguments(parser)
+    add_profile_argument(parser)
     args = parser.parse_args()
 
-    pprint.pprint(build_feature_vector(args.audio_file, verbose=True))
+    with profile_session(args.profile):
+        pprint.pprint(
+            build_feature_vector(
+                args.audio_file, verbose=True, sampling=sampling_from_args(args)
+            )
+        )
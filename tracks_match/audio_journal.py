@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+
+import pandas as pd
+
+from audio_matrix import AudioMatrix
+
+
+class JournaledAudioMatrix(AudioMatrix):
+    """
+    AudioMatrix persisted as a CSV snapshot plus an append-only journal.
+
+    Every `set_match`/`remove_match` appends one JSON line to the journal and
+    fsyncs it, so the cost of a label does not grow with the number of labels
+    and a crash loses at most the label being written. Loading reads the
+    snapshot and replays the journal on top of it.
+
+    Once the journal holds `compact_every` records, it is moved aside and a new
+    snapshot is written in a background thread:
+
+    - `<csv>.journal`: records since the last compaction started
+    - `<csv>.journal.compacting`: records being folded into the snapshot
+
+    Both are replayed at load, so a crash at any point of a compaction is safe:
+    replaying records already in the snapshot gives the same labels.
+    """
+
+    def __init__(self, csv_path: str = "audio_matrix.csv", compact_every: int = 1000):
+        """
+        Params
+        ======
+        `csv_path`: snapshot of the labels, with `left,right,match` columns
+        `compact_every`: number of journal records that triggers a compaction
+        """
+        super().__init__()
+
+        self.csv_path = csv_path
+        self.journal_path = csv_path + ".journal"
+        self.compacting_path = self.journal_path + ".compacting"
+        self.compact_every = compact_every
+
+        self.lock = threading.Lock()
+        self.compaction: threading.Thread = None
+
+        if os.path.exists(csv_path):
+            self.from_dataframe(pd.read_csv(csv_path))
+
+        interrupted = os.path.exists(self.compacting_path)
+        if interrupted:
+            self._replay(self.compacting_path)
+        self.journal_records = self._replay(self.journal_path)
+
+        self.journal = open(self.journal_path, "a", encoding="utf-8")
+
+        if interrupted:
+            # finish the compaction a crash interrupted, the journal is kept
+            self._write_snapshot(self.to_dataframe())
+            os.remove(self.compacting_path)
+
+    def _replay(self, path: str) -> int:
+        """
+        Applies the records of a journal file and returns their number.
+
+        A last record cut by a crash is dropped from the file.
+        """
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(complete)
+
+        records = data[:complete].decode("utf-8").splitlines()
+        for record in records:
+            action, audio1, audio2, *match = json.loads(record)
+            if action == "set":
+                super().set_match(audio1, audio2, match[0])
+            else:
+                super().remove_match(audio1, audio2)
+
+        return len(records)
+
+    def _append(self, record: list):
+        self.journal.write(json.dumps(record) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+        self.journal_records += 1
+        if self.journal_records >= self.compact_every:
+            self._start_compaction()
+
+    def set_match(self, audio1, audio2, match: bool):
+        with self.lock:
+            super().set_match(audio1, audio2, match)
+            self._append(["set", audio1, audio2, bool(match)])
+
+    def remove_match(self, audio1, audio2):
+        with self.lock:
+            if self.pair_exists(audio1, audio2):
+                super().remove_match(audio1, audio2)
+                self._append(["remove", audio1, audio2])
+
+    def _write_snapshot(self, df: pd.DataFrame):
+        tmp_path = self.csv_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            df.to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.csv_path)
+
+    def _compact(self, df: pd.DataFrame):
+        self._write_snapshot(df)
+        os.remove(self.compacting_path)
+
+    def _start_compaction(self) -> threading.Thread:
+        """
+        Moves the journal aside and writes the snapshot in the background.
+
+        Must be called with the lock held. Does nothing while a compaction runs.
+        """
+        if self.compaction is not None and self.compaction.is_alive():
+            return self.compaction
+
+        self.journal.close()
+        if os.path.exists(self.compacting_path):
+            # a failed compaction left its records, keep them before the new ones
+            with open(self.journal_path, "rb") as src, open(self.compacting_path, "ab") as dst:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, self.compacting_path)
+        self.journal = open(self.journal_path, "a", encoding="utf-8")
+        self.journal_records = 0
+
+        # to_dataframe builds a new dataframe after any change, so this one is not mutated
+        self.compaction = threading.Thread(
+            target=self._compact, args=(self.to_dataframe(),), daemon=True
+        )
+        self.compaction.start()
+
+        return self.compaction
+
+    def save(self):
+        """
+        Folds the journal into the snapshot and waits for it to be written.
+        """
+        with self.lock:
+            compaction = self.compaction
+        if compaction is not None:
+            compaction.join()
+
+        with self.lock:
+            if self.journal_records > 0:
+                compaction = self._start_compaction()
+        if compaction is not None:
+            compaction.join()
+
+    def close(self):
+        self.save()
+        self.journal.close()
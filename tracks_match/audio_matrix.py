@@ -1,37 +1,150 @@
+import numpy as np
 import pandas as pd
 
 
 class AudioMatrix:
+    """
+    Symmetric yes/no labels between pairs of audio files.
+
+    Filenames are interned to integer ids and each unordered pair is packed into
+    a single int64 key `min_id << 32 | max_id`. Labels are held in two parallel
+    arrays sorted by key, so lookups are binary searches and bulk queries,
+    loading and saving are vectorized.
+    """
+
     def __init__(self):
-        self.matrix = {}
+        self.names: list[str] = []
+        self.ids: dict[str, int] = {}
+
+        self.keys = np.empty(0, dtype=np.int64)
+        self.matches = np.empty(0, dtype=bool)
+
+        self._dataframe = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _intern(self, audio) -> int:
+        audio_id = self.ids.get(audio)
+        if audio_id is None:
+            audio_id = len(self.names)
+            self.names.append(audio)
+            self.ids[audio] = audio_id
+        return audio_id
+
+    def _intern_many(self, audios) -> np.ndarray:
+        audios = pd.Index(np.asarray(audios, dtype=object))
+        audio_ids = pd.Index(self.names, dtype=object).get_indexer(audios)
+
+        for audio in pd.unique(audios[audio_ids < 0]):
+            self._intern(audio)
+
+        return pd.Index(self.names, dtype=object).get_indexer(audios).astype(np.int64)
+
+    @staticmethod
+    def _key(audio_id1, audio_id2):
+        return (np.minimum(audio_id1, audio_id2) << 32) | np.maximum(audio_id1, audio_id2)
+
+    def _keys(self, audios1, audios2) -> np.ndarray:
+        """
+        Keys of pairs of names, -1 for pairs with a name never seen.
+        """
+        names = pd.Index(self.names, dtype=object)
+        audio_ids1 = names.get_indexer(np.asarray(audios1, dtype=object)).astype(np.int64)
+        audio_ids2 = names.get_indexer(np.asarray(audios2, dtype=object)).astype(np.int64)
+
+        keys = AudioMatrix._key(audio_ids1, audio_ids2)
+        keys[(audio_ids1 < 0) | (audio_ids2 < 0)] = -1
+
+        return keys
+
+    def _position(self, key) -> int:
+        """
+        Position of `key` in the sorted keys, or -1 if it is not labelled.
+        """
+        position = np.searchsorted(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            return int(position)
+        return -1
 
     def set_match(self, audio1, audio2, match: bool):
-        pair = tuple(sorted((audio1, audio2)))
-        self.matrix[pair] = match
+        key = AudioMatrix._key(self._intern(audio1), self._intern(audio2))
+        position = np.searchsorted(self.keys, key)
+
+        if position < len(self.keys) and self.keys[position] == key:
+            self.matches[position] = bool(match)
+        else:
+            self.keys = np.insert(self.keys, position, key)
+            self.matches = np.insert(self.matches, position, bool(match))
+
+        self._dataframe = None
 
     def remove_match(self, audio1, audio2):
-        pair = tuple(sorted((audio1, audio2)))
-        if pair in self.matrix:
-            del self.matrix[pair]
+        if audio1 not in self.ids or audio2 not in self.ids:
+            return
+
+        position = self._position(AudioMatrix._key(self.ids[audio1], self.ids[audio2]))
+        if position >= 0:
+            self.keys = np.delete(self.keys, position)
+            self.matches = np.delete(self.matches, position)
+            self._dataframe = None
 
     def get_match(self, audio1, audio2):
-        pair = tuple(sorted((audio1, audio2)))
-        return self.matrix.get(pair, None)
+        if audio1 not in self.ids or audio2 not in self.ids:
+            return None
+
+        position = self._position(AudioMatrix._key(self.ids[audio1], self.ids[audio2]))
+        return bool(self.matches[position]) if position >= 0 else None
 
     def pair_exists(self, audio1, audio2):
-        pair = tuple(sorted((audio1, audio2)))
-        return pair in self.matrix
+        return self.get_match(audio1, audio2) is not None
+
+    def pairs_exist(self, audios1, audios2) -> np.ndarray:
+        """
+        Vectorized `pair_exists` over two sequences of names of the same length.
+        """
+        keys = self._keys(audios1, audios2)
+
+        if len(self.keys) == 0:
+            return np.zeros(len(keys), dtype=bool)
+
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return (keys >= 0) & (self.keys[positions] == keys)
 
     def to_dataframe(self):
-        data = []
-        for pair, match in self.matrix.items():
-            audio1, audio2 = pair
-            data.append([audio1, audio2, match])
-        return pd.DataFrame(data, columns=["left", "right", "match"])
+        if self._dataframe is None:
+            names = np.array(self.names, dtype=object)
+            left = names[self.keys >> 32]
+            right = names[self.keys & 0xFFFFFFFF]
+
+            # pairs are stored as (left, right) with left <= right
+            swap = left > right
+            left[swap], right[swap] = right[swap], left[swap]
+
+            self._dataframe = pd.DataFrame(
+                {"left": left, "right": right, "match": self.matches.copy()}
+            )
+
+        return self._dataframe
 
     def from_dataframe(self, df):
-        for _, row in df.iterrows():
-            self.set_match(row["left"], row["right"], row["match"])
+        if len(df) == 0:
+            return
+
+        left_ids = self._intern_many(df["left"].values)
+        right_ids = self._intern_many(df["right"].values)
+        keys = AudioMatrix._key(left_ids, right_ids)
+        matches = df["match"].values.astype(bool)
+
+        # like successive set_match calls, the last label of a pair wins
+        keys = np.concatenate([self.keys, keys])
+        matches = np.concatenate([self.matches, matches])
+        _, last = np.unique(keys[::-1], return_index=True)
+        last = len(keys) - 1 - last
+
+        self.keys = keys[last]
+        self.matches = matches[last]
+        self._dataframe = None
 
 
 if __name__ == "__main__":
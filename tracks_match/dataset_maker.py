@@ -1,9 +1,35 @@
+import argparse
+from collections import deque
 import pandas as pd
-from audio_matrix import AudioMatrix
+from audio_journal import JournaledAudioMatrix
+from pair_sampler import PairSampler
+from preview import PreviewCache
 import os
 import random
 import streamlit as st
 
+# arguments are given after `--`: streamlit run dataset_maker.py -- --features ../track_features.csv
+parser = argparse.ArgumentParser(description="Label pairs of tracks that mix well together.")
+parser.add_argument(
+    "--features",
+    default=None,
+    help="Features CSV built with build_dataset.py, to label close pairs first",
+)
+parser.add_argument("--seed", type=int, default=42, help="Seed of the pair order")
+parser.add_argument(
+    "--preview-start", type=float, default=60.0, help="Start of the preview clips in seconds"
+)
+parser.add_argument(
+    "--preview-length", type=float, default=20.0, help="Length of the preview clips in seconds"
+)
+parser.add_argument(
+    "--prefetch", type=int, default=3, help="Number of upcoming pairs rendered in advance"
+)
+parser.add_argument(
+    "--recent", type=int, default=10, help="Number of latest labels shown under the pair"
+)
+args, _ = parser.parse_known_args()
+
 
 def list_files_in_directory(directory):
     files = []
@@ -19,18 +45,24 @@ def get_n_random_candidates(tracklist: list[str], n: int, seed: int = 42):
     return tracklist_cpy[:n]
 
 
-def generate_key_pairs(list1, list2):
-    key_pairs = set()
-    for item1 in list1:
-        for item2 in list2:
-            key_pairs.add(tuple(sorted((item1, item2))))
-    return key_pairs
+@st.cache_resource
+def get_preview_cache(start: float, length: float):
+    return PreviewCache(start=start, length=length)
+
 
+def label(audio1: str, audio2: str, match: bool):
+    st.session_state.am.set_match(audio1, audio2, match)
+    st.session_state.recent_labels.appendleft(
+        {"left": audio1, "right": audio2, "match": match}
+    )
 
-def generate_random_order_key_pairs(list1, list2):
-    key_pairs = list(generate_key_pairs(list1, list2))
-    random.shuffle(key_pairs)
-    return key_pairs
+
+def preview(previews: PreviewCache, file_name: str):
+    try:
+        st.audio(previews.clip("./tracks/" + file_name), format="audio/ogg")
+    except Exception as e:
+        print(f"Cannot render a preview of '{file_name}': {e!r}")
+        st.audio("./tracks/" + file_name)
 
 
 if "candidates" not in st.session_state:
@@ -39,60 +71,79 @@ if "candidates" not in st.session_state:
     st.session_state["candidates"] = candidates
 
 if "am" not in st.session_state:
-    am = AudioMatrix()
-    try:
-        am.from_dataframe(pd.read_csv("audio_matrix.csv"))
-    except FileNotFoundError:
-        print("Cannot load audio_matrix.csv")
+    # every label is appended to audio_matrix.csv.journal as soon as it is given
+    st.session_state["am"] = JournaledAudioMatrix("audio_matrix.csv")
 
-    st.session_state["am"] = am
+if "recent_labels" not in st.session_state:
+    # only the labels of this session are shown, the full matrix is built on demand
+    st.session_state["recent_labels"] = deque(maxlen=args.recent)
 
 
 if "random_order_key_pairs" not in st.session_state:
-    random_order_key_pairs = generate_random_order_key_pairs(candidates, candidates)
-
-    # filter to keep only missing pairs
-    pairs = []
-    for left, right in random_order_key_pairs:
-        if left != right and not st.session_state.am.pair_exists(left, right):
-            pairs.append((left, right))
-
-    st.session_state["random_order_key_pairs"] = iter(pairs)
-
-try:
-    candidate_left, candidate_right = next(st.session_state.random_order_key_pairs)
-except StopIteration:
-    st.session_state.am.to_dataframe().to_csv("audio_matrix.csv", index=False)
+    features = pd.read_csv(args.features) if args.features else None
+
+    # labelled pairs are skipped as they are drawn
+    sampler = PairSampler(
+        st.session_state.candidates,
+        st.session_state.am,
+        seed=args.seed,
+        features=features,
+    )
+    st.session_state["random_order_key_pairs"] = iter(sampler)
+    st.session_state["upcoming_pairs"] = deque()
+
+# the current pair followed by the pairs whose previews are prefetched
+upcoming_pairs = st.session_state.upcoming_pairs
+for pair in st.session_state.random_order_key_pairs:
+    upcoming_pairs.append(pair)
+    if len(upcoming_pairs) > args.prefetch:
+        break
+
+if not upcoming_pairs:
+    st.session_state.am.save()
     st.warning("No more key pairs. Data saved to `audio_matrix.csv`")
     st.stop()
 
+candidate_left, candidate_right = upcoming_pairs.popleft()
+
+previews = get_preview_cache(args.preview_start, args.preview_length)
+
 st.write(candidate_left)
-st.audio("./tracks/" + candidate_left)
+preview(previews, candidate_left)
 st.write(candidate_right)
-st.audio("./tracks/" + candidate_right)
+preview(previews, candidate_right)
+
+previews.prefetch(
+    ["./tracks/" + file_name for pair in upcoming_pairs for file_name in pair]
+)
 
 st.header(f"is it a good match?")
 col1, col2 = st.columns(2)
 col1.button(
     "no",
-    on_click=st.session_state.am.set_match,
+    on_click=label,
     args=[candidate_left, candidate_right, False],
 )
 col2.button(
     "yes",
-    on_click=st.session_state.am.set_match,
+    on_click=label,
     args=[candidate_left, candidate_right, True],
 )
 
 st.divider()
 
-st.button(
-    "save",
-    on_click=st.session_state.am.to_dataframe().to_csv("audio_matrix.csv", index=False),
-)
+st.button("save", on_click=st.session_state.am.save)
 
-st.write(f"len(dataframe): {len(st.session_state.am.to_dataframe())}")
+st.write(f"len(dataframe): {len(st.session_state.am)}")
 
 st.dataframe(
-    st.session_state.am.to_dataframe(), use_container_width=True, hide_index=True
+    pd.DataFrame(list(st.session_state.recent_labels), columns=["left", "right", "match"]),
+    use_container_width=True,
+    hide_index=True,
 )
+
+# building the full matrix grows with the library, it is not done on every click
+if st.checkbox("show every labelled pair"):
+    st.dataframe(
+        st.session_state.am.to_dataframe(), use_container_width=True, hide_index=True
+    )
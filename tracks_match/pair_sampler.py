@@ -0,0 +1,155 @@
+import hashlib
+import heapq
+import math
+import os
+
+import pandas as pd
+
+from audio_matrix import AudioMatrix
+
+
+def num_pairs(n: int) -> int:
+    return n * (n - 1) // 2
+
+
+def triangular_pair(index: int) -> tuple[int, int]:
+    """
+    Unordered pair (i, j), i < j, of the `index`-th cell of a strict lower triangle.
+    """
+    j = (1 + math.isqrt(1 + 8 * index)) // 2
+    i = index - j * (j - 1) // 2
+    return i, j
+
+
+class LazyPermutation:
+    """
+    Seeded pseudo-random permutation of range(size), computed one element at a time.
+
+    A 4-round Feistel network is a bijection over the smallest even-bit domain
+    covering `size`; values falling outside of range(size) are mapped again until
+    they fall inside (cycle walking). Nothing of size `size` is ever allocated.
+    """
+
+    def __init__(self, size: int, seed: int = 42, rounds: int = 4):
+        self.size = size
+        self.half_bits = max(1, (max(size - 1, 1).bit_length() + 1) // 2)
+        self.mask = (1 << self.half_bits) - 1
+        self.keys = [
+            int.from_bytes(hashlib.sha256(f"{seed}:{r}".encode()).digest()[:8], "big")
+            for r in range(rounds)
+        ]
+
+    def _round(self, value: int, key: int) -> int:
+        return ((value * 0x9E3779B1) ^ key ^ (value >> 3)) * 0x85EBCA6B & self.mask
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << self.half_bits) | right
+
+    def __getitem__(self, index: int) -> int:
+        value = self._encrypt(index)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self[index]
+
+
+class PairSampler:
+    """
+    Lazily draws the unordered pairs of candidates that are not labelled yet.
+
+    Pairs come from a seeded permutation of the triangular pair indices, so the
+    full list of pairs is never built. With `features`, pairs of tracks close to
+    each other in feature space are drawn first, closest first, then the others
+    in random order.
+    """
+
+    def __init__(
+        self,
+        candidates: list[str],
+        audio_matrix: AudioMatrix,
+        seed: int = 42,
+        features: pd.DataFrame = None,
+        neighbours: int = 10,
+    ):
+        """
+        Params
+        ======
+        `candidates`: file names of the tracks to pair
+        `audio_matrix`: labels of the pairs to skip, checked when a pair is drawn
+        `seed`: seed of the random order
+        `features`: dataframe built with build_dataset.py, to prioritize close pairs
+        `neighbours`: number of nearest neighbours per track drawn first
+        """
+        self.candidates = list(candidates)
+        self.audio_matrix = audio_matrix
+        self.seed = seed
+        self.features = features
+        self.neighbours = neighbours
+
+    def _pair(self, i: int, j: int) -> tuple[str, str]:
+        return tuple(sorted((self.candidates[i], self.candidates[j])))
+
+    def _random_pairs(self):
+        for index in LazyPermutation(num_pairs(len(self.candidates)), seed=self.seed):
+            yield triangular_pair(index)
+
+    def _closest_pairs(self):
+        """
+        Pairs of each track with its nearest neighbours, by increasing feature distance.
+        """
+        from sklearn.neighbors import BallTree
+        from sklearn.preprocessing import StandardScaler
+
+        positions = {os.path.basename(name): i for i, name in enumerate(self.candidates)}
+        names = self.features.iloc[:, 0].map(lambda name: os.path.basename(str(name)))
+        rows = names.map(positions).notna().values
+
+        if rows.sum() < 2:
+            return
+
+        X = StandardScaler().fit_transform(self.features.iloc[:, 12:].values[rows])
+        candidate_positions = names[rows].map(positions).astype(int).values
+
+        k = min(self.neighbours + 1, len(X))
+        distances, indices = BallTree(X).query(X, k=k)
+
+        heap = []
+        for row in range(len(X)):
+            for distance, neighbour in zip(distances[row][1:], indices[row][1:]):
+                i, j = candidate_positions[row], candidate_positions[neighbour]
+                if i < j:
+                    heap.append((distance, i, j))
+                elif j < i:
+                    heap.append((distance, j, i))
+        heapq.heapify(heap)
+
+        while heap:
+            _, i, j = heapq.heappop(heap)
+            yield i, j
+
+    def __iter__(self):
+        seen = set()
+
+        if self.features is not None:
+            for i, j in self._closest_pairs():
+                if (i, j) in seen:
+                    continue
+                seen.add((i, j))
+
+                left, right = self._pair(i, j)
+                if left != right and not self.audio_matrix.pair_exists(left, right):
+                    yield left, right
+
+        for i, j in self._random_pairs():
+            if (i, j) in seen:
+                continue
+
+            left, right = self._pair(i, j)
+            if left != right and not self.audio_matrix.pair_exists(left, right):
+                yield left, right
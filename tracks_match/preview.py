@@ -0,0 +1,158 @@
+import os
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import librosa
+import soundfile as sf
+
+# feature_cache.py is shared with the feature pipeline at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feature_cache import file_digest
+
+DEFAULT_CACHE_DIR = os.path.expanduser("~/.cache/auto_digger/previews")
+
+
+class PreviewCache:
+    """
+    Short, low bitrate preview clips of tracks, rendered once and cached on disk.
+
+    A clip is `length` seconds of the track from `start` seconds (moved back for
+    short tracks), downmixed to mono, resampled to `sr` and encoded as Ogg Vorbis.
+    Clips are keyed by the SHA-256 of the source file and the rendering settings,
+    so a renamed track keeps its clip and an edited one gets a new clip.
+
+    Rendering runs in a thread pool: `prefetch` queues clips of upcoming tracks
+    and `clip` waits for a clip, sharing the work of a prefetch in progress.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        start: float = 60.0,
+        length: float = 20.0,
+        sr: int = 22050,
+        quality: float = 0.2,
+        workers: int = 2,
+    ):
+        """
+        Params
+        ======
+        `cache_dir`: folder of the rendered clips, created if missing
+        `start`: start of the clip in the track in seconds
+        `length`: duration of the clip in seconds
+        `sr`: sample rate of the clip
+        `quality`: Vorbis quality between 0 (smallest) and 1 (best)
+        `workers`: number of clips rendered at once
+        """
+        self.cache_dir = cache_dir
+        self.start = start
+        self.length = length
+        self.sr = sr
+        self.quality = quality
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.digests: dict[str, tuple[int, int, str]] = {}
+        self.pending: dict[str, Future] = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _digest(self, audio_path: str) -> str:
+        """
+        Digest of the source file, hashed again only when its size or mtime changes.
+        """
+        stat = os.stat(audio_path)
+        with self.lock:
+            cached = self.digests.get(audio_path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+
+        digest = file_digest(audio_path)
+        with self.lock:
+            self.digests[audio_path] = (stat.st_mtime_ns, stat.st_size, digest)
+
+        return digest
+
+    def clip_path(self, audio_path: str) -> str:
+        key = f"{self._digest(audio_path)[:32]}_{self.start:g}_{self.length:g}_{self.sr}_{self.quality:g}"
+        return os.path.join(self.cache_dir, f"{key}.ogg")
+
+    def render(self, audio_path: str, clip_path: str):
+        duration = librosa.get_duration(path=audio_path)
+        offset = max(0.0, min(self.start, duration - self.length))
+
+        y, _ = librosa.load(
+            audio_path, sr=self.sr, mono=True, offset=offset, duration=self.length
+        )
+
+        tmp_path = f"{clip_path}.{threading.get_ident()}.tmp"
+        sf.write(
+            tmp_path,
+            y,
+            self.sr,
+            format="OGG",
+            subtype="VORBIS",
+            compression_level=1.0 - self.quality,
+        )
+        os.replace(tmp_path, clip_path)
+
+    def _clip(self, audio_path: str) -> str:
+        clip_path = self.clip_path(audio_path)
+        if not os.path.exists(clip_path):
+            self.render(audio_path, clip_path)
+
+        return clip_path
+
+    def _submit(self, audio_path: str) -> Future:
+        with self.lock:
+            future = self.pending.get(audio_path)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self.executor.submit(self._clip, audio_path)
+                self.pending[audio_path] = future
+
+            return future
+
+    def clip(self, audio_path: str) -> str:
+        """
+        Path of the preview clip of a track, rendered first if it is not cached.
+        """
+        return self._submit(audio_path).result()
+
+    def prefetch(self, audio_paths: list[str]):
+        """
+        Renders the clips of tracks in the background.
+        """
+        for audio_path in audio_paths:
+            self._submit(audio_path)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Render the preview clips of a folder.")
+    parser.add_argument("tracks_folder", nargs="?", default="./tracks")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--start", type=float, default=60.0, help="Clip start in seconds")
+    parser.add_argument("--length", type=float, default=20.0, help="Clip length in seconds")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    previews = PreviewCache(
+        args.cache_dir, start=args.start, length=args.length, workers=args.workers
+    )
+    paths = [
+        os.path.join(args.tracks_folder, name)
+        for name in sorted(os.listdir(args.tracks_folder))
+    ]
+
+    start_time = time.time()
+    previews.prefetch(paths)
+    for path in paths:
+        try:
+            previews.clip(path)
+        except Exception as e:
+            print(f"Failed on '{path}': {e!r}")
+
+    print(f"rendered {len(paths)} previews in {time.time() - start_time:.2f}s")
@@ -0,0 +1,140 @@
+"""
+Memory-mapped store of siamese encoder embeddings.
+
+Every database track is embedded once per window by the encoder tower of the
+siamese model. A query is then embedded once and ranked against the whole store
+with a single vectorized distance computation instead of running the two-tower
+model for every (query, track, window) triplet.
+
+Layout of a store folder:
+
+- `embeddings.npy`: float32 array of shape (n_tracks, n_windows, embedding_dim)
+- `valid.npy`: bool array of shape (n_tracks,), False for tracks that could not be embedded
+- `meta.json`: track paths, window offsets and window length
+"""
+
+import json
+import os
+
+import numpy as np
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+VALID_FILE = 'valid.npy'
+META_FILE = 'meta.json'
+BLOCK_SIZE = 4096
+KERAS_EPSILON = 1e-7  # K.epsilon() used by the euclidean_distance layer
+
+class EmbeddingStore:
+    def __init__(self, folder: str) -> None:
+        """
+        Open an existing store, memory-mapping its embeddings read-only.
+        """
+        self.folder = folder
+
+        with open(os.path.join(folder, META_FILE)) as f:
+            meta = json.load(f)
+
+        self.paths: list[str] = meta['paths']
+        self.offsets: list[int] = meta['offsets']
+        self.window_length: int = meta['window_length']
+
+        self.embeddings = np.load(os.path.join(folder, EMBEDDINGS_FILE), mmap_mode='r')
+        self.valid = np.load(os.path.join(folder, VALID_FILE))
+
+    @staticmethod
+    def create(folder: str, paths: list[str], offsets: list[int], window_length: int, embed_tracks, batch_size: int = 32, verbose: bool = False) -> 'EmbeddingStore':
+        """
+        Embed every track once, `batch_size` tracks per call, and write the store.
+
+        Params
+        ======
+        `folder`: output folder, created if missing
+        `paths`: database tracks
+        `offsets`: start of each window in seconds
+        `window_length`: length of each window in seconds
+        `embed_tracks`: function (paths, offsets, window_length) -> array of shape (len(paths), n_windows, embedding_dim)
+        `batch_size`: number of tracks embedded per call
+        """
+        os.makedirs(folder, exist_ok=True)
+
+        embeddings = None
+        valid = np.zeros(len(paths), dtype=bool)
+
+        def embed_batch(start: int, batch_paths: list[str]):
+            try:
+                return [(start, embed_tracks(batch_paths, offsets, window_length))]
+            except Exception as e:
+                if len(batch_paths) == 1:
+                    if verbose:
+                        print(f"Cannot embed '{batch_paths[0]}': {e!r}")
+                    return []
+
+            # one track of the batch failed, the others are embedded one by one
+            return [result for i, path in enumerate(batch_paths) for result in embed_batch(start + i, [path])]
+
+        for batch_start in range(0, len(paths), batch_size):
+            for start, batch_embeddings in embed_batch(batch_start, paths[batch_start:batch_start + batch_size]):
+                if embeddings is None:
+                    embeddings = np.lib.format.open_memmap(
+                        os.path.join(folder, EMBEDDINGS_FILE),
+                        mode='w+',
+                        dtype=np.float32,
+                        shape=(len(paths), len(offsets), batch_embeddings.shape[-1]),
+                    )
+
+                embeddings[start:start + len(batch_embeddings)] = batch_embeddings
+                valid[start:start + len(batch_embeddings)] = True
+
+            if verbose:
+                print(f"embedded {min(batch_start + batch_size, len(paths))}/{len(paths)} tracks")
+
+        if embeddings is None:
+            raise Exception("No track could be embedded")
+
+        embeddings.flush()
+        del embeddings
+
+        np.save(os.path.join(folder, VALID_FILE), valid)
+        with open(os.path.join(folder, META_FILE), 'w') as f:
+            json.dump({'paths': paths, 'offsets': offsets, 'window_length': window_length}, f)
+
+        return EmbeddingStore(folder)
+
+    def distances(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """
+        Average distance between the query and every track over the windows.
+
+        Uses the same distance as the `euclidean_distance` layer of the siamese model,
+        window `i` of the query being compared to window `i` of each track.
+
+        Params
+        ======
+        `query_embeddings`: array of shape (n_windows, embedding_dim)
+
+        Returns
+        =======
+        array of shape (n_tracks,), NaN for tracks that could not be embedded
+        """
+        query = query_embeddings[np.newaxis, :, :].astype(np.float32)
+        distances = np.empty(len(self.paths), dtype=np.float32)
+
+        # blocks of tracks keep the temporary difference array small on large stores
+        for start in range(0, len(self.paths), BLOCK_SIZE):
+            diff = self.embeddings[start:start + BLOCK_SIZE] - query
+            sum_square = np.einsum('twd,twd->tw', diff, diff)
+            window_distances = np.sqrt(np.maximum(sum_square, KERAS_EPSILON))
+            distances[start:start + BLOCK_SIZE] = window_distances.mean(axis=1)
+
+        distances[~self.valid] = np.nan
+
+        return distances
+
+    def rank(self, query_embeddings: np.ndarray) -> list[tuple[str, float]]:
+        """
+        Database tracks sorted from the closest to the farthest from the query.
+        """
+        distances = self.distances(query_embeddings)
+        order = np.argsort(distances[self.valid])
+        valid_indices = np.flatnonzero(self.valid)[order]
+
+        return [(self.paths[i], float(distances[i])) for i in valid_indices]
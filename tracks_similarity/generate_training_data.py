@@ -4,14 +4,35 @@ Script to generate a training data.
 Usefull to import filtered training data to Google Collab or whatever instead of copying Gigabytes of raw audio tracks
 """
 
+from collections import OrderedDict
+import json
+import os
+import sys
+import threading
+
 import numpy as np
 import pandas as pd
 import librosa
 import joblib
 from tqdm import tqdm
 
+from tag_index import DEFAULT_INDEX_PATH, TagIndex
 from triplet_dataset import TripletDataset
 
+# profiling.py is shared with the feature pipeline at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from profiling import add_profile_argument, profile_session, profiler
+
+SPECTROGRAMS_FILE = 'spectrograms.npy'
+PAIRS_FILE = 'pairs.npy'
+LABELS_FILE = 'labels.npy'
+TRACKS_FILE = 'tracks.json'
+
+AUDIO_CACHE_SECONDS = 600 # decoded audio kept in memory, over all tracks
+
+_decoded_spans: "OrderedDict[tuple[str, int], tuple[float, np.ndarray]]" = OrderedDict()
+_decoded_spans_lock = threading.Lock()
+
 class Track:
     def __init__(self, filepath: str, sr: int = 22050) -> None:
         self.filepath = filepath
@@ -23,29 +44,149 @@ class Track:
         normalized_spectrogram = (mel_spec - min_val) / (max_val - min_val)
 
         return normalized_spectrogram
+
+    def _cached_span(self, from_sec: float, to_sec: float):
+        with _decoded_spans_lock:
+            key = (self.filepath, self.sr)
+            if key not in _decoded_spans:
+                return None
+
+            span_start, audio = _decoded_spans[key]
+            if span_start > from_sec or span_start + len(audio) / self.sr < to_sec:
+                return None
+
+            _decoded_spans.move_to_end(key)
+            return span_start, audio
+
+    def _cache_span(self, span_start: float, audio: np.ndarray):
+        with _decoded_spans_lock:
+            _decoded_spans[(self.filepath, self.sr)] = (span_start, audio)
+            _decoded_spans.move_to_end((self.filepath, self.sr))
+
+            # evict least recently used tracks, always keeping the newest one
+            max_samples = AUDIO_CACHE_SECONDS * self.sr
+            while len(_decoded_spans) > 1 and sum(len(a) for _, a in _decoded_spans.values()) > max_samples:
+                _decoded_spans.popitem(last=False)
+
+    def audio_span(self, from_sec: float, to_sec: float) -> tuple[float, np.ndarray]:
+        """
+        Decode `from_sec` to `to_sec` once, or reuse a cached decoded span covering it
+
+        Returns
+        =======
+        (start of the decoded span in seconds, decoded audio)
+        """
+        cached = self._cached_span(from_sec, to_sec)
+        if cached is not None:
+            profiler.count("span_cache_hits")
+            return cached
+
+        profiler.count("span_cache_misses")
+        # decoding then resampling is what librosa.load(sr=self.sr) does
+        with profiler.stage("decode"):
+            audio, native_sr = librosa.load(
+                self.filepath,
+                mono=True,
+                sr=None,
+                offset=from_sec,
+                duration=to_sec - from_sec
+            )
+
+        if audio is None:
+            raise Exception("Something went wrong went reading extract")
+
+        profiler.count("samples_decoded", audio.size)
+
+        with profiler.stage("resample"):
+            audio = librosa.resample(audio, orig_sr=native_sr, target_sr=self.sr, res_type="soxr_hq")
+
+        self._cache_span(from_sec, audio)
+
+        return from_sec, audio
     
     def audio_extract(self, from_sec: int, to_sec: int) -> np.ndarray:
-        audio, _ = librosa.load(
-            self.filepath,
-            mono=True,
-            sr=self.sr,
-            offset=from_sec,
-            duration=to_sec - from_sec
+        span_start, audio = self.audio_span(from_sec, to_sec)
+
+        start = int(round((from_sec - span_start) * self.sr))
+        return audio[start:start + int(round((to_sec - from_sec) * self.sr))]
+
+    def audio_windows(self, windows: list[tuple[int, int]]) -> np.ndarray:
+        """
+        Decode the span covering every window once and slice the windows from it
+
+        Params
+        ======
+        `windows`: list of (from_sec, to_sec), all of the same length
+
+        Returns
+        =======
+        array of shape (len(windows), window samples)
+        """
+        lengths = {to_sec - from_sec for from_sec, to_sec in windows}
+        if len(lengths) != 1:
+            raise Exception("Windows must all have the same length")
+
+        span_start, audio = self.audio_span(
+            min(from_sec for from_sec, _ in windows),
+            max(to_sec for _, to_sec in windows)
         )
 
-        if audio is None:
-            raise Exception("Something went wrong went reading extract")
+        num_samples = int(round(lengths.pop() * self.sr))
+        extracts = np.empty((len(windows), num_samples), dtype=audio.dtype)
+
+        for i, (from_sec, _) in enumerate(windows):
+            start = int(round((from_sec - span_start) * self.sr))
+            extract = audio[start:start + num_samples]
+
+            if len(extract) < num_samples:
+                raise Exception(f"Window starting at {from_sec}s is past the end of '{self.filepath}'")
+
+            extracts[i] = extract
 
-        return audio
+        return extracts
+
+    def spectrograms(self, windows: list[tuple[int, int]]) -> np.ndarray:
+        """
+        Normalized mel spectrograms of several windows, computed in one vectorized pass
+
+        Each window is scaled exactly like `spectrogram` does it for a single window.
+
+        Returns
+        =======
+        array of shape (len(windows), n_mels, frames)
+        """
+        with profiler.stage("spectrograms"):
+            extracts = self.audio_windows(windows)
+            profiler.count("samples_processed", extracts.size)
+
+            with profiler.stage("melspectrogram"):
+                spec = librosa.feature.melspectrogram(y=extracts, sr=self.sr, n_fft=512, hop_length=128)
+
+            with profiler.stage("normalize"):
+                # power_to_db(ref=np.max) and the min/max normalization, per window
+                amin, top_db = 1e-10, 80.0
+                spec_db = 10.0 * np.log10(np.maximum(amin, spec))
+                spec_db -= 10.0 * np.log10(np.maximum(amin, spec.max(axis=(1, 2), keepdims=True)))
+                spec_db = np.maximum(spec_db, spec_db.max(axis=(1, 2), keepdims=True) - top_db)
+
+                min_val = spec_db.min(axis=(1, 2), keepdims=True)
+                max_val = spec_db.max(axis=(1, 2), keepdims=True)
+
+                return (spec_db - min_val) / (max_val - min_val)
     
     def spectrogram(self, from_sec: int = 40, to_sec: int = 43) -> np.ndarray:
-        extract = self.audio_extract(from_sec, to_sec)
+        with profiler.stage("spectrogram"):
+            extract = self.audio_extract(from_sec, to_sec)
+            profiler.count("samples_processed", extract.size)
+
+            with profiler.stage("melspectrogram"):
+                spec = librosa.feature.melspectrogram(y=extract, sr=self.sr, n_fft=512, hop_length=128)
 
-        spec = librosa.feature.melspectrogram(y=extract, sr=self.sr, n_fft=512, hop_length=128)
-        spec_db = librosa.power_to_db(S=spec, ref=np.max)
-        spec_db_norm = Track._normalize_mel_spectrogram(spec_db)
+            with profiler.stage("normalize"):
+                spec_db = librosa.power_to_db(S=spec, ref=np.max)
+                spec_db_norm = Track._normalize_mel_spectrogram(spec_db)
 
-        return spec_db_norm
+            return spec_db_norm
 
 class TrackPair:
     def __init__(self, filepath_left: str, filepath_right: str, similar: bool) -> None:
@@ -76,15 +217,88 @@ class Dataset:
         
         return pd.DataFrame(data)
     
+    def unique_tracks(self) -> list[str]:
+        return sorted({
+            filepath
+            for track_pair in self.trackpairs
+            for filepath in (track_pair.left.filepath, track_pair.right.filepath)
+        })
+
     def as_training_data(self) -> tuple[np.ndarray, np.ndarray]:
-        pairs = []
-        labels = []
+        spectrograms = {
+            filepath: Track(filepath).spectrogram().astype(np.float32)
+            for filepath in tqdm(self.unique_tracks())
+        }
 
-        for track_pair in tqdm(self.trackpairs):
-            pairs.append([track_pair.left.spectrogram(), track_pair.right.spectrogram()])
-            labels.append(track_pair.similar)
-        
-        return np.array(pairs).astype(float), np.float32(np.array(labels))
+        pairs = np.stack([
+            [spectrograms[track_pair.left.filepath], spectrograms[track_pair.right.filepath]]
+            for track_pair in self.trackpairs
+        ])
+        labels = np.array([track_pair.similar for track_pair in self.trackpairs], dtype=np.float32)
+
+        return pairs, labels
+
+    def write_training_data(self, folder: str) -> None:
+        """
+        Write the training data without duplicating the spectrogram of any track
+
+        Spectrograms are computed once per unique track and written one by one to a
+        float32 memory-mapped file, so memory stays flat whatever the number of pairs.
+
+        Layout of `folder`:
+
+        - `spectrograms.npy`: float32 array of shape (n_tracks, n_mels, frames)
+        - `pairs.npy`: int32 array of shape (n_pairs, 2), rows of `spectrograms.npy`
+        - `labels.npy`: float32 array of shape (n_pairs,)
+        - `tracks.json`: path of the track of each row of `spectrograms.npy`
+        """
+        os.makedirs(folder, exist_ok=True)
+
+        tracks = self.unique_tracks()
+        track_index = {filepath: i for i, filepath in enumerate(tracks)}
+
+        pairs = np.array([
+            [track_index[track_pair.left.filepath], track_index[track_pair.right.filepath]]
+            for track_pair in self.trackpairs
+        ], dtype=np.int32).reshape(-1, 2)
+        labels = np.array([track_pair.similar for track_pair in self.trackpairs], dtype=np.float32)
+
+        np.save(os.path.join(folder, PAIRS_FILE), pairs)
+        np.save(os.path.join(folder, LABELS_FILE), labels)
+        with open(os.path.join(folder, TRACKS_FILE), 'w') as f:
+            json.dump(tracks, f)
+
+        spectrograms = None
+        for i, filepath in enumerate(tqdm(tracks)):
+            spec = Track(filepath).spectrogram()
+
+            if spectrograms is None:
+                spectrograms = np.lib.format.open_memmap(
+                    os.path.join(folder, SPECTROGRAMS_FILE),
+                    mode='w+',
+                    dtype=np.float32,
+                    shape=(len(tracks), *spec.shape),
+                )
+
+            spectrograms[i] = spec
+
+        if spectrograms is not None:
+            spectrograms.flush()
+
+def load_training_data(folder: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Load data written by `Dataset.write_training_data`, the spectrograms memory-mapped
+
+    Returns
+    =======
+    (spectrograms, pairs, labels). `spectrograms[pairs[i]]` is the (2, n_mels, frames)
+    input of pair `i`, equivalent to `X[i]` of `Dataset.as_training_data`
+    """
+    spectrograms = np.load(os.path.join(folder, SPECTROGRAMS_FILE), mmap_mode='r')
+    pairs = np.load(os.path.join(folder, PAIRS_FILE))
+    labels = np.load(os.path.join(folder, LABELS_FILE))
+
+    return spectrograms, pairs, labels
 
 if __name__ == "__main__":
     import argparse
@@ -95,21 +309,37 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "output",
-        help="output file"
+        help="output folder, or output file with --joblib"
     )
     parser.add_argument(
         "num_triplets",
         help="number of similar anchor per triplets"
     )
+    parser.add_argument(
+        "--joblib",
+        action="store_true",
+        help="export the full (X, y) arrays to a single compressed joblib file"
+    )
+    parser.add_argument(
+        "--tag-index",
+        default=DEFAULT_INDEX_PATH,
+        help="tag index file, only changed tracks are reread"
+    )
+    add_profile_argument(parser)
     args = parser.parse_args()
 
-    triplets = TripletDataset(args.tracks_folder, n=int(args.num_triplets))
-    dataset = Dataset(triplets)
+    with profile_session(args.profile):
+        triplets = TripletDataset(args.tracks_folder, n=int(args.num_triplets), tag_index=TagIndex(args.tag_index))
+        dataset = Dataset(triplets)
 
-    X, y = dataset.as_training_data()
+        if not args.joblib:
+            print(f"Writing {len(dataset.trackpairs)} pairs to '{args.output}'...")
+            dataset.write_training_data(args.output)
+        else:
+            X, y = dataset.as_training_data()
 
-    print(f"X.shape: {X.shape}")
-    print(f"y.shape: {y.shape}")
-    compression = 3
-    print(f"Exporting (X, y) to joblib with compression: {compression}...")
-    joblib.dump((X, y), args.output, compress=compression)
+            print(f"X.shape: {X.shape}")
+            print(f"y.shape: {y.shape}")
+            compression = 3
+            print(f"Exporting (X, y) to joblib with compression: {compression}...")
+            joblib.dump((X, y), args.output, compress=compression)
@@ -1,17 +1,24 @@
 from glob import glob
+from itertools import groupby
+import os
+import queue
+import sys
+import threading
+import numpy as np
 from tqdm import tqdm
 
-from tensorflow.keras.models import load_model
-import tensorflow.keras.backend as K
-import tensorflow as tf
-
 from generate_training_data import Track
+from embedding_store import EmbeddingStore
+
+# profiling.py is shared with the feature pipeline at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from profiling import add_profile_argument, profile_session
 
-class GlobalL2Pooling1D(tf.keras.layers.Layer):
-    def call(self, inputs):
-        return tf.sqrt(tf.reduce_sum(tf.square(inputs), axis=1))
+# TensorFlow takes seconds to import, it is only imported by the functions using it
 
 def euclidean_distance(embeddings):
+    import tensorflow.keras.backend as K
+
     x, y = embeddings
     sum_square = K.sum(K.square(x - y), axis=1, keepdims=True)
     return K.sqrt(K.maximum(sum_square, K.epsilon()))
@@ -21,60 +28,262 @@ def eucl_dist_output_shape(shapes):
     return (shape1[0], 1)
 
 def contrastive_loss(y_true, y_pred):
+    import tensorflow.keras.backend as K
+
     margin = 1.0
     square_pred = K.square(y_pred)
     margin_square = K.square(K.maximum(margin - y_pred, 0))
     return (y_true * square_pred + (1 - y_true) * margin_square)
 
-# Custom objects for loading the model
-custom_objects = {
-    'GlobalL2Pooling1D': GlobalL2Pooling1D,
-    'euclidean_distance': euclidean_distance,
-    'eucl_dist_output_shape': eucl_dist_output_shape,
-    'contrastive_loss': contrastive_loss
-}
+def get_custom_objects() -> dict:
+    """
+    Custom objects for loading the model
+    """
+    import tensorflow as tf
 
-def distance(left_path: str, right_path: str, model, from_sec: int = 40, to_sec: int = 43):
-    spec_left = Track(left_path).spectrogram(from_sec, to_sec)
-    spec_right = Track(right_path).spectrogram(from_sec, to_sec)
+    class GlobalL2Pooling1D(tf.keras.layers.Layer):
+        def call(self, inputs):
+            return tf.sqrt(tf.reduce_sum(tf.square(inputs), axis=1))
+
+    return {
+        'GlobalL2Pooling1D': GlobalL2Pooling1D,
+        'euclidean_distance': euclidean_distance,
+        'eucl_dist_output_shape': eucl_dist_output_shape,
+        'contrastive_loss': contrastive_loss
+    }
+
+def load_siamese_model(model_path: str):
+    from tensorflow.keras.models import load_model
+
+    return load_model(model_path, custom_objects=get_custom_objects())
+
+def _spectrogram_batches(pairs, input_shape, batch_size: int):
+    lefts, rights = [], []
+
+    # the query track is on one side of every pair, its last spectrograms are kept per side
+    last_specs = [None, None]
+
+    def spectrograms(side: int, track_path: str, windows: list) -> np.ndarray:
+        key = (track_path, tuple(windows))
+        if last_specs[side] is None or last_specs[side][0] != key:
+            last_specs[side] = (key, Track(track_path).spectrograms(windows))
+        return last_specs[side][1]
+
+    # consecutive windows of the same pair are decoded and transformed together
+    for (left_path, right_path), group in groupby(pairs, key=lambda pair: pair[:2]):
+        windows = [window for _, _, window in group]
+        specs_left = spectrograms(0, left_path, windows)
+        specs_right = spectrograms(1, right_path, windows)
+
+        for spec_left, spec_right in zip(specs_left, specs_right):
+            lefts.append(spec_left.T.reshape(input_shape[0], input_shape[1]))
+            rights.append(spec_right.T.reshape(input_shape[0], input_shape[1]))
+
+            if len(lefts) == batch_size:
+                yield np.stack(lefts), np.stack(rights)
+                lefts, rights = [], []
+
+    if lefts:
+        yield np.stack(lefts), np.stack(rights)
 
+def score_pairs(pairs, model, batch_size: int = 256, prefetch: int = 2) -> np.ndarray:
+    """
+    Run the siamese model on many pairs of track windows
+
+    Spectrograms are computed by a producer thread while the model scores the
+    previous batch, at most `prefetch` batches being held in memory.
+
+    Params
+    ======
+    `pairs`: iterable of (left_path, right_path, (from_sec, to_sec))
+    `model`: siamese model
+    `batch_size`: number of pairs per model call
+
+    Returns
+    =======
+    array of one score per pair, in the order of `pairs`
+    """
     input_shape = model.input_shape[0][1:]
-    spec_left_reshaped = spec_left.T.reshape(1, input_shape[0], input_shape[1])
-    spec_right_reshaped = spec_right.T.reshape(1, input_shape[0], input_shape[1])
+    batches = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # gives up when the consumer stopped, instead of blocking on a full queue
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for batch in _spectrogram_batches(pairs, input_shape, batch_size):
+                if not put(batch):
+                    return
+        except Exception as e:
+            put(e)
+        put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    scores = []
+    try:
+        while (batch := batches.get()) is not None:
+            if isinstance(batch, Exception):
+                raise batch
+
+            left, right = batch
+            scores.append(model.predict_on_batch([left, right]).ravel())
+    finally:
+        stop.set()
+        producer.join()
+
+    return np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+
+def distance(left_path: str, right_path: str, model, from_sec: int = 40, to_sec: int = 43):
+    return score_pairs([(left_path, right_path, (from_sec, to_sec))], model)[0]
+
+WINDOW_OFFSETS = list(range(60, 90, 3)) # multiple spectrograms of length 3s on this timeframe
+WINDOW_LENGTH = 3
+
+def extract_encoder(model):
+    """
+    Split the shared encoder tower out of the two-tower siamese model
+    """
+    import tensorflow as tf
+
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.Model):
+            return layer
+
+    # towers not wrapped in a sub-model: cut the graph right before the distance layer
+    distance_layer = model.layers[-1]
+    return tf.keras.Model(model.inputs[0], distance_layer.input[0])
 
-    pred = model.predict([spec_left_reshaped, spec_right_reshaped], verbose=False)
-    
-    return pred.ravel()[0]
+def embed_track(track_path: str, encoder, offsets: list[int] = WINDOW_OFFSETS, window_length: int = WINDOW_LENGTH) -> np.ndarray:
+    """
+    Embed the windows of a track in a single encoder call
+
+    Returns
+    =======
+    array of shape (len(offsets), embedding_dim)
+    """
+    return embed_tracks([track_path], encoder, offsets, window_length)[0]
+
+def embed_tracks(track_paths: list[str], encoder, offsets: list[int] = WINDOW_OFFSETS, window_length: int = WINDOW_LENGTH) -> np.ndarray:
+    """
+    Embed the windows of several tracks in a single encoder call
+
+    Returns
+    =======
+    array of shape (len(track_paths), len(offsets), embedding_dim)
+    """
+    input_shape = encoder.input_shape[1:]
+    windows = [(offset, offset + window_length) for offset in offsets]
+
+    specs = np.concatenate([Track(track_path).spectrograms(windows) for track_path in track_paths])
+    specs = np.transpose(specs, (0, 2, 1)).reshape(len(specs), input_shape[0], input_shape[1])
+
+    embeddings = encoder.predict(specs, verbose=False)
+
+    return embeddings.reshape(len(track_paths), len(windows), -1)
+
+def compare(query_path: str, database_path: str, model, batch_size: int = 256) -> dict[str, float]:
+    track_paths = glob(f"{database_path}/*")
+    windows = [(offset, offset + WINDOW_LENGTH) for offset in WINDOW_OFFSETS]
+    pairs = [(query_path, track_path, window) for track_path in track_paths for window in windows]
+
+    scores = score_pairs(tqdm(pairs), model, batch_size=batch_size)
+    average_scores = np.asarray(scores).reshape(len(track_paths), len(windows)).mean(axis=1)
+
+    return dict(zip(track_paths, average_scores))
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument(
+        "--model",
+        default='siamese_model_n2.h5',
+        help="trained siamese model"
+    )
+    add_profile_argument(parser)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    embed_parser = subparsers.add_parser("embed", help="embed every database track into an embedding store")
+    embed_parser.add_argument(
+        "database_path",
+        help="database of candidate tracks"
+    )
+    embed_parser.add_argument(
+        "store_path",
+        help="output folder of the embedding store"
+    )
+    embed_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="number of tracks per encoder call"
+    )
+
+    query_parser = subparsers.add_parser("query", help="rank the tracks of an embedding store")
+    query_parser.add_argument(
         "query_path",
         help="track path to run query from"
     )
-    parser.add_argument(
+    query_parser.add_argument(
+        "store_path",
+        help="embedding store built with the embed command"
+    )
+
+    compare_parser = subparsers.add_parser("compare", help="run the siamese model on every pair, without a store")
+    compare_parser.add_argument(
+        "query_path",
+        help="track path to run query from"
+    )
+    compare_parser.add_argument(
         "database_path",
         help="database of candidate tracks"
     )
+    compare_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="number of pairs per model call"
+    )
     args = parser.parse_args()
 
-    print("Load model...")
-    model = load_model('siamese_model_n2.h5', custom_objects=custom_objects)
-
-    print("Compare query to database...")
-    scores = {'path': [], 'score': []}
-    for track_path in tqdm(glob(f"{args.database_path}/*")):
-        average_score = 0.0
-        count = 0.0
-        for offsets in range(60, 90, 3): # multiple spectrograms of length 3s on this timeframe
-            similarity_score = distance(args.query_path, track_path, model, offsets, offsets+3)
-            average_score += similarity_score
-            count += 1.0
-
-        scores[track_path] = average_score / count
-    
-    d_view = [(v,k) for k,v in scores.items()]
-    d_view.sort(reverse=True)
-    for v, k in d_view:
-        print(f"{k}: {v}")
+    with profile_session(args.profile):
+        print("Load model...")
+        model = load_siamese_model(args.model)
+
+        if args.command == "embed":
+            encoder = extract_encoder(model)
+            EmbeddingStore.create(
+                args.store_path,
+                sorted(glob(f"{args.database_path}/*")),
+                WINDOW_OFFSETS,
+                WINDOW_LENGTH,
+                lambda paths, offsets, window_length: embed_tracks(paths, encoder, offsets, window_length),
+                batch_size=args.batch_size,
+                verbose=True,
+            )
+
+        elif args.command == "query":
+            store = EmbeddingStore(args.store_path)
+            encoder = extract_encoder(model)
+            query_embeddings = embed_track(args.query_path, encoder, store.offsets, store.window_length)
+
+            for track_path, score in reversed(store.rank(query_embeddings)):
+                print(f"{track_path}: {score}")
+
+        else:
+            print("Compare query to database...")
+            scores = compare(args.query_path, args.database_path, model, batch_size=args.batch_size)
+
+            d_view = [(v,k) for k,v in scores.items()]
+            d_view.sort(reverse=True)
+            for v, k in d_view:
+                print(f"{k}: {v}")
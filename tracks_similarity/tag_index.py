@@ -0,0 +1,146 @@
+"""
+Persistent index of the class comment ID3 tag of tracks
+
+Reading tags with mutagen is slow on network or USB storage, so parsed class
+comments are kept in a local JSON file along with the mtime and size of each
+file. A scan only reopens files that are new or changed since the last one, and
+reads them in a thread pool.
+"""
+
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+import json
+import os
+import re
+
+from mutagen.id3 import ID3, COMM
+from mutagen.mp3 import MP3
+from mutagen.aiff import AIFF
+
+DEFAULT_INDEX_PATH = os.path.expanduser("~/.cache/auto_digger/tags.json")
+INDEX_VERSION = 1
+
+CLASS_COMMENT_PATTERN = re.compile(r'^\d,[aetdfghiobr](?:;[aetdfghiobr])*$')
+
+def is_class_comment(comment: str) -> bool:
+    return bool(CLASS_COMMENT_PATTERN.match(comment))
+
+def read_class_comment(file_path: str) -> Optional[str]:
+    """
+    Read the first comment ID3 tag of a track that looks like '2,e;d'
+    """
+    id3 = None
+
+    if file_path.lower().endswith('.mp3'):
+        id3 = MP3(file_path, ID3=ID3)
+    elif file_path.lower().endswith('.aif') or file_path.lower().endswith('.aiff'):
+        id3 = AIFF(file_path)
+    else:
+        return None
+
+    if id3.tags is None:
+        return None
+
+    comms = [tag.text for tag in id3.tags.values() if isinstance(tag, COMM)]
+    for comm in comms:
+        for text in comm:
+            if is_class_comment(text):
+                return text
+
+    return None
+
+class TagIndex:
+    def __init__(self, index_path: str = DEFAULT_INDEX_PATH, workers: int = 16) -> None:
+        """
+        Params
+        ======
+        `index_path`: JSON file of the index, created on the first save
+        `workers`: number of threads reading tags during a scan
+        """
+        self.index_path = index_path
+        self.workers = workers
+        self.entries: dict[str, dict] = {}
+
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                data = json.load(f)
+
+            if data.get('version') == INDEX_VERSION:
+                self.entries = data['entries']
+
+    def save(self) -> None:
+        if os.path.dirname(self.index_path):
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _read_entry(file_path: str) -> dict:
+        stat = os.stat(file_path)
+
+        try:
+            comment = read_class_comment(file_path)
+        except Exception:
+            # unreadable tags are indexed too, so they are not retried until the file changes
+            comment = None
+
+        return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'comment': comment}
+
+    def _is_fresh(self, file_path: str) -> bool:
+        entry = self.entries.get(file_path)
+        if entry is None:
+            return False
+
+        stat = os.stat(file_path)
+        return entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size
+
+    def scan(self, file_paths: list[str]) -> dict[str, Optional[str]]:
+        """
+        Class comment of each file, reading only files that changed since the last scan
+
+        The index is saved if any file was read.
+        """
+        file_paths = [os.path.abspath(file_path) for file_path in file_paths]
+        stale = [file_path for file_path in file_paths if not self._is_fresh(file_path)]
+
+        if stale:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for file_path, entry in zip(stale, executor.map(TagIndex._read_entry, stale)):
+                    self.entries[file_path] = entry
+
+            self.save()
+
+        return {file_path: self.entries[file_path]['comment'] for file_path in file_paths}
+
+    def scan_folder(self, tracks_folder: str) -> dict[str, Optional[str]]:
+        """
+        Class comment of each file of `tracks_folder`, keyed by the path as globbed
+        """
+        track_paths = sorted(glob(f"{tracks_folder}/*"))
+        comments = self.scan(track_paths)
+
+        return {
+            track_path: comments[os.path.abspath(track_path)]
+            for track_path in track_paths
+        }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "tracks_folder",
+        help="path to folder of tracks with comment ID3 tags like '2;e;d'"
+    )
+    parser.add_argument(
+        "--index",
+        default=DEFAULT_INDEX_PATH,
+        help="tag index file"
+    )
+    args = parser.parse_args()
+
+    comments = TagIndex(args.index).scan_folder(args.tracks_folder)
+    tagged = sum(comment is not None for comment in comments.values())
+    print(f"{tagged}/{len(comments)} tracks with a class comment")
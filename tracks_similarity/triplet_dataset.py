@@ -13,108 +13,119 @@ Using this distance, we can generate triplets to train a siamese NN:
 """
 
 from typing import Optional
-from glob import glob
-import re
-
-from mutagen.id3 import ID3, COMM
-from mutagen.mp3 import MP3
-from mutagen.aiff import AIFF
 
+import numpy as np
 import pandas as pd
 
+from tag_index import DEFAULT_INDEX_PATH, TagIndex
+
+GENRES = 'aetdfghiobr'
+GENRE_BITS = {genre: 1 << i for i, genre in enumerate(GENRES)}
+POPCOUNT = np.array([bin(mask).count('1') for mask in range(1 << len(GENRES))], dtype=np.int8)
+
+BLOCK_SIZE = 1024 # anchors whose similarity rows are computed at once
+
 class TripletDataset:
-    def __init__(self, tracks_folder: str, allow_same: bool = False, n: int = 3) -> None:
+    def __init__(self, tracks_folder: str, allow_same: bool = False, n: int = 3, seed: Optional[int] = 42, tag_index: Optional[TagIndex] = None) -> None:
         """
         Params
         ======
         `tracks_folder`: folder to track with ID3 comment tagged music
         `allow_same`: allow pairs with the same track
         `n`: number of triplet per anchor
+        `seed`: seed of the random sampling of positives and negatives
+        `tag_index`: index the comment tags are read through, defaults to the one in the user cache
         """
 
-        data = {'track_path': [], 'comment': []}
-
-        for track_path in sorted(glob(f"{tracks_folder}/*")):
-            data['track_path'].append(track_path)
-            data['comment'].append(TripletDataset._find_id3_comment(track_path))
-        
-        initial_df = pd.DataFrame(data).dropna(subset='comment')
-        
-        pairs_df = pd.merge(initial_df, initial_df, how='cross', suffixes=('_left', '_right'))
-
-        if not allow_same:
-            pairs_df = pairs_df[pairs_df['track_path_left'] != pairs_df['track_path_right']]
-        
-        pairs_df['similarity_count'] = pairs_df[['comment_left', 'comment_right']].apply(
-            lambda x: TripletDataset._count_similarities(x.iloc[0], x.iloc[1]),
-            axis=1
-        )
+        if tag_index is None:
+            tag_index = TagIndex()
+
+        track_paths = []
+        comments = []
 
-        groups = pairs_df.groupby('track_path_left')
+        for track_path, comment in tag_index.scan_folder(tracks_folder).items():
+            if comment is not None:
+                track_paths.append(track_path)
+                comments.append(comment)
 
-        self.df = groups[pairs_df.columns].apply(
-            TripletDataset._generate_triplets,
+        energies, genre_masks = TripletDataset._encode_comments(comments)
+
+        self.df = TripletDataset._generate_all_triplets(
+            np.array(track_paths, dtype=object),
+            energies,
+            genre_masks,
+            allow_same=allow_same,
             n=n,
-        ).reset_index(drop=True)
-
-    def _find_id3_comment(file_path) -> Optional[str]:
-        id3 = None
-
-        if file_path.lower().endswith('.mp3'):
-            id3 = MP3(file_path, ID3=ID3)
-        elif file_path.lower().endswith('.aif') or file_path.lower().endswith('.aiff'):
-            id3 = AIFF(file_path)
-        else:
-            return None
-        
-        comms = [tag.text for tag in id3.tags.values() if isinstance(tag, COMM)]
-        for comm in comms:
-            for text in comm:
-                if TripletDataset._is_class_comment(text):
-                    return text
-
-        return None
-    
-    def _is_class_comment(comment: str) -> bool:
-        class_comment_pattern = r'^\d,[aetdfghiobr](?:;[aetdfghiobr])*$'
-
-        return bool(re.match(class_comment_pattern, comment))
-
-    def _count_similarities(comment_a: str, comment_b: str) -> bool:
-        energy_str_a, genres_str_a = comment_a.split(",")
-        genres_a = genres_str_a.split(";")
-
-        energy_str_b, genres_str_b = comment_b.split(",")
-        genres_b = genres_str_b.split(";")
-
-        count = 0
-
-        if energy_str_a == energy_str_b:
-            count += 1
-        
-        for genre_a in genres_a:
-            if genre_a in genres_b:
-                count += 1
-
-        return count
-    
-    def _generate_triplets(group, n: int) -> pd.Series:
+            rng=np.random.default_rng(seed),
+        )
+
+    def _encode_comments(comments: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Encode class comments like '2,e;d' into an energy array and a genre bitmask array
+        """
+        energies = np.empty(len(comments), dtype=np.int16)
+        genre_masks = np.zeros(len(comments), dtype=np.int16)
+
+        for i, comment in enumerate(comments):
+            energy_str, genres_str = comment.split(",")
+            energies[i] = int(energy_str)
+            for genre in genres_str.split(";"):
+                genre_masks[i] |= GENRE_BITS[genre]
+
+        return energies, genre_masks
+
+    def _similarity_counts(energies: np.ndarray, genre_masks: np.ndarray, rows: slice) -> np.ndarray:
+        """
+        Similarity of the anchors in `rows` to every track: 1 for the same energy plus 1 per shared genre
+
+        Returns
+        =======
+        array of shape (number of anchors in `rows`, number of tracks)
+        """
+        same_energy = energies[rows, np.newaxis] == energies[np.newaxis, :]
+        shared_genres = POPCOUNT[genre_masks[rows, np.newaxis] & genre_masks[np.newaxis, :]]
+
+        return same_energy + shared_genres
+
+    def _generate_all_triplets(track_paths: np.ndarray, energies: np.ndarray, genre_masks: np.ndarray, allow_same: bool, n: int, rng: np.random.Generator) -> pd.DataFrame:
+        """
+        Sample `n` triplets per anchor
+
+        Positives are drawn among the tracks whose similarity is one of the `n` largest
+        similarities of the anchor, negatives among the `n` smallest ones.
+        """
+        num_tracks = len(track_paths)
         triplets = []
-        for _ in range(n):
-            anchor = group['track_path_left'].iloc[0]
-            
-            # Positive tracks: randomly select from best candidates
-            max_similarity = group['similarity_count'].nlargest(n)
-            positive_tracks = group[group['similarity_count'].isin(max_similarity)]
-            positive_track = positive_tracks.sample(n=1)['track_path_right'].iloc[0]
-            
-            # Negative tracks: randomly select from worst candidates
-            min_similarity = group['similarity_count'].nsmallest(n)
-            negative_tracks = group[group['similarity_count'].isin(min_similarity)]
-            negative_track = negative_tracks.sample(n=1)['track_path_right'].iloc[0]
-            
-            triplets.append([anchor, positive_track, negative_track])
-        
+
+        for start in range(0, num_tracks, BLOCK_SIZE):
+            rows = slice(start, min(start + BLOCK_SIZE, num_tracks))
+            counts = TripletDataset._similarity_counts(energies, genre_masks, rows).astype(np.int16)
+
+            # push the anchor itself out of the candidate sets
+            top_counts = counts.copy()
+            bottom_counts = counts.copy()
+            if not allow_same:
+                anchors = np.arange(rows.start, rows.stop)
+                top_counts[anchors - rows.start, anchors] = -1
+                bottom_counts[anchors - rows.start, anchors] = np.iinfo(np.int16).max
+
+            num_candidates = num_tracks if allow_same else num_tracks - 1
+            if num_candidates == 0:
+                break
+            k = min(n, num_candidates)
+
+            # a track is a candidate when its similarity is one of the k largest (smallest) ones
+            top_threshold = -np.partition(-top_counts, k - 1, axis=1)[:, k - 1]
+            bottom_threshold = np.partition(bottom_counts, k - 1, axis=1)[:, k - 1]
+
+            for i in range(rows.stop - rows.start):
+                positives = np.flatnonzero(top_counts[i] >= top_threshold[i])
+                negatives = np.flatnonzero(bottom_counts[i] <= bottom_threshold[i])
+
+                anchor = track_paths[rows.start + i]
+                for positive, negative in zip(rng.choice(positives, n), rng.choice(negatives, n)):
+                    triplets.append([anchor, track_paths[positive], track_paths[negative]])
+
         return pd.DataFrame(triplets, columns=['anchor', 'positive', 'negative'])
 
 if __name__ == "__main__":
@@ -124,7 +135,12 @@ if __name__ == "__main__":
         "tracks_folder",
         help="path to folder of tracks with comment ID3 tags like '2;e;d'"
     )
+    parser.add_argument(
+        "--tag-index",
+        default=DEFAULT_INDEX_PATH,
+        help="tag index file, only changed tracks are reread"
+    )
     args = parser.parse_args()
 
-    dataset = TripletDataset(args.tracks_folder)
+    dataset = TripletDataset(args.tracks_folder, tag_index=TagIndex(args.tag_index))
     print(dataset.df)